@@ -0,0 +1,164 @@
+import functools
+import importlib
+import torch
+from basicsr.archs import stylegan2_arch
+from basicsr.ops import fused_act
+from basicsr.ops.fused_act import fused_leaky_relu as ext_fused_leaky_relu
+from basicsr.ops.upfirdn2d import upfirdn2d as ext_upfirdn2d
+from torch import nn
+from torch.nn import functional as F
+
+
+@functools.lru_cache(maxsize=None)
+def has_extension(name):
+    """Whether the compiled extension of a basicsr op is loaded. Option: fused_act | upfirdn2d."""
+    module = importlib.import_module(f'basicsr.ops.{name}.{name}')
+    return hasattr(module, f'{name}_ext')
+
+
+def fused_leaky_relu(input, bias=None, negative_slope=0.2, scale=2**0.5):
+    """Bias, leaky ReLU and scale, as ``basicsr.ops.fused_act.fused_leaky_relu``.
+
+    The compiled CUDA kernel of basicsr is used for cuda tensors when it is loaded. Otherwise, the op runs with native
+    PyTorch ops, on any device. Without autograd, the activation and the scale are applied in place to the biased
+    tensor, so that it allocates a single output.
+
+    Args:
+        input (Tensor): Input with shape (b, c, ...).
+        bias (Tensor | None): Bias with shape (c, ). Default: None.
+        negative_slope (float): Negative slope of the leaky ReLU. Default: 0.2.
+        scale (float): Output scale. Default: 2**0.5.
+    """
+    if input.is_cuda and bias is not None and has_extension('fused_act'):
+        return ext_fused_leaky_relu(input, bias, negative_slope, scale)
+    if bias is None:
+        return F.leaky_relu(input, negative_slope) * scale
+    out = input + bias.view(1, -1, *[1] * (input.ndim - 2))
+    if torch.is_grad_enabled() and out.requires_grad:
+        return F.leaky_relu(out, negative_slope) * scale
+    return F.leaky_relu_(out, negative_slope).mul_(scale)
+
+
+class FusedLeakyReLU(nn.Module):
+    """Leaky ReLU with a learnable bias, as ``basicsr.ops.fused_act.FusedLeakyReLU``, with the same parameters.
+
+    Args:
+        channel (int): Channel number of the input.
+        negative_slope (float): Negative slope of the leaky ReLU. Default: 0.2.
+        scale (float): Output scale. Default: 2**0.5.
+    """
+
+    def __init__(self, channel, negative_slope=0.2, scale=2**0.5):
+        super(FusedLeakyReLU, self).__init__()
+        self.bias = nn.Parameter(torch.zeros(channel))
+        self.negative_slope = negative_slope
+        self.scale = scale
+
+    def forward(self, input):
+        return fused_leaky_relu(input, self.bias, self.negative_slope, self.scale)
+
+
+def _upfirdn2d_depthwise(input, kernel, up, down, pad):
+    """Upsample (zero insertion), pad, FIR filter and downsample each channel, with a depthwise convolution.
+
+    Args:
+        input (Tensor): Input with shape (b, c, h, w).
+        kernel (Tensor): The FIR kernel with shape (kh, kw). It is convolved, i.e., flipped.
+        up (tuple[int]): The (y, x) upsampling factors.
+        down (tuple[int]): The (y, x) downsampling factors.
+        pad (tuple[int]): The (y0, y1, x0, x1) padding, after the upsampling. Negative values crop.
+    """
+    c, h, w = input.shape[1:]
+    kernel_h, kernel_w = kernel.shape
+    up_y, up_x = up
+    pad_y0, pad_y1, pad_x0, pad_x1 = pad
+    weight = kernel.to(input).expand(c, 1, kernel_h, kernel_w).contiguous()
+    if up_y == 1 and up_x == 1:
+        out = F.pad(input, [pad_x0, pad_x1, pad_y0, pad_y1])
+        return F.conv2d(out, torch.flip(weight, [2, 3]), stride=down, groups=c)
+    # the transposed convolution is the convolution of the zero-inserted input (full size), without the products of
+    # the inserted zeros. Crop (or pad) it to the padded window of upfirdn.
+    out = F.conv_transpose2d(input, weight, stride=up, groups=c)
+    out_h = h * up_y + pad_y0 + pad_y1 - kernel_h + 1
+    out_w = w * up_x + pad_x0 + pad_x1 - kernel_w + 1
+    start_y, start_x = kernel_h - 1 - pad_y0, kernel_w - 1 - pad_x0
+    out = F.pad(out, [-start_x, start_x + out_w - out.shape[3], -start_y, start_y + out_h - out.shape[2]])
+    return out[:, :, ::down[0], ::down[1]]
+
+
+def upfirdn2d(input, kernel, up=1, down=1, pad=(0, 0)):
+    """Upsample, FIR filter and downsample, as ``basicsr.ops.upfirdn2d.upfirdn2d``.
+
+    The compiled CUDA kernel of basicsr is used for cuda tensors when it is loaded. Otherwise, the kernel is applied
+    to all the channels at once as a depthwise convolution, and the upsampling as a depthwise transposed convolution.
+    The native op of basicsr instead reshapes the input to a single channel and convolves the zero-inserted input.
+    The resampling kernels are separable, but a single 2D pass is faster on cpu than a horizontal and a vertical one,
+    as the op is bound by the memory traffic.
+
+    Args:
+        input (Tensor): Input with shape (b, c, h, w).
+        kernel (Tensor): The FIR kernel with shape (kh, kw).
+        up (int): Upsampling factor. Default: 1.
+        down (int): Downsampling factor. Default: 1.
+        pad (tuple[int]): The (start, end) padding of both dimensions, after the upsampling. Default: (0, 0).
+    """
+    if input.is_cuda and has_extension('upfirdn2d'):
+        return ext_upfirdn2d(input, kernel, up=up, down=down, pad=pad)
+    return _upfirdn2d_depthwise(input, kernel, (up, up), (down, down), (pad[0], pad[1], pad[0], pad[1]))
+
+
+class UpFirDnUpsample(stylegan2_arch.UpFirDnUpsample):
+    """``basicsr.archs.stylegan2_arch.UpFirDnUpsample``, with the upfirdn2d of this file."""
+
+    def forward(self, x):
+        return upfirdn2d(x, self.kernel.type_as(x), up=self.factor, down=1, pad=self.pad)
+
+
+class UpFirDnDownsample(stylegan2_arch.UpFirDnDownsample):
+    """``basicsr.archs.stylegan2_arch.UpFirDnDownsample``, with the upfirdn2d of this file."""
+
+    def forward(self, x):
+        return upfirdn2d(x, self.kernel.type_as(x), up=1, down=self.factor, pad=self.pad)
+
+
+class UpFirDnSmooth(stylegan2_arch.UpFirDnSmooth):
+    """``basicsr.archs.stylegan2_arch.UpFirDnSmooth``, with the upfirdn2d of this file."""
+
+    def forward(self, x):
+        return upfirdn2d(x, self.kernel.type_as(x), up=1, down=1, pad=self.pad)
+
+
+class EqualLinear(stylegan2_arch.EqualLinear):
+    """``basicsr.archs.stylegan2_arch.EqualLinear``, with the fused_leaky_relu of this file."""
+
+    def forward(self, x):
+        bias = None if self.bias is None else self.bias * self.lr_mul
+        if self.activation == 'fused_lrelu':
+            return fused_leaky_relu(F.linear(x, self.weight * self.scale), bias)
+        return F.linear(x, self.weight * self.scale, bias=bias)
+
+
+# the basicsr layers whose forward calls the basicsr ops, and their versions with the ops of this file
+NATIVE_LAYERS = {
+    fused_act.FusedLeakyReLU: FusedLeakyReLU,
+    stylegan2_arch.UpFirDnUpsample: UpFirDnUpsample,
+    stylegan2_arch.UpFirDnDownsample: UpFirDnDownsample,
+    stylegan2_arch.UpFirDnSmooth: UpFirDnSmooth,
+    stylegan2_arch.EqualLinear: EqualLinear,
+}
+
+
+def use_native_ops(net):
+    """Make the basicsr layers of a network (e.g., of basicsr.archs.stylegan2_arch) use the ops of this file, in place.
+
+    The layers keep their attributes, parameters and buffers: only their class is changed to the version in this file,
+    so that they run without the compiled extensions. Other networks, and basicsr itself, are not affected.
+
+    Returns:
+        nn.Module: The network.
+    """
+    for module in net.modules():
+        native_layer = NATIVE_LAYERS.get(type(module))
+        if native_layer is not None:
+            module.__class__ = native_layer
+    return net
@@ -283,7 +283,7 @@ class GFPGANBilinear(nn.Module):
         feat = self.final_conv(feat)
 
         # style code
-        style_code = self.final_linear(feat.view(feat.size(0), -1))
+        style_code = self.final_linear(feat.reshape(feat.size(0), -1))
         if self.different_w:
             style_code = style_code.view(style_code.size(0), -1, self.num_style_feat)
 
@@ -3,11 +3,12 @@ import random
 import torch
 from basicsr.archs.stylegan2_arch import (ConvLayer, EqualConv2d, EqualLinear, ResBlock, ScaledLeakyReLU,
                                           StyleGAN2Generator)
-from basicsr.ops.fused_act import FusedLeakyReLU
 from basicsr.utils.registry import ARCH_REGISTRY
 from torch import nn
 from torch.nn import functional as F
 
+from .fused_ops import FusedLeakyReLU, use_native_ops
+
 
 class StyleGAN2GeneratorSFT(StyleGAN2Generator):
     """StyleGAN2 Generator with SFT modulation (Spatial Feature Transform).
@@ -42,6 +43,8 @@ class StyleGAN2GeneratorSFT(StyleGAN2Generator):
             lr_mlp=lr_mlp,
             narrow=narrow)
         self.sft_half = sft_half
+        # the StyleGAN2 layers of basicsr run without its compiled extensions, e.g., on cpu
+        use_native_ops(self)
 
     def forward(self,
                 styles,
@@ -208,6 +211,7 @@ class ResUpBlock(nn.Module):
         self.conv1 = ConvLayer(in_channels, in_channels, 3, bias=True, activate=True)
         self.conv2 = ConvUpLayer(in_channels, out_channels, 3, stride=1, padding=1, bias=True, activate=True)
         self.skip = ConvUpLayer(in_channels, out_channels, 1, bias=False, activate=False)
+        use_native_ops(self)
 
     def forward(self, x):
         out = self.conv1(x)
@@ -349,6 +353,8 @@ class GFPGANv1(nn.Module):
                     EqualConv2d(out_channels, out_channels, 3, stride=1, padding=1, bias=True, bias_init_val=0),
                     ScaledLeakyReLU(0.2),
                     EqualConv2d(out_channels, sft_out_channels, 3, stride=1, padding=1, bias=True, bias_init_val=0)))
+        # the U-Net layers of basicsr run without its compiled extensions, e.g., on cpu
+        use_native_ops(self)
 
     def forward(self, x, return_latents=False, return_rgb=True, randomize_noise=True, **kwargs):
         """Forward function for GFPGANv1.
@@ -372,7 +378,7 @@ class GFPGANv1(nn.Module):
         feat = self.final_conv(feat)
 
         # style code
-        style_code = self.final_linear(feat.view(feat.size(0), -1))
+        style_code = self.final_linear(feat.reshape(feat.size(0), -1))
         if self.different_w:
             style_code = style_code.view(style_code.size(0), -1, self.num_style_feat)
 
@@ -415,6 +421,7 @@ class FacialComponentDiscriminator(nn.Module):
         self.conv4 = ConvLayer(128, 256, 3, downsample=True, resample_kernel=(1, 3, 3, 1), bias=True, activate=True)
         self.conv5 = ConvLayer(256, 256, 3, downsample=False, resample_kernel=(1, 3, 3, 1), bias=True, activate=True)
         self.final_conv = ConvLayer(256, 1, 3, bias=True, activate=False)
+        use_native_ops(self)
 
     def forward(self, x, return_feats=False, **kwargs):
         """Forward function for FacialComponentDiscriminator.
@@ -5,7 +5,7 @@ from basicsr.utils.registry import ARCH_REGISTRY
 from torch import nn
 from torch.nn import functional as F
 
-from .stylegan2_clean_arch import StyleGAN2GeneratorClean
+from .stylegan2_clean_arch import StyleGAN2GeneratorClean, upsample_conv2d, use_fused_upsample
 
 
 class StyleGAN2GeneratorCSFT(StyleGAN2GeneratorClean):
@@ -120,6 +120,9 @@ class StyleGAN2GeneratorCSFT(StyleGAN2GeneratorClean):
 class ResBlock(nn.Module):
     """Residual block with bilinear upsampling/downsampling.
 
+    In the up mode, the upsampling and conv2 are fused by upsample_conv2d, as selected by ``fused_upsample``. The skip
+    convolution (1x1) is then run before the upsampling, with which it commutes, on 4 times fewer pixels.
+
     Args:
         in_channels (int): Channel number of the input.
         out_channels (int): Channel number of the output.
@@ -136,8 +139,18 @@ class ResBlock(nn.Module):
             self.scale_factor = 0.5
         elif mode == 'up':
             self.scale_factor = 2
+        self.fused_upsample = None
 
     def forward(self, x):
+        b, _, h, w = x.shape
+        # not for the quantized convolutions
+        if (self.scale_factor == 2 and isinstance(self.conv2, nn.Conv2d)
+                and use_fused_upsample(self, b * h * w, self.conv2.out_channels)):
+            out = F.leaky_relu_(self.conv1(x), negative_slope=0.2)
+            out = F.leaky_relu_(upsample_conv2d(out, self.conv2.weight, self.conv2.bias), negative_slope=0.2)
+            skip = F.interpolate(self.skip(x), scale_factor=2, mode='bilinear', align_corners=False)
+            return out + skip
+
         out = F.leaky_relu_(self.conv1(x), negative_slope=0.2)
         # upsample/downsample
         out = F.interpolate(out, scale_factor=self.scale_factor, mode='bilinear', align_corners=False)
@@ -274,15 +287,86 @@ class GFPGANv1Clean(nn.Module):
                     nn.Conv2d(out_channels, out_channels, 3, 1, 1), nn.LeakyReLU(0.2, True),
                     nn.Conv2d(out_channels, sft_out_channels, 3, 1, 1)))
 
+    def strip_for_inference(self):
+        """Delete the submodules that the restored image does not use, once the weights are loaded.
+
+        The intermediate rgb images (toRGB) are only used by the training losses, and the style MLP of the decoder is
+        not used with input_is_latent. Afterwards, the network only runs with return_rgb=False, and its state dict
+        no longer has their weights.
+        """
+        self.toRGB = None
+        if self.input_is_latent:
+            self.stylegan_decoder.style_mlp = None
+        return self
+
+    def inference(self, x, randomize_noise=True):
+        """Restored images only, without autograd, with less memory than forward.
+
+        The U-Net decoder and the StyleGAN2 decoder run level by level: the SFT conditions of a level are consumed
+        as soon as they are computed, in place, instead of cloning and keeping the conditions of all the levels, and
+        each U-Net skip feature is freed once it is added. The output is the same as forward.
+
+        Args:
+            x (Tensor): Input images.
+            randomize_noise (bool): Randomize noise, used when 'noise' is False. Default: True.
+        """
+        decoder = self.stylegan_decoder
+        unet_skips = []
+
+        # encoder
+        feat = F.leaky_relu_(self.conv_body_first(x), negative_slope=0.2)
+        for i in range(self.log_size - 2):
+            feat = self.conv_body_down[i](feat)
+            unet_skips.append(feat)
+        feat = F.leaky_relu_(self.final_conv(feat), negative_slope=0.2)
+
+        # style code
+        style_code = self.final_linear(feat.reshape(feat.size(0), -1))
+        if self.different_w:
+            style_code = style_code.view(style_code.size(0), -1, self.num_style_feat)
+        # as in the decoder forward: the style MLP runs on the reshaped style code
+        if not self.input_is_latent:
+            style_code = decoder.style_mlp(style_code)
+        if self.different_w:
+            latent = style_code
+        else:
+            latent = style_code.unsqueeze(1).repeat(1, decoder.num_latent, 1)
+        if randomize_noise:
+            noise = [None] * decoder.num_layers
+        else:  # use the stored noise
+            noise = [getattr(decoder.noises, f'noise{i}') for i in range(decoder.num_layers)]
+
+        out = decoder.constant_input(latent.shape[0])
+        out = decoder.style_conv1(out, latent[:, 0], noise=noise[0])
+        skip = decoder.to_rgb1(out, latent[:, 1])
+        for i in range(self.log_size - 2):
+            # ResUpLayer, with the unet skip
+            feat = self.conv_body_up[i](feat + unet_skips.pop())
+            # StyleConv with the SFT conditions of this level
+            j = 2 * i + 1
+            out = decoder.style_convs[j - 1](out, latent[:, j], noise=noise[j])
+            out_sft = out[:, out.size(1) // 2:] if decoder.sft_half else out
+            out_sft.mul_(self.condition_scale[i](feat)).add_(self.condition_shift[i](feat))
+            out = decoder.style_convs[j](out, latent[:, j + 1], noise=noise[j + 1])
+            skip = decoder.to_rgbs[i](out, latent[:, j + 2], skip)
+        return skip
+
     def forward(self, x, return_latents=False, return_rgb=True, randomize_noise=True, **kwargs):
         """Forward function for GFPGANv1Clean.
 
+        Without autograd, in eval mode, and without intermediate rgb images and latents, it runs inference (but not
+        in ONNX export, which does not support the in-place ops on the channel slices of the SFT).
+
         Args:
             x (Tensor): Input images.
             return_latents (bool): Whether to return style latents. Default: False.
             return_rgb (bool): Whether return intermediate rgb images. Default: True.
             randomize_noise (bool): Randomize noise, used when 'noise' is False. Default: True.
         """
+        if not (self.training or return_rgb or return_latents or torch.is_grad_enabled()
+                or torch.onnx.is_in_onnx_export()):
+            return self.inference(x, randomize_noise=randomize_noise), []
+
         conditions = []
         unet_skips = []
         out_rgbs = []
@@ -295,7 +379,7 @@ class GFPGANv1Clean(nn.Module):
         feat = F.leaky_relu_(self.final_conv(feat), negative_slope=0.2)
 
         # style code
-        style_code = self.final_linear(feat.view(feat.size(0), -1))
+        style_code = self.final_linear(feat.reshape(feat.size(0), -1))
         if self.different_w:
             style_code = style_code.view(style_code.size(0), -1, self.num_style_feat)
 
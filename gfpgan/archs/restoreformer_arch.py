@@ -36,23 +36,33 @@ class VectorQuantizer(nn.Module):
         quantization pipeline:
             1. get encoder input (B,C,H,W)
             2. flatten input to (B*H*W,C)
+
+        In eval mode, only z_q and the indices are computed: the loss, the perplexity, the one-hot encodings and the
+        distances are None.
         """
+        # keep the memory format of the input (e.g., channels_last) for the output
+        if z.is_contiguous(memory_format=torch.channels_last):
+            memory_format = torch.channels_last
+        else:
+            memory_format = torch.contiguous_format
         # reshape z -> (batch, height, width, channel) and flatten
         z = z.permute(0, 2, 3, 1).contiguous()
         z_flattened = z.view(-1, self.e_dim)
-        # distances from z to embeddings e_j (z - e)^2 = z^2 + e^2 - 2 e * z
 
+        if not self.training:
+            # find closest encodings, and get the quantized latent vectors by their indices
+            min_encoding_indices = self.nearest_indices(z_flattened)
+            z_q = self.embedding(min_encoding_indices).view(z.shape)
+            z_q = z_q.permute(0, 3, 1, 2).contiguous(memory_format=memory_format)
+            return z_q, None, (None, None, min_encoding_indices.unsqueeze(1), None)
+
+        # distances from z to embeddings e_j (z - e)^2 = z^2 + e^2 - 2 e * z
         d = torch.sum(z_flattened ** 2, dim=1, keepdim=True) + \
             torch.sum(self.embedding.weight**2, dim=1) - 2 * \
             torch.matmul(z_flattened, self.embedding.weight.t())
 
-        # could possible replace this here
-        # #\start...
         # find closest encodings
-
-        min_value, min_encoding_indices = torch.min(d, dim=1)
-
-        min_encoding_indices = min_encoding_indices.unsqueeze(1)
+        min_encoding_indices = torch.argmin(d, dim=1).unsqueeze(1)
 
         min_encodings = torch.zeros(min_encoding_indices.shape[0], self.n_e).to(z)
         min_encodings.scatter_(1, min_encoding_indices, 1)
@@ -62,14 +72,7 @@ class VectorQuantizer(nn.Module):
         # min_encoding_indices.shape: torch.Size([2048, 1])
 
         # get quantized latent vectors
-        z_q = torch.matmul(min_encodings, self.embedding.weight).view(z.shape)
-        # .........\end
-
-        # with:
-        # .........\start
-        # min_encoding_indices = torch.argmin(d, dim=1)
-        # z_q = self.embedding(min_encoding_indices)
-        # ......\end......... (TODO)
+        z_q = self.embedding(min_encoding_indices.squeeze(1)).view(z.shape)
 
         # compute loss for embedding
         loss = torch.mean((z_q.detach() - z)**2) + self.beta * torch.mean((z_q - z.detach())**2)
@@ -83,18 +86,29 @@ class VectorQuantizer(nn.Module):
         perplexity = torch.exp(-torch.sum(e_mean * torch.log(e_mean + 1e-10)))
 
         # reshape back to match original input shape
-        z_q = z_q.permute(0, 3, 1, 2).contiguous()
+        z_q = z_q.permute(0, 3, 1, 2).contiguous(memory_format=memory_format)
 
         return z_q, loss, (perplexity, min_encodings, min_encoding_indices, d)
 
+    def nearest_indices(self, z_flattened, chunk_size=4096):
+        """Index of the closest embedding of each row of z_flattened (N, e_dim).
+
+        The distances are computed for chunk_size rows at a time, so that the (N, n_e) distance matrix is never
+        allocated at once.
+        """
+        e_sq = torch.sum(self.embedding.weight**2, dim=1)
+        indices = []
+        # a single chunk is not split, which ONNX export does not support
+        chunks = z_flattened.split(chunk_size) if z_flattened.size(0) > chunk_size else [z_flattened]
+        for chunk in chunks:
+            d = torch.sum(chunk**2, dim=1, keepdim=True) + e_sq - 2 * torch.matmul(chunk, self.embedding.weight.t())
+            indices.append(torch.argmin(d, dim=1))
+        return torch.cat(indices)
+
     def get_codebook_entry(self, indices, shape):
         # shape specifying (batch, height, width, channel)
-        # TODO: check for more easy handling with nn.Embedding
-        min_encodings = torch.zeros(indices.shape[0], self.n_e).to(indices)
-        min_encodings.scatter_(1, indices[:, None], 1)
-
         # get quantized latent vectors
-        z_q = torch.matmul(min_encodings.float(), self.embedding.weight)
+        z_q = self.embedding(indices)
 
         if shape is not None:
             z_q = z_q.view(shape)
@@ -213,42 +227,34 @@ class MultiHeadAttnBlock(nn.Module):
         self.num = 0
 
     def forward(self, x, y=None):
-        h_ = x
-        h_ = self.norm1(h_)
+        # channels_last features, so that the channels of a pixel (the heads) are contiguous after the 1x1 convs
+        h_ = self.norm1(x).contiguous(memory_format=torch.channels_last)
         if y is None:
             y = h_
         else:
-            y = self.norm2(y)
+            y = self.norm2(y).contiguous(memory_format=torch.channels_last)
 
         q = self.q(y)
         k = self.k(h_)
         v = self.v(h_)
 
-        # compute attention
+        # compute attention, with the heads as a batch dimension: (b, head, hw, att), with contiguous att as the
+        # fused kernels need. It is a view of the channels_last features.
         b, c, h, w = q.shape
-        q = q.reshape(b, self.head_size, self.att_size, h * w)
-        q = q.permute(0, 3, 1, 2)  # b, hw, head, att
-
-        k = k.reshape(b, self.head_size, self.att_size, h * w)
-        k = k.permute(0, 3, 1, 2)
-
-        v = v.reshape(b, self.head_size, self.att_size, h * w)
-        v = v.permute(0, 3, 1, 2)
-
-        q = q.transpose(1, 2)
-        v = v.transpose(1, 2)
-        k = k.transpose(1, 2).transpose(2, 3)
-
-        scale = int(self.att_size)**(-0.5)
-        q.mul_(scale)
-        w_ = torch.matmul(q, k)
-        w_ = F.softmax(w_, dim=3)
-
-        w_ = w_.matmul(v)
+        q, k, v = [
+            t.permute(0, 2, 3, 1).contiguous().view(b, h * w, self.head_size, self.att_size).transpose(1, 2)
+            for t in (q, k, v)
+        ]
+
+        if hasattr(F, 'scaled_dot_product_attention'):  # PyTorch >= 2.0
+            # fused, without the (hw, hw) attention matrix of each head on the flash or memory-efficient kernels
+            w_ = F.scaled_dot_product_attention(q, k, v)
+        else:
+            w_ = F.softmax(torch.matmul(q * int(self.att_size)**(-0.5), k.transpose(2, 3)), dim=3)
+            w_ = w_.matmul(v)
 
-        w_ = w_.transpose(1, 2).contiguous()  # [b, h*w, head, att]
-        w_ = w_.view(b, h, w, -1)
-        w_ = w_.permute(0, 3, 1, 2)
+        # (b, head, hw, att) -> (b, c, h, w), channels_last
+        w_ = w_.transpose(1, 2).reshape(b, h, w, c).permute(0, 3, 1, 2)
 
         w_ = self.proj_out(w_)
 
@@ -1,11 +1,12 @@
 import math
 import random
 import torch
-from basicsr.ops.fused_act import FusedLeakyReLU, fused_leaky_relu
 from basicsr.utils.registry import ARCH_REGISTRY
 from torch import nn
 from torch.nn import functional as F
 
+from .fused_ops import FusedLeakyReLU, fused_leaky_relu
+
 
 class NormStyleCode(nn.Module):
 
@@ -145,10 +146,14 @@ class ModulatedConv2d(nn.Module):
             x = F.interpolate(x, scale_factor=0.5, mode=self.interpolation_mode, align_corners=self.align_corners)
 
         b, c, h, w = x.shape
-        x = x.view(1, b * c, h, w)
-        # weight: (b*c_out, c_in, k, k), groups=b
-        out = F.conv2d(x, weight, padding=self.padding, groups=b)
-        out = out.view(b, self.out_channels, *out.shape[2:4])
+        if b == 1:
+            # a plain conv, which also keeps the memory format of x (e.g., channels_last)
+            out = F.conv2d(x, weight, padding=self.padding)
+        else:
+            x = x.reshape(1, b * c, h, w)
+            # weight: (b*c_out, c_in, k, k), groups=b
+            out = F.conv2d(x, weight, padding=self.padding, groups=b)
+            out = out.view(b, self.out_channels, *out.shape[2:4])
 
         return out
 
@@ -266,7 +271,8 @@ class ConstantInput(nn.Module):
         self.weight = nn.Parameter(torch.randn(1, num_channel, size, size))
 
     def forward(self, batch):
-        out = self.weight.repeat(batch, 1, 1, 1)
+        # clone keeps the memory format of the weight (e.g., channels_last), unlike repeat
+        out = self.weight.expand(batch, -1, -1, -1).clone()
         return out
 
 
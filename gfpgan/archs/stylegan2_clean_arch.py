@@ -21,11 +21,84 @@ class NormStyleCode(nn.Module):
         return x * torch.rsqrt(torch.mean(x**2, dim=1, keepdim=True) + 1e-8)
 
 
+# the weight of x[i + d - 1] in the position 2i + p + k - 1 of x upsampled by 2 (bilinear, align_corners=False), for
+# the phase p, the tap k of a 3x3 convolution on the upsampled tensor, and the tap d of its phase convolution on x
+UPSAMPLE_PHASES = (
+    ((0.75, 0.25, 0), (0.25, 0.75, 0), (0, 0.75, 0.25)),
+    ((0.25, 0.75, 0), (0, 0.75, 0.25), (0, 0.25, 0.75)),
+)
+
+
+def upsample_conv2d(x, weight, bias=None, groups=1):
+    """Bilinear upsampling by 2 (align_corners=False) then a 3x3 convolution (padding 1), without the upsampled tensor.
+
+    Each of the 4 phases of the output (its even and odd rows and columns) is a 3x3 convolution of x, whose weight is
+    the convolution weight combined with the bilinear weights. The phases are computed by a single convolution of x
+    (edge padded, as the bilinear upsampling) and interleaved. The border of the upsampled tensor is zero padded in
+    the convolution, so that its contribution is removed from the output border.
+
+    Args:
+        x (Tensor): Input with shape (n, groups * c_in, h, w).
+        weight (Tensor): Weight with shape (groups * c_out, c_in, 3, 3).
+        bias (Tensor | None): Bias with shape (groups * c_out, ). Default: None.
+        groups (int): Number of groups of the convolution. Default: 1.
+
+    Returns:
+        Tensor: Output with shape (n, groups * c_out, 2h, 2w), as
+            ``F.conv2d(F.interpolate(x, scale_factor=2, mode='bilinear'), weight, bias, padding=1, groups=groups)``.
+    """
+    c_out, c_in = weight.shape[0:2]
+    phases = torch.tensor(UPSAMPLE_PHASES, dtype=weight.dtype, device=weight.device)
+    phase_weight = torch.einsum('pkd,qle,ockl->opqcde', phases, phases, weight).reshape(c_out * 4, c_in, 3, 3)
+    phase_bias = None if bias is None else bias.repeat_interleave(4)
+    out = F.conv2d(F.pad(x, [1, 1, 1, 1], mode='replicate'), phase_weight, phase_bias, groups=groups)
+    out = F.pixel_shuffle(out, 2)
+
+    # the border rows and columns of the upsampled tensor, without the corners for the columns
+    top = F.interpolate(x[:, :, :1], scale_factor=(1, 2), mode='bilinear', align_corners=False)
+    bottom = F.interpolate(x[:, :, -1:], scale_factor=(1, 2), mode='bilinear', align_corners=False)
+    left = F.interpolate(x[:, :, :, :1], scale_factor=(2, 1), mode='bilinear', align_corners=False)
+    right = F.interpolate(x[:, :, :, -1:], scale_factor=(2, 1), mode='bilinear', align_corners=False)
+    out[:, :, :1] -= F.conv2d(F.pad(top, [1, 1, 0, 0], mode='replicate'), weight[:, :, :1], groups=groups)
+    out[:, :, -1:] -= F.conv2d(F.pad(bottom, [1, 1, 0, 0], mode='replicate'), weight[:, :, 2:], groups=groups)
+    out[:, :, :, :1] -= F.conv2d(F.pad(left, [0, 0, 1, 1]), weight[:, :, :, :1], groups=groups)
+    out[:, :, :, -1:] -= F.conv2d(F.pad(right, [0, 0, 1, 1]), weight[:, :, :, 2:], groups=groups)
+    return out
+
+
+def use_fused_upsample(module, num_pixels, out_channels):
+    """Whether a module runs its bilinear upsampling and 3x3 convolution with upsample_conv2d.
+
+    ``module.fused_upsample`` forces it (True | False). By default (None), it is used in eval mode, when the
+    upsampled tensor that it saves is larger than the phase weight that it builds, i.e., at high resolution. It is
+    never used in ONNX export, which does not support convolutions with the weights built in the graph.
+
+    Args:
+        module (nn.Module): The module, with a ``fused_upsample`` attribute.
+        num_pixels (int): Number of pixels of the input batch before the upsampling (b * h * w).
+        out_channels (int): Channel number of the output.
+    """
+    if torch.onnx.is_in_onnx_export():
+        return False
+    if module.fused_upsample is not None:
+        return module.fused_upsample
+    return not module.training and num_pixels >= 9 * out_channels
+
+
 class ModulatedConv2d(nn.Module):
     """Modulated Conv2d used in StyleGAN2.
 
     There is no bias in ModulatedConv2d.
 
+    The weight is modulated by the style of each sample, and the samples of a batch are convolved by a grouped
+    convolution. When the weight is large against the features (the low resolution layers), building a weight per
+    sample dominates the cost. A batch is then run with a fused modulation instead: the input is scaled by the style,
+    convolved with the shared weight, and the output is scaled by the demodulation, which is computed from the squared
+    weight and style. Both are the same up to the float rounding. ``fused_modulation`` (None: chosen by the batch
+    size and the feature size; True | False to force it) selects the implementation.
+
+    The upsampling and the 3x3 convolution are fused by upsample_conv2d, as selected by ``fused_upsample``.
+
     Args:
         in_channels (int): Channel number of the input.
         out_channels (int): Channel number of the output.
@@ -61,6 +134,16 @@ class ModulatedConv2d(nn.Module):
             torch.randn(1, out_channels, in_channels, kernel_size, kernel_size) /
             math.sqrt(in_channels * kernel_size**2))
         self.padding = kernel_size // 2
+        self.fused_modulation = None
+        self.fused_upsample = None
+
+    def use_fused_modulation(self, b, h, w):
+        """Whether to run a batch with the fused modulation, for its size and the spatial size of the features."""
+        if self.fused_modulation is not None:
+            return self.fused_modulation
+        # a weight per sample (grouped conv), against a scale of the input and of the output (fused modulation)
+        weight_size = self.out_channels * self.in_channels * self.kernel_size**2
+        return b > 1 and 2 * weight_size >= (self.in_channels + self.out_channels) * h * w
 
     def forward(self, x, style):
         """Forward function.
@@ -73,6 +156,11 @@ class ModulatedConv2d(nn.Module):
             Tensor: Modulated tensor after convolution.
         """
         b, c, h, w = x.shape  # c = c_in
+        fused_upsample = (
+            self.sample_mode == 'upsample' and self.kernel_size == 3
+            and use_fused_upsample(self, b * h * w, self.out_channels))
+        if self.use_fused_modulation(b, h, w):
+            return self._fused_forward(x, self.modulation(style), fused_upsample)
         # weight modulation
         style = self.modulation(style).view(b, 1, c, 1, 1)
         # self.weight: (1, c_out, c_in, k, k); style: (b, 1, c, 1, 1)
@@ -85,17 +173,44 @@ class ModulatedConv2d(nn.Module):
         weight = weight.view(b * self.out_channels, c, self.kernel_size, self.kernel_size)
 
         # upsample or downsample if necessary
-        if self.sample_mode == 'upsample':
+        if self.sample_mode == 'upsample' and not fused_upsample:
             x = F.interpolate(x, scale_factor=2, mode='bilinear', align_corners=False)
         elif self.sample_mode == 'downsample':
             x = F.interpolate(x, scale_factor=0.5, mode='bilinear', align_corners=False)
 
         b, c, h, w = x.shape
-        x = x.view(1, b * c, h, w)
-        # weight: (b*c_out, c_in, k, k), groups=b
-        out = F.conv2d(x, weight, padding=self.padding, groups=b)
-        out = out.view(b, self.out_channels, *out.shape[2:4])
+        if b == 1:
+            # a plain conv, which also keeps the memory format of x (e.g., channels_last)
+            out = upsample_conv2d(x, weight) if fused_upsample else F.conv2d(x, weight, padding=self.padding)
+        else:
+            x = x.reshape(1, b * c, h, w)
+            # weight: (b*c_out, c_in, k, k), groups=b
+            if fused_upsample:
+                out = upsample_conv2d(x, weight, groups=b)
+            else:
+                out = F.conv2d(x, weight, padding=self.padding, groups=b)
+            out = out.view(b, self.out_channels, *out.shape[2:4])
+
+        return out
 
+    def _fused_forward(self, x, style, fused_upsample=False):
+        """Modulate the input and demodulate the output of a convolution with the shared weight."""
+        b, c = style.shape
+        weight = self.weight[0]  # (c_out, c_in, k, k)
+        # scaled before the upsampling, on the smaller tensor
+        x = x * style.view(b, c, 1, 1)
+        if fused_upsample:
+            out = upsample_conv2d(x, weight)
+        else:
+            if self.sample_mode == 'upsample':
+                x = F.interpolate(x, scale_factor=2, mode='bilinear', align_corners=False)
+            elif self.sample_mode == 'downsample':
+                x = F.interpolate(x, scale_factor=0.5, mode='bilinear', align_corners=False)
+            out = F.conv2d(x, weight, padding=self.padding)
+        if self.demodulate:
+            # sum over (c_in, k, k) of (weight * style)**2, without the weight per sample
+            demod = torch.rsqrt(style.pow(2) @ weight.pow(2).sum([2, 3]).t() + self.eps)
+            out = out * demod.view(b, self.out_channels, 1, 1)
         return out
 
     def __repr__(self):
@@ -187,7 +302,8 @@ class ConstantInput(nn.Module):
         self.weight = nn.Parameter(torch.randn(1, num_channel, size, size))
 
     def forward(self, batch):
-        out = self.weight.repeat(batch, 1, 1, 1)
+        # clone keeps the memory format of the weight (e.g., channels_last), unlike repeat
+        out = self.weight.expand(batch, -1, -1, -1).clone()
         return out
 
 
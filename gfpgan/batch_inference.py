@@ -0,0 +1,339 @@
+import argparse
+import cv2
+import json
+import multiprocessing
+import os
+import sys
+import time
+import torch
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from tqdm import tqdm
+
+from gfpgan.bundle import build_bg_upsampler, is_bundle_file
+from gfpgan.face_triage import FaceTriage
+from gfpgan.profiling import StageProfiler
+from gfpgan.utils import GFPGANer
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+REALESRGAN_X2_URL = 'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth'
+
+# the options and the restorer of a worker process
+_args = None
+_restorer = None
+
+
+def _is_under(path, root):
+    root = os.path.abspath(root)
+    return os.path.commonpath([root, os.path.abspath(path)]) == root
+
+
+def _relative_path(path, input_root):
+    if not _is_under(path, input_root):
+        raise ValueError(f'{path} is not under the input root {input_root}. Set --input_root to a folder of all the '
+                         'inputs.')
+    return os.path.relpath(path, input_root)
+
+
+def scan_inputs(input_path, input_root=None):
+    """Yield the (path, relative path) of the input images, from a folder (recursively) or a file list.
+
+    Args:
+        input_path (str): A folder, or a text file with one image path per line.
+        input_root (str | None): The root of the relative paths. The inputs must be under it, otherwise a ValueError
+            is raised. Default: None (the input folder, or the folder of the file list).
+    """
+    if os.path.isdir(input_path):
+        input_root = input_path if input_root is None else input_root
+        for root, dirs, files in os.walk(input_path):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in IMG_EXTENSIONS:
+                    path = os.path.join(root, name)
+                    yield path, _relative_path(path, input_root)
+    else:
+        list_dir = os.path.dirname(os.path.abspath(input_path))
+        input_root = list_dir if input_root is None else input_root
+        with open(input_path, 'r') as f:
+            for line in f:
+                path = line.strip()
+                if not path:
+                    continue
+                path = os.path.join(list_dir, path)  # relative to the file list
+                yield path, _relative_path(path, input_root)
+
+
+def output_path(rel_path, output_dir, ext):
+    """The output path of an input, in output_dir. A ValueError is raised if the path is not in output_dir."""
+    stem, input_ext = os.path.splitext(rel_path)
+    save_path = os.path.join(output_dir, stem + (input_ext.lower() if ext == 'auto' else f'.{ext}'))
+    if not _is_under(save_path, output_dir) or os.path.abspath(save_path) == os.path.abspath(output_dir):
+        raise ValueError(f'The output path of {rel_path} is not in the output folder {output_dir}.')
+    return save_path
+
+
+def _is_bundle_file(path):
+    return path is not None and os.path.isfile(path) and is_bundle_file(path)
+
+
+def build_restorer(args):
+    """Build the GFPGANer of the options, in a worker process."""
+    device = torch.device(args.device)
+    bg_upsampler = None
+    if args.bg_upsampler == 'realesrgan':
+        bg_model_path = args.bg_model_path
+        if bg_model_path is None and _is_bundle_file(args.model_path):
+            bg_model_path = args.model_path
+        if _is_bundle_file(bg_model_path):
+            # mapped from the bundle, shared by the workers
+            bg_upsampler = build_bg_upsampler(bg_model_path, tile=args.bg_tile, device=device)
+        else:
+            from basicsr.archs.rrdbnet_arch import RRDBNet
+            from realesrgan import RealESRGANer
+            model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2)
+            bg_upsampler = RealESRGANer(
+                scale=2,
+                model_path=REALESRGAN_X2_URL if bg_model_path is None else bg_model_path,
+                model=model,
+                tile=args.bg_tile,
+                tile_pad=10,
+                pre_pad=0,
+                half=False,
+                device=device)
+
+    face_triage = None
+    if any(v is not None for v in (args.min_face_size, args.max_face_size, args.sharpness_threshold)):
+        face_triage = FaceTriage(args.min_face_size, args.max_face_size, args.sharpness_threshold)
+    return GFPGANer(
+        model_path=args.model_path,
+        upscale=args.upscale,
+        arch=args.arch,
+        channel_multiplier=args.channel_multiplier,
+        bg_upsampler=bg_upsampler,
+        device=device,
+        face_batch_size=args.face_batch_size,
+        precision=args.precision,
+        precision_psnr=args.precision_psnr,
+        jit_trace=args.jit_trace,
+        backend=args.backend,
+        channels_last=args.channels_last,
+        face_triage=face_triage,
+        mask_mode=args.mask_mode,
+        randomize_noise=not args.fixed_noise,
+        profiler=StageProfiler(device=device))
+
+
+def _init_worker(args):
+    global _args, _restorer
+    _args = args
+    torch.set_num_threads(args.threads)
+    cv2.setNumThreads(args.threads)
+    # an error breaks the pool, which fails the submitted images and stops the run
+    _restorer = build_restorer(args)
+
+
+def _process(task):
+    """Restore one image in a worker process, and return its log record."""
+    input_path, save_path = task
+    args = _args
+    record = dict(input=input_path, output=save_path, pid=os.getpid())
+    start = time.perf_counter()
+    try:
+        img = cv2.imread(input_path, cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError('cannot read the image')
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        # write to a temporary file, so that a crash does not leave a partial output that would be skipped
+        tmp_path = f'{os.path.splitext(save_path)[0]}.{os.getpid()}.tmp{os.path.splitext(save_path)[1]}'
+        if args.strip_height is not None and save_path.lower().endswith('.png'):
+            _restorer.enhance_to_file(
+                img,
+                tmp_path,
+                only_center_face=args.only_center_face,
+                weight=args.weight,
+                det_max_side=args.det_max_side,
+                strip_height=args.strip_height)
+        else:
+            _, _, output = _restorer.enhance(
+                img,
+                only_center_face=args.only_center_face,
+                paste_back=True,
+                weight=args.weight,
+                det_max_side=args.det_max_side)
+            if not cv2.imwrite(tmp_path, output):
+                raise ValueError(f'cannot write {tmp_path}')
+        os.replace(tmp_path, save_path)
+        stage_times = {stage: round(total['wall_time'], 4) for stage, total in _restorer.profiler.summary().items()}
+        record.update(
+            status='ok',
+            faces=len(_restorer.face_helper.cropped_faces),
+            skipped_faces=len(_restorer.skipped_faces),
+            downgrades=_restorer.downgrades,
+            stages=stage_times)
+    except Exception as error:
+        record.update(status='error', error=f'{type(error).__name__}: {error}')
+    record['time'] = round(time.perf_counter() - start, 4)
+    return record
+
+
+def _error_record(task, error):
+    """The log record of a task that did not return one, e.g., when its worker process died."""
+    return dict(input=task[0], output=task[1], status='error', error=f'{type(error).__name__}: {error}')
+
+
+def _tasks(args, counts):
+    for input_path, rel_path in scan_inputs(args.input, args.input_root):
+        save_path = output_path(rel_path, args.output, args.ext)
+        if os.path.exists(save_path) and not args.overwrite:
+            counts['skipped'] += 1
+            continue
+        yield input_path, save_path
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Restore the faces of a folder tree or a file list of images, with several worker processes.')
+    parser.add_argument('-i', '--input', type=str, required=True, help='Input folder, or text file of image paths')
+    parser.add_argument('-o', '--output', type=str, required=True, help='Output folder, with the input tree')
+    parser.add_argument('--input_root', type=str, default=None, help='Root of the output tree. Default: the input')
+    parser.add_argument('--ext', type=str, default='auto', help='Output extension. auto: same as the input')
+    parser.add_argument('--overwrite', action='store_true', help='Restore the images whose output exists')
+    parser.add_argument('--log', type=str, default=None, help='JSONL log. Default: <output>/batch_log.jsonl')
+    # processes
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--threads', type=int, default=None, help='Torch threads per worker. Default: cpus/workers')
+    parser.add_argument(
+        '--max_pending', type=int, default=None, help='Maximum number of submitted images. Default: 4 x workers')
+    parser.add_argument('--device', type=str, default='cpu')
+    # GFPGANer
+    parser.add_argument(
+        '--model_path',
+        type=str,
+        default='experiments/pretrained_models/GFPGANv1.4.pth',
+        help='GFPGAN model, or a bundle from scripts/pack_bundle.py, whose weights are shared by the workers')
+    parser.add_argument('--arch', type=str, default='clean', choices=['clean', 'original', 'bilinear', 'RestoreFormer'])
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('-s', '--upscale', type=float, default=2)
+    parser.add_argument('--bg_upsampler', type=str, default='none', choices=['none', 'realesrgan'])
+    parser.add_argument('--bg_model_path', type=str, default=None, help='RealESRGAN x2 model or bundle')
+    parser.add_argument('--bg_tile', type=int, default=400, help='Tile size of the bg upsampler, 0 for no tile')
+    parser.add_argument('--face_batch_size', type=int, default=1)
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16_autocast', 'bf16', 'int8'])
+    parser.add_argument('--precision_psnr', type=float, default=35.)
+    parser.add_argument('--jit_trace', action='store_true')
+    parser.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnxruntime'])
+    parser.add_argument('--channels_last', action='store_true')
+    parser.add_argument('--mask_mode', type=str, default='parse', choices=['parse', 'ellipse', 'square'])
+    parser.add_argument('--fixed_noise', action='store_true', help='Reproducible outputs with the fixed noise')
+    parser.add_argument('--min_face_size', type=float, default=None, help='Face triage: skip smaller faces')
+    parser.add_argument('--max_face_size', type=float, default=None, help='Face triage: skip larger faces')
+    parser.add_argument('--sharpness_threshold', type=float, default=None, help='Face triage: skip sharp faces')
+    # enhance
+    parser.add_argument('--only_center_face', action='store_true')
+    parser.add_argument('--weight', type=float, default=0.5)
+    parser.add_argument('--det_max_side', type=int, default=None, help='Detect the faces on a downscaled copy')
+    parser.add_argument('--strip_height', type=int, default=None, help='Write the png outputs strip by strip')
+    args = parser.parse_args(argv)
+    if args.threads is None:
+        args.threads = max(1, (os.cpu_count() or 1) // args.workers)
+    if args.max_pending is None:
+        args.max_pending = 4 * args.workers
+    if args.log is None:
+        args.log = os.path.join(args.output, 'batch_log.jsonl')
+    return args
+
+
+def check_args(args):
+    """Check the paths of the options before the workers start, without loading the models.
+
+    Raises:
+        ValueError: If the input or a model file does not exist, or the device is wrong.
+    """
+    if not os.path.exists(args.input):
+        raise ValueError(f'The input {args.input} does not exist.')
+    for name in ('model_path', 'bg_model_path'):
+        path = getattr(args, name)
+        if path is not None and not path.startswith('https://') and not os.path.isfile(path):
+            raise ValueError(f'The {name} {path} does not exist.')
+    try:
+        torch.device(args.device)
+    except RuntimeError as error:
+        raise ValueError(f'Wrong device {args.device}: {error}')
+
+
+def main(argv=None):
+    """Restore a folder tree or a file list of images.
+
+    The images are sharded over the worker processes, each with its own GFPGANer. With a memory-mapped bundle as
+    model_path, all the workers share the same physical pages of the weights. The outputs that exist are skipped, so
+    that an interrupted run resumes where it stopped. Each image gets a JSON line in the log, with its status, number
+    of faces, time and the time of each stage.
+
+    The input tree is scanned as the images are restored, with at most max_pending images submitted to the workers,
+    so that the memory does not grow with the number of images. The options are checked before the workers start.
+    If a worker process dies (e.g., killed when out of memory, or its restorer cannot be built), the images it was
+    given and the other pending ones are logged as errors, and the run stops: it resumes with the next run.
+    """
+    args = parse_args(argv)
+    try:
+        check_args(args)
+    except ValueError as error:
+        print(error)
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(args.log)), exist_ok=True)
+    counts = dict(ok=0, error=0, skipped=0)
+    start = time.perf_counter()
+    broken = False
+    # spawn: fork does not mix well with the threads of torch
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(args.workers, mp_context=context, initializer=_init_worker, initargs=(args, )) as pool, \
+            open(args.log, 'a') as log_file, tqdm(unit='img', dynamic_ncols=True) as pbar:
+
+        def log_record(record):
+            counts[record['status']] += 1
+            log_file.write(json.dumps(record) + '\n')
+            log_file.flush()
+            pbar.set_postfix(counts, refresh=False)
+            pbar.update(1)
+
+        def log_done(futures):
+            """Log the records of done futures. Return whether the pool is broken."""
+            is_broken = False
+            for future in futures:
+                task = pending.pop(future)
+                try:
+                    record = future.result()
+                except BrokenProcessPool as error:
+                    is_broken = True
+                    record = _error_record(task, error)
+                except Exception as error:
+                    record = _error_record(task, error)
+                log_record(record)
+            return is_broken
+
+        pending = {}
+        for task in _tasks(args, counts):
+            if len(pending) >= args.max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                broken = log_done(done)
+                if broken:
+                    break
+            try:
+                pending[pool.submit(_process, task)] = task
+            except BrokenProcessPool as error:
+                log_record(_error_record(task, error))
+                broken = True
+                break
+        # in the submission order. The futures of a broken pool are all done, with BrokenProcessPool
+        broken = log_done(list(pending)) or broken
+    elapsed = time.perf_counter() - start
+    if broken:
+        print('A worker process died: its images and the pending ones are logged as errors. Run again to resume.')
+    print(f'Done in {elapsed:.1f} s: {counts["ok"]} restored, {counts["error"]} failed, '
+          f'{counts["skipped"]} skipped (existing outputs). Log: {args.log}')
+    return 0 if counts['error'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
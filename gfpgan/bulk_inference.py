@@ -0,0 +1,237 @@
+import argparse
+import cv2
+import lmdb
+import numpy as np
+import os
+import sys
+import tarfile
+import time
+import torch
+from basicsr.utils.lmdb_util import LmdbMaker
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+from gfpgan.utils import GFPGANer
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def read_lmdb(lmdb_path):
+    """Yield the (key, encoded image) records of an LMDB, in the order of its meta_info.txt.
+
+    The LMDB is in the format of basicsr (e.g., made by ``scripts/data_preparation/create_lmdb.py`` of basicsr), as
+    read by FFHQDegradationDataset. The values are read from the memory-mapped database, without a file per image.
+    """
+    with open(os.path.join(lmdb_path, 'meta_info.txt')) as fin:
+        keys = [os.path.splitext(line.split(' ')[0])[0] for line in fin if line.strip()]
+    env = lmdb.open(lmdb_path, readonly=True, lock=False, readahead=False)
+    try:
+        with env.begin(write=False) as txn:
+            for key in keys:
+                value = txn.get(key.encode('ascii'))
+                yield key, None if value is None else bytes(value)
+    finally:
+        env.close()
+
+
+def read_tar(tar_path):
+    """Yield the (key, encoded image) records of a tar shard, streamed in the order of its members.
+
+    The key of an image is its member name without the extension. Compressed shards (.tar.gz, ...) are supported.
+    """
+    with tarfile.open(tar_path, 'r|*') as tar:
+        for member in tar:
+            stem, ext = os.path.splitext(member.name)
+            if member.isfile() and ext.lower() in IMG_EXTENSIONS:
+                yield stem, tar.extractfile(member).read()
+
+
+def read_records(input_paths):
+    """Yield the records of LMDBs (folders ending with .lmdb) and tar shards, one input after the other."""
+    for input_path in input_paths:
+        if input_path.rstrip('/\\').endswith('.lmdb'):
+            yield from read_lmdb(input_path)
+        else:
+            yield from read_tar(input_path)
+
+
+def decode_face(record, face_size=512):
+    """Decode a record to a (key, BGR face) pair. The face is resized to face_size, and None if it cannot be read."""
+    key, data = record
+    face = None if data is None else cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if face is not None and face.shape[0:2] != (face_size, face_size):
+        face = cv2.resize(face, (face_size, face_size), interpolation=cv2.INTER_LINEAR)
+    return key, face
+
+
+def encode_face(face, compress_level=1):
+    """Encode a face to png bytes, as the images of basicsr LMDBs."""
+    _, img_byte = cv2.imencode('.png', face, [cv2.IMWRITE_PNG_COMPRESSION, compress_level])
+    return img_byte.tobytes()
+
+
+def prefetch(items, func, num_threads=4, depth=64):
+    """Yield func(item) for the items, in order, computed ahead by a thread pool.
+
+    At most depth results are computed ahead, which bounds the memory of the prefetched items. cv2 releases the GIL,
+    so that decoding runs in parallel with the forward of the network.
+    """
+    with ThreadPoolExecutor(num_threads) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def batches(items, batch_size):
+    """Group the items in lists of batch_size (the last one can be shorter)."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bulk_restore(restorer, records, put, batch_size=32, weight=0.5, num_threads=4, compress_level=1, pbar=None):
+    """Restore a stream of aligned faces in batches, and write the restored faces in the order of the records.
+
+    The records are decoded ahead of the forward by a thread pool, and the restored faces of a batch are encoded by
+    another one while the next batch is restored. The faces are restored with ``GFPGANer.restore_faces``, without the
+    face helper (no detection, alignment or paste back).
+
+    Args:
+        restorer (GFPGANer): The restorer, whose face_batch_size is the forward batch size.
+        records (iterable[tuple]): The (key, encoded image) records, e.g., from read_records.
+        put (callable): Called with (img_byte, key, img_shape) for each restored face, as ``LmdbMaker.put``.
+        batch_size (int): Number of faces decoded and restored together. Default: 32.
+        weight (float): Weight of the SFT features (for the original arch). Default: 0.5.
+        num_threads (int): Number of threads of the decoding and of the encoding. Default: 4.
+        compress_level (int): Png compress level of the restored faces. Default: 1.
+        pbar (tqdm | None): Progress bar, updated with the number of restored faces. Default: None.
+
+    Returns:
+        dict: The number of restored faces (ok), and of the records that cannot be decoded or restored (error). The
+            faces that are not restored (``GFPGANer.failed_faces``) are not written.
+    """
+    counts = dict(ok=0, error=0)
+    pending = []  # the encoding restored faces of the previous batch
+
+    def write_pending():
+        for key, shape, future in pending:
+            put(future.result(), key, shape)
+        pending.clear()
+
+    with ThreadPoolExecutor(num_threads) as encoder:
+        decoded = prefetch(records, decode_face, num_threads=num_threads, depth=2 * batch_size)
+        for batch in batches(decoded, batch_size):
+            for key, face in batch:
+                if face is None:
+                    print(f'\tCannot decode {key}, skipped.')
+                    counts['error'] += 1
+            batch = [(key, face) for key, face in batch if face is not None]
+            restored_faces = restorer.restore_faces([face for _, face in batch], weight=weight) if batch else []
+            failed_faces = set(restorer.failed_faces) if batch else set()
+            # write the previous batch, encoded during this forward
+            write_pending()
+            for idx, ((key, _), restored_face) in enumerate(zip(batch, restored_faces)):
+                if idx in failed_faces:
+                    print(f'\tCannot restore {key}, skipped.')
+                    continue
+                pending.append((key, restored_face.shape, encoder.submit(encode_face, restored_face, compress_level)))
+            counts['ok'] += len(batch) - len(failed_faces)
+            counts['error'] += len(failed_faces)
+            if pbar is not None:
+                pbar.update(len(batch) - len(failed_faces))
+        write_pending()
+    return counts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Restore the aligned faces of LMDBs or tar shards in large batches, to an output LMDB.')
+    parser.add_argument(
+        '-i', '--input', type=str, nargs='+', required=True, help='Input LMDBs (basicsr format) or tar shards')
+    parser.add_argument('-o', '--output', type=str, required=True, help='Output LMDB, ending with .lmdb')
+    parser.add_argument('--batch_size', type=int, default=32, help='Number of faces in one forward')
+    parser.add_argument('--threads', type=int, default=4, help='Threads of the decoding and of the encoding')
+    parser.add_argument('--compress_level', type=int, default=1, help='Png compress level of the outputs')
+    parser.add_argument('--map_size', type=int, default=1024**4, help='Map size of the output LMDB, in bytes')
+    parser.add_argument('--device', type=str, default=None, help='Default: cuda if available, otherwise cpu')
+    # GFPGANer
+    parser.add_argument(
+        '--model_path',
+        type=str,
+        default='experiments/pretrained_models/GFPGANv1.4.pth',
+        help='GFPGAN model, or a bundle from scripts/pack_bundle.py')
+    parser.add_argument('--arch', type=str, default='clean', help='clean | original | bilinear | RestoreFormer')
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--precision', type=str, default='fp32', help='fp32 | bf16_autocast | bf16 | int8')
+    parser.add_argument('--precision_psnr', type=float, default=35.)
+    parser.add_argument('--jit_trace', action='store_true')
+    parser.add_argument('--backend', type=str, default='torch', help='torch | onnxruntime')
+    parser.add_argument('--channels_last', action='store_true')
+    parser.add_argument('--fixed_noise', action='store_true', help='Reproducible outputs with the fixed noise')
+    parser.add_argument('--weight', type=float, default=0.5)
+    args = parser.parse_args(argv)
+    if not args.output.rstrip('/\\').endswith('.lmdb'):
+        parser.error('The output should end with .lmdb.')
+    return args
+
+
+def main(argv=None):
+    """Restore the aligned faces of LMDBs or tar shards to an output LMDB.
+
+    The output LMDB has the keys of the inputs and a meta_info.txt, in the format of basicsr, so that it can be read
+    by FFHQDegradationDataset. It must not exist.
+    """
+    args = parse_args(argv)
+    if os.path.exists(args.output):
+        print(f'{args.output} already exists.')
+        return 1
+    device = None if args.device is None else torch.device(args.device)
+    # the faces are aligned: no face helper, so the detection and parsing models are neither downloaded nor loaded
+    restorer = GFPGANer(
+        model_path=args.model_path,
+        upscale=1,
+        arch=args.arch,
+        channel_multiplier=args.channel_multiplier,
+        device=device,
+        face_batch_size=args.batch_size,
+        precision=args.precision,
+        precision_psnr=args.precision_psnr,
+        jit_trace=args.jit_trace,
+        backend=args.backend,
+        channels_last=args.channels_last,
+        randomize_noise=not args.fixed_noise,
+        aligned_only=True)
+
+    start = time.perf_counter()
+    maker = LmdbMaker(args.output, map_size=args.map_size, compress_level=args.compress_level)
+    try:
+        with tqdm(unit='face', dynamic_ncols=True) as pbar:
+            counts = bulk_restore(
+                restorer,
+                read_records(args.input),
+                maker.put,
+                batch_size=args.batch_size,
+                weight=args.weight,
+                num_threads=args.threads,
+                compress_level=args.compress_level,
+                pbar=pbar)
+    finally:
+        maker.close()
+    elapsed = time.perf_counter() - start
+    print(f'Done in {elapsed:.1f} s: {counts["ok"]} faces restored ({counts["ok"] / max(elapsed, 1e-6):.1f} faces/s), '
+          f'{counts["error"]} failed. Output: {args.output}')
+    return 0 if counts['error'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
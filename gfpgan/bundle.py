@@ -0,0 +1,281 @@
+import contextlib
+import os
+import re
+import threading
+import torch
+import zipfile
+from collections import OrderedDict
+from facexlib.detection import RetinaFace, init_detection_model
+from facexlib.parsing import ParseNet, init_parsing_model
+from facexlib.utils import face_restoration_helper
+from facexlib.utils.face_restoration_helper import FaceRestoreHelper
+
+BUNDLE_VERSION = 1
+# BundledFaceRestoreHelper replaces the model loaders of facexlib while FaceRestoreHelper.__init__ runs
+_HELPER_INIT_LOCK = threading.Lock()
+
+
+def _torch_version():
+    return tuple(int(v) for v in re.findall(r'\d+', torch.__version__)[:2])
+
+
+# torch.load(mmap=True), load_state_dict(assign=True) and torch.device as a context manager need torch >= 2.1. With
+# an older torch, the checkpoints are read, and the networks are initialized and then loaded, as without a bundle.
+INIT_EMPTY_SUPPORTED = _torch_version() >= (2, 1)
+# the default of torch.load(mmap=None), which is set for RealESRGANer: torch >= 2.5
+MMAP_CONFIG_SUPPORTED = _torch_version() >= (2, 5)
+
+
+def _read_state_dict(path):
+    """Read the inference weights of a checkpoint: params_ema (or params), without the 'module.' prefix."""
+    loadnet = torch.load(path, map_location='cpu')
+    for keyname in ('params_ema', 'params'):
+        if keyname in loadnet:
+            loadnet = loadnet[keyname]
+            break
+    state_dict = OrderedDict()
+    for key, value in loadnet.items():
+        if key.startswith('module.'):
+            key = key[7:]
+        # compact copies, so that the bundle does not keep the storages of the training states
+        state_dict[key] = value.detach().clone().contiguous()
+    return state_dict
+
+
+def pack_bundle(save_path,
+                gfpgan_path,
+                detector_path=None,
+                parser_path=None,
+                bg_upsampler_path=None,
+                arch='clean',
+                channel_multiplier=2,
+                det_model='retinaface_resnet50',
+                bg_upsampler_scale=2):
+    """Pack the weights of the restoration pipeline into one memory-mappable bundle.
+
+    The bundle is a torch zip file, in which each tensor is stored uncompressed and aligned, so that load_bundle can
+    map it instead of reading it. Only the inference weights are kept: params_ema of GFPGAN, the detector
+    (RetinaFace), the parser (ParseNet) and the background upsampler (RealESRGAN RRDBNet). The background upsampler
+    is stored as ``params``, so that ``RealESRGANer(model_path=bundle_path)`` also reads it.
+
+    Args:
+        save_path (str): Path of the bundle.
+        gfpgan_path (str): Path of the GFPGAN checkpoint.
+        detector_path (str | None): Path of the face detector weights. Default: None.
+        parser_path (str | None): Path of the ParseNet face parsing weights. Default: None.
+        bg_upsampler_path (str | None): Path of the RealESRGAN weights. Default: None.
+        arch (str): The GFPGAN architecture. Default: 'clean'.
+        channel_multiplier (int): Channel multiplier of the GFPGAN StyleGAN2 decoder. Default: 2.
+        det_model (str): Name of the facexlib RetinaFace detection model. Default: 'retinaface_resnet50'.
+        bg_upsampler_scale (int): Scale of the RealESRGAN RRDBNet. Default: 2.
+    """
+    if not det_model.startswith('retinaface_'):
+        raise ValueError(f'Unsupported det_model: {det_model}. Only the RetinaFace detectors can be bundled.')
+    bundle = {'gfpgan': _read_state_dict(gfpgan_path)}
+    meta = dict(
+        version=BUNDLE_VERSION,
+        arch=arch,
+        channel_multiplier=channel_multiplier,
+        det_model=det_model,
+        bg_upsampler_scale=bg_upsampler_scale)
+    if detector_path is not None:
+        bundle['detector'] = _read_state_dict(detector_path)
+    if parser_path is not None:
+        bundle['parser'] = _read_state_dict(parser_path)
+    if bg_upsampler_path is not None:
+        bundle['params'] = _read_state_dict(bg_upsampler_path)
+    bundle['bundle_meta'] = meta
+
+    os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
+    tmp_path = f'{save_path}.{os.getpid()}.tmp'
+    torch.save(bundle, tmp_path)
+    os.replace(tmp_path, save_path)
+
+
+def load_checkpoint(path):
+    """Load a checkpoint on cpu, memory-mapped when it is in the torch zip format.
+
+    The storages are mapped privately (copy-on-write): the pages are read on first access and shared by all the
+    processes that map the same file, as long as they are not written. With torch < 2.1, it is read.
+    """
+    if not INIT_EMPTY_SUPPORTED:
+        return torch.load(path, map_location='cpu')
+    try:
+        return torch.load(path, map_location='cpu', mmap=True)
+    except RuntimeError:
+        # the legacy (non-zip) format cannot be mapped
+        return torch.load(path, map_location='cpu')
+
+
+def empty_init_context():
+    """Build networks on the meta device, without initializing their weights, which are then assigned by
+    load_network. It does nothing with torch < 2.1."""
+    return torch.device('meta') if INIT_EMPTY_SUPPORTED else contextlib.nullcontext()
+
+
+def is_bundle(checkpoint):
+    return isinstance(checkpoint, dict) and 'bundle_meta' in checkpoint
+
+
+def is_bundle_file(path):
+    """Whether a file is a bundle, from the pickled structure of the torch zip file, without loading the tensors."""
+    if not zipfile.is_zipfile(path):
+        return False  # pack_bundle saves in the zip format
+    with zipfile.ZipFile(path) as f:
+        pickle_names = [name for name in f.namelist() if name.count('/') == 1 and name.endswith('/data.pkl')]
+        return len(pickle_names) == 1 and b'bundle_meta' in f.read(pickle_names[0])
+
+
+def load_bundle(path):
+    """Map a bundle made by pack_bundle.
+
+    Returns:
+        dict: The state dicts ('gfpgan', and optionally 'detector', 'parser' and 'params' for the background
+            upsampler) and 'bundle_meta'.
+    """
+    bundle = load_checkpoint(path)
+    if not is_bundle(bundle):
+        raise ValueError(f'{path} is not a weight bundle. Make one with scripts/pack_bundle.py.')
+    return bundle
+
+
+def load_network(net, state_dict, device='cpu'):
+    """Load weights into a network without copying them on cpu.
+
+    The parameters and buffers of the network become the (memory-mapped) tensors of ``state_dict``. They are copied
+    when moved to another device. The network can be built in ``empty_init_context()``, which skips the
+    initialization of its weights. With torch < 2.1, the weights are copied.
+
+    Args:
+        net (nn.Module): The network.
+        state_dict (dict): The weights, e.g., from load_bundle.
+        device (torch.device): The device to run on. Default: 'cpu'.
+
+    Returns:
+        nn.Module: The network in eval mode, on device.
+    """
+    if INIT_EMPTY_SUPPORTED:
+        net.load_state_dict(state_dict, strict=True, assign=True)
+    else:  # the weights are copied
+        net.load_state_dict(state_dict, strict=True)
+    for name, tensor in list(net.named_parameters()) + list(net.named_buffers()):
+        if tensor.is_meta:
+            raise ValueError(f'{name} of {type(net).__name__} is not in the state dict.')
+    return net.eval().to(device)
+
+
+def _build_retinaface(model_name, state_dict, device):
+    """Build a facexlib RetinaFace with the weights of a bundle."""
+    network_name = model_name[len('retinaface_'):]
+    if not INIT_EMPTY_SUPPORTED:
+        return load_network(RetinaFace(network_name=network_name, device=device), state_dict, device)
+    # RetinaFace moves itself to its device in __init__, so it is built with the meta device. Then its device and its
+    # mean tensor, which is not a buffer, are set.
+    with torch.device('meta'):
+        net = RetinaFace(network_name=network_name, device=torch.device('meta'))
+    net = load_network(net, state_dict, device)
+    net.device = device
+    net.mean_tensor = torch.tensor([[[[104.]], [[117.]], [[123.]]]], device=device)
+    return net
+
+
+@contextlib.contextmanager
+def _bundled_face_models(bundle, bundled_det_model):
+    """Make FaceRestoreHelper.__init__ build its detection and parsing models from a bundle.
+
+    The facexlib loaders that FaceRestoreHelper.__init__ calls are replaced while it runs, under a lock. The models
+    that are not in the bundle are built by the facexlib loaders.
+    """
+
+    def init_bundled_detection_model(model_name, half=False, device='cuda', model_rootpath=None):
+        if 'detector' in bundle and model_name == bundled_det_model:
+            return _build_retinaface(model_name, bundle['detector'], device)
+        return init_detection_model(model_name, half=half, device=device, model_rootpath=model_rootpath)
+
+    def init_bundled_parsing_model(model_name='bisenet', half=False, device='cuda', model_rootpath=None):
+        if 'parser' in bundle and model_name == 'parsenet':
+            with empty_init_context():
+                net = ParseNet(in_size=512, out_size=512, parsing_ch=19)
+            return load_network(net, bundle['parser'], device)
+        return init_parsing_model(model_name, half=half, device=device, model_rootpath=model_rootpath)
+
+    with _HELPER_INIT_LOCK:
+        face_restoration_helper.init_detection_model = init_bundled_detection_model
+        face_restoration_helper.init_parsing_model = init_bundled_parsing_model
+        try:
+            yield
+        finally:
+            face_restoration_helper.init_detection_model = init_detection_model
+            face_restoration_helper.init_parsing_model = init_parsing_model
+
+
+class BundledFaceRestoreHelper(FaceRestoreHelper):
+    """FaceRestoreHelper with the detection and parsing models of a bundle, instead of downloading and reading their
+    weight files. The models that are not in the bundle are built by facexlib.
+
+    Args:
+        bundle (dict): The bundle, from load_bundle.
+        The other arguments are the ones of FaceRestoreHelper.
+    """
+
+    def __init__(self, bundle, *args, **kwargs):
+        with _bundled_face_models(bundle, bundle['bundle_meta']['det_model']):
+            super(BundledFaceRestoreHelper, self).__init__(*args, **kwargs)
+
+
+def build_bg_upsampler(bundle_path, tile=400, half=False, device=None):
+    """Build the RealESRGAN background upsampler from a bundle.
+
+    RealESRGANer reads the ``params`` of the bundle with a memory-mapped torch.load, then the RRDBNet parameters are
+    pointed to the mapped tensors (on cpu, in float32).
+
+    Args:
+        bundle_path (str): Path of the bundle.
+        tile (int): Tile size of RealESRGANer, 0 for no tile. Default: 400.
+        half (bool): Run in float16. Default: False.
+        device (torch.device): The device to run on. Default: None (cuda if available, otherwise cpu).
+
+    Returns:
+        RealESRGANer: The background upsampler.
+    """
+    from basicsr.archs.rrdbnet_arch import RRDBNet
+    from realesrgan import RealESRGANer
+
+    bundle = load_bundle(bundle_path)
+    if 'params' not in bundle:
+        raise ValueError(f'{bundle_path} has no background upsampler.')
+    scale = bundle['bundle_meta']['bg_upsampler_scale']
+    with empty_init_context():
+        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=scale)
+    # RealESRGANer loads params into the model: allocate it first
+    model = model.to_empty(device='cpu')
+    if not MMAP_CONFIG_SUPPORTED:
+        # params is read by RealESRGANer, then replaced by the mapped tensors
+        bg_upsampler = RealESRGANer(
+            scale=scale,
+            model_path=bundle_path,
+            model=model,
+            tile=tile,
+            tile_pad=10,
+            pre_pad=0,
+            half=half,
+            device=device)
+    else:
+        from torch.utils.serialization import config
+        mmap = config.load.mmap
+        config.load.mmap = True
+        try:
+            bg_upsampler = RealESRGANer(
+                scale=scale,
+                model_path=bundle_path,
+                model=model,
+                tile=tile,
+                tile_pad=10,
+                pre_pad=0,
+                half=half,
+                device=device)
+        finally:
+            config.load.mmap = mmap
+    if bg_upsampler.device.type == 'cpu' and not half:
+        load_network(bg_upsampler.model, bundle['params'], bg_upsampler.device)
+    return bg_upsampler
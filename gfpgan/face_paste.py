@@ -0,0 +1,189 @@
+import cv2
+import numpy as np
+import torch
+
+from gfpgan.img_util import FaceTensorConverter
+
+# face parsing classes blended from the restored face (ParseNet, 19 classes): all but background, neck, cloth, hat,
+# ear rings and necklace
+PARSE_MASK_COLORMAP = [0, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 0, 255, 0, 0, 0]
+
+MASK_MODES = ('parse', 'ellipse', 'square')
+
+
+class FacePaster():
+    """Paste the restored faces back to the upsampled image, one bounding region at a time.
+
+    ``FaceRestoreHelper.paste_faces_to_input_image`` warps each face and its mask to the whole upsampled canvas, so
+    its cost is the image area times the number of faces. Here each face and its mask are warped to the bounding box
+    of the face on the canvas only, and blended in place.
+
+    The blending masks are computed in the face crop space, then warped with the faces. The ``parse`` masks are the
+    face regions from face parsing, as in facexlib, with the parsing network run on batches of faces. The ``ellipse``
+    and ``square`` masks are feathered templates, computed once per crop size and cached.
+
+    Args:
+        upscale_factor (float): The upscale of the output.
+        mask_mode (str): The blending masks. Option: parse | ellipse | square. Default: 'square'.
+        face_parse (nn.Module | None): The face parsing network (ParseNet), for the parse masks. Default: None.
+        device (torch.device): The device of face_parse. Default: None (cpu).
+        parse_batch_size (int): Number of faces parsed in one forward. Default: 8.
+    """
+
+    def __init__(self, upscale_factor, mask_mode='square', face_parse=None, device=None, parse_batch_size=8):
+        if mask_mode not in MASK_MODES:
+            raise ValueError(f'Unsupported mask_mode: {mask_mode}. Option: {" | ".join(MASK_MODES)}.')
+        if mask_mode == 'parse' and face_parse is None:
+            raise ValueError('The parse mask_mode needs a face parsing network.')
+        self.upscale_factor = upscale_factor
+        self.mask_mode = mask_mode
+        self.face_parse = face_parse
+        self.device = torch.device('cpu') if device is None else device
+        self.parse_batch_size = parse_batch_size
+        self._parse_colormap = torch.tensor(PARSE_MASK_COLORMAP, dtype=torch.float32, device=self.device) / 255.
+        self._face_converter = FaceTensorConverter(face_size=512, device=self.device)
+        self._mask_templates = {}
+
+    def square_mask(self, h, w):
+        """The soft square mask of a face crop, eroded and blurred by 1/20 of the crop size as in facexlib."""
+        if ('square', h, w) not in self._mask_templates:
+            w_edge = int((h * w)**0.5) // 20
+            mask = np.zeros((h, w), dtype=np.float32)
+            mask[w_edge:h - w_edge, w_edge:w - w_edge] = 1
+            blur_size = w_edge * 2
+            self._mask_templates[('square', h, w)] = cv2.GaussianBlur(mask, (blur_size + 1, blur_size + 1), 0)
+        return self._mask_templates[('square', h, w)]
+
+    def ellipse_mask(self, h, w):
+        """The feathered elliptical mask of an aligned face crop, which covers the face up to the chin."""
+        if ('ellipse', h, w) not in self._mask_templates:
+            w_edge = int((h * w)**0.5) // 20
+            mask = np.zeros((h, w), dtype=np.float32)
+            cv2.ellipse(mask, (w // 2, h // 2), (int(w * 0.38), int(h * 0.42)), 0, 0, 360, 1, -1)
+            blur_size = w_edge * 2
+            self._mask_templates[('ellipse', h, w)] = cv2.GaussianBlur(mask, (blur_size + 1, blur_size + 1), 0)
+        return self._mask_templates[('ellipse', h, w)]
+
+    @torch.no_grad()
+    def parse_masks(self, faces):
+        """The soft masks of the face regions of face crops, from face parsing.
+
+        The faces are parsed in batches of parse_batch_size, so that the faces of several images can also be parsed
+        together.
+
+        Args:
+            faces (list[ndarray]): The face crops, BGR, uint8.
+
+        Returns:
+            list[ndarray]: The masks with the shape of the faces, float32, in [0, 1].
+        """
+        masks = []
+        for start in range(0, len(faces), self.parse_batch_size):
+            batch = faces[start:start + self.parse_batch_size]
+            face_inputs = [
+                face if face.shape[0:2] == (512, 512) else cv2.resize(face, (512, 512), interpolation=cv2.INTER_LINEAR)
+                for face in batch
+            ]
+            out = self.face_parse(self._face_converter.to_tensor(face_inputs))[0]
+            out = self._parse_colormap[out.argmax(dim=1)].cpu().numpy()
+            for face, mask in zip(batch, out):
+                # blur the mask
+                mask = cv2.GaussianBlur(mask, (101, 101), 11)
+                mask = cv2.GaussianBlur(mask, (101, 101), 11)
+                # remove the black borders
+                thres = 10
+                mask[:thres, :] = 0
+                mask[-thres:, :] = 0
+                mask[:, :thres] = 0
+                mask[:, -thres:] = 0
+                masks.append(cv2.resize(mask, face.shape[1::-1]))
+        return masks
+
+    def masks(self, faces):
+        """The blending masks of face crops, for the mask_mode."""
+        if self.mask_mode == 'parse':
+            return self.parse_masks(faces)
+        elif self.mask_mode == 'ellipse':
+            return [self.ellipse_mask(*face.shape[0:2]) for face in faces]
+        return [self.square_mask(*face.shape[0:2]) for face in faces]
+
+    def paste(self, input_img, restored_faces, inverse_affine_matrices, upsample_img=None, masks=None):
+        """Paste the restored faces to the upsampled input image.
+
+        Args:
+            input_img (ndarray): The input image, BGR.
+            restored_faces (list[ndarray]): The restored faces, BGR, uint8.
+            inverse_affine_matrices (list[ndarray]): The affine matrices from the face crops to the upsampled image,
+                as from ``FaceRestoreHelper.get_inverse_affine``. They are not modified.
+            upsample_img (ndarray | None): The upsampled background. Default: None (resize the input image).
+            masks (list[ndarray] | None): The blending masks of the faces, e.g., parsed with the faces of other
+                images. Default: None (computed for the mask_mode).
+
+        Returns:
+            ndarray: The output image.
+        """
+        h, w = input_img.shape[0:2]
+        h_up, w_up = int(h * self.upscale_factor), int(w * self.upscale_factor)
+        if upsample_img is None:
+            upsample_img = input_img
+        if upsample_img.shape[0:2] != (h_up, w_up):
+            canvas = cv2.resize(upsample_img, (w_up, h_up), interpolation=cv2.INTER_LANCZOS4)
+        else:
+            canvas = upsample_img.copy()
+        if canvas.ndim == 2:  # gray image
+            canvas = cv2.cvtColor(canvas, cv2.COLOR_GRAY2BGR)
+
+        self.paste_to_region(canvas, (0, 0), restored_faces, inverse_affine_matrices, masks=masks)
+        if not np.issubdtype(canvas.dtype, np.integer):
+            canvas = canvas.astype(np.uint16 if np.max(canvas) > 256 else np.uint8)  # 16-bit image
+        return canvas
+
+    def paste_to_region(self, region, offset, restored_faces, inverse_affine_matrices, masks=None):
+        """Paste the restored faces to a region of the upsampled image, in place.
+
+        Only the faces that overlap the region are warped, so that the upsampled image can be composed tile by tile.
+
+        Args:
+            region (ndarray): The region of the upsampled background, BGR(A).
+            offset (tuple[int]): The (x, y) position of the region in the upsampled image.
+            restored_faces (list[ndarray]): The restored faces, BGR, uint8.
+            inverse_affine_matrices (list[ndarray]): The affine matrices from the face crops to the upsampled image.
+            masks (list[ndarray] | None): The blending masks of the faces. Default: None (computed for the
+                mask_mode).
+        """
+        if masks is None:
+            masks = self.masks(restored_faces)
+        for restored_face, mask, inverse_affine in zip(restored_faces, masks, inverse_affine_matrices):
+            inverse_affine = inverse_affine.copy()
+            # add an offset to inverse affine matrix, for more precise back alignment
+            if self.upscale_factor > 1:
+                inverse_affine[:, 2] += 0.5 * self.upscale_factor
+            inverse_affine[:, 2] -= offset
+            self._paste_face(region, restored_face, mask, inverse_affine)
+
+    def _paste_face(self, canvas, face, mask, inverse_affine):
+        h_up, w_up = canvas.shape[0:2]
+        face_h, face_w = face.shape[0:2]
+        corners = np.array([[0, 0, 1], [face_w, 0, 1], [0, face_h, 1], [face_w, face_h, 1]], dtype=np.float64)
+        corners = corners @ inverse_affine.T
+        # the bounding region of the warped face on the canvas, with a margin for the interpolation
+        x0 = max(int(np.floor(corners[:, 0].min())) - 1, 0)
+        y0 = max(int(np.floor(corners[:, 1].min())) - 1, 0)
+        x1 = min(int(np.ceil(corners[:, 0].max())) + 2, w_up)
+        y1 = min(int(np.ceil(corners[:, 1].max())) + 2, h_up)
+        if x0 >= x1 or y0 >= y1:  # outside of the image
+            return
+        roi_affine = inverse_affine.copy()
+        roi_affine[:, 2] -= (x0, y0)
+        roi_size = (x1 - x0, y1 - y0)
+        inv_face = cv2.warpAffine(face, roi_affine, roi_size).astype(np.float32)
+        # the parse masks are warped with INTER_AREA, as in facexlib
+        mask_flags = cv2.INTER_AREA if self.mask_mode == 'parse' else cv2.INTER_LINEAR
+        inv_mask = cv2.warpAffine(mask, roi_affine, roi_size, flags=mask_flags)[:, :, None]
+
+        roi = canvas[y0:y1, x0:x1, 0:3]  # keep the alpha channel
+        blended = roi.astype(np.float32)
+        blended += inv_mask * (inv_face - blended)
+        if np.issubdtype(canvas.dtype, np.integer):
+            blended = np.clip(np.rint(blended), 0, np.iinfo(canvas.dtype).max)
+        roi[...] = blended
@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+
+
+def laplacian_variance(img):
+    """Sharpness of an image: the variance of its Laplacian, on the gray image.
+
+    Args:
+        img (ndarray): Image with shape (h, w, 3) or (h, w), BGR.
+
+    Returns:
+        float: The variance. Blurry (e.g., upsampled) images have low values.
+    """
+    if img.ndim == 3:
+        img = cv2.cvtColor(img.astype(np.uint8), cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(img, cv2.CV_32F).var())
+
+
+class FaceTriage():
+    """Select the aligned faces that are worth restoring.
+
+    Each face is scored by its size in the input image (the longest side of its detection box) and by the sharpness
+    of its aligned crop. A face is skipped when it is too small to benefit from restoration, when it is larger than
+    the crop (restoring it would lower its resolution), or when its crop is already sharp. Each criterion is disabled
+    when its threshold is None.
+
+    Args:
+        min_face_size (float | None): Skip the faces whose box is smaller than this, in input pixels. Default: None.
+        max_face_size (float | None): Skip the faces whose box is larger than this, in input pixels. Default: None.
+        sharpness_threshold (float | None): Skip the faces whose crop has a Laplacian variance of at least this.
+            Default: None.
+    """
+
+    def __init__(self, min_face_size=None, max_face_size=None, sharpness_threshold=None):
+        self.min_face_size = min_face_size
+        self.max_face_size = max_face_size
+        self.sharpness_threshold = sharpness_threshold
+
+    def __call__(self, cropped_faces, det_faces=None):
+        """Triage the aligned faces.
+
+        Args:
+            cropped_faces (list[ndarray]): The aligned face crops, BGR.
+            det_faces (list[ndarray] | None): The detection boxes (x1, y1, x2, y2, ...) of the faces, in input
+                pixels. None for faces that are already aligned, which are only checked by sharpness. Default: None.
+
+        Returns:
+            list[str | None]: For each face, None to restore it, otherwise the reason to skip it: 'small' | 'large' |
+                'sharp'.
+        """
+        decisions = []
+        for i, cropped_face in enumerate(cropped_faces):
+            face_size = None
+            if det_faces is not None and i < len(det_faces):
+                x1, y1, x2, y2 = det_faces[i][0:4]
+                face_size = max(x2 - x1, y2 - y1)
+            if face_size is not None and self.min_face_size is not None and face_size < self.min_face_size:
+                decisions.append('small')
+            elif face_size is not None and self.max_face_size is not None and face_size > self.max_face_size:
+                decisions.append('large')
+            elif (self.sharpness_threshold is not None
+                  and laplacian_variance(cropped_face) >= self.sharpness_threshold):
+                decisions.append('sharp')
+            else:
+                decisions.append(None)
+        return decisions
@@ -0,0 +1,171 @@
+import numpy as np
+import struct
+import torch
+import zlib
+
+
+class FaceTensorConverter():
+    """Fused conversion between uint8 BGR face crops and normalized RGB tensor batches.
+
+    The reference path (``img2tensor(face / 255.)``, ``normalize``, ``unsqueeze`` and ``tensor2img``) makes several
+    full-size copies per face, including a float64 one. Here a batch of faces is stacked into a reused uint8 buffer,
+    converted to float32 in [-1, 1] with the BGR->RGB swap in one pass per channel, and converted back the same way.
+    The input buffers are allocated once for the face size and only grow with the batch size.
+
+    Args:
+        face_size (int): Spatial size of the face crops. Default: 512.
+        device (torch.device): The device the network runs on. Default: None (cpu).
+        channels_last (bool): Return the tensor batches in the channels_last memory format. Default: False.
+    """
+
+    def __init__(self, face_size=512, device=None, channels_last=False):
+        self.face_size = face_size
+        self.channels_last = channels_last
+        self.device = torch.device('cpu') if device is None else torch.device(device)
+        self._capacity = 0
+        self._host_buffer = None  # (n, h, w, 3), uint8, numpy
+        self._device_buffer = None  # (n, h, w, 3), uint8, on self.device (not used on cpu)
+        self._input_buffer = None  # (n, 3, h, w), float32, on self.device, in the memory format of the network
+
+    def _reserve(self, batch_size):
+        if batch_size <= self._capacity:
+            return
+        h = w = self.face_size
+        if self.device.type == 'cuda':
+            self._host_buffer = torch.empty((batch_size, h, w, 3), dtype=torch.uint8).pin_memory().numpy()
+            self._device_buffer = torch.empty((batch_size, h, w, 3), dtype=torch.uint8, device=self.device)
+        else:
+            self._host_buffer = np.empty((batch_size, h, w, 3), dtype=np.uint8)
+        if self.channels_last:
+            # (n, h, w, 3) storage, seen as (n, 3, h, w)
+            self._input_buffer = torch.empty((batch_size, h, w, 3), dtype=torch.float32,
+                                             device=self.device).permute(0, 3, 1, 2)
+        else:
+            self._input_buffer = torch.empty((batch_size, 3, h, w), dtype=torch.float32, device=self.device)
+        self._capacity = batch_size
+
+    def to_tensor(self, faces):
+        """Convert BGR faces to a normalized RGB tensor batch.
+
+        Args:
+            faces (list[ndarray]): Face crops with shape (face_size, face_size, 3), BGR, uint8. Float faces in
+                [0, 255] (e.g., from 16-bit inputs) are cast to uint8, i.e., truncated.
+
+        Returns:
+            Tensor: Tensor with shape (n, 3, face_size, face_size), RGB, float32, in [-1, 1]. It is a view of an
+                internal buffer and is overwritten by the next call.
+        """
+        n = len(faces)
+        self._reserve(n)
+        host = self._host_buffer[:n]
+        for i, face in enumerate(faces):
+            host[i] = face  # also casts float faces (e.g., from 16-bit inputs)
+        src = torch.from_numpy(host)
+        if self._device_buffer is not None:
+            src = self._device_buffer[:n].copy_(src, non_blocking=True)
+        out = self._input_buffer[:n]
+        # (v / 255 - 0.5) / 0.5 = v * 2 / 255 - 1
+        for c in range(3):
+            torch.mul(src[..., 2 - c], 2 / 255., out=out[:, c])
+        out.sub_(1)
+        return out
+
+    def to_images(self, output, min_max=(-1, 1)):
+        """Convert a network output batch to uint8 BGR images.
+
+        It matches ``tensor2img(output, rgb2bgr=True, min_max=min_max)`` for each sample. The output tensor is
+        modified in place.
+
+        Args:
+            output (Tensor): Tensor with shape (n, 3, h, w), RGB.
+            min_max (tuple[int]): min and max values for clamp. Default: (-1, 1).
+
+        Returns:
+            list[ndarray]: Images with shape (h, w, 3), BGR, uint8. They are views of one newly allocated array.
+        """
+        low, high = min_max
+        output = output.float().clamp_(low, high)
+        output.sub_(low).mul_(255. / (high - low)).round_()
+        n, _, h, w = output.shape
+        imgs = torch.empty((n, h, w, 3), dtype=torch.uint8, device=output.device)
+        for c in range(3):
+            imgs[..., 2 - c].copy_(output[:, c])
+        imgs = imgs.cpu().numpy()
+        return list(imgs)
+
+
+class PngStripWriter():
+    """Write a PNG file strip by strip, without holding the whole image in memory.
+
+    The rows are filtered with the PNG Sub filter and compressed incrementally with zlib.
+
+    Args:
+        path (str): Path of the PNG file.
+        width (int): Image width.
+        height (int): Image height.
+        channels (int): 3 (BGR) or 4 (BGRA). Default: 3.
+        bit_depth (int): 8 (uint8) or 16 (uint16). Default: 8.
+        compress_level (int): zlib compression level. Default: 6.
+    """
+
+    def __init__(self, path, width, height, channels=3, bit_depth=8, compress_level=6):
+        if channels not in (3, 4) or bit_depth not in (8, 16):
+            raise ValueError(f'Unsupported PNG format: {channels} channels, {bit_depth} bits.')
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.bit_depth = bit_depth
+        self.rows = 0
+        self._bpp = channels * bit_depth // 8  # bytes per pixel
+        self._compressor = zlib.compressobj(compress_level)
+        self._file = open(path, 'wb')
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        color_type = 2 if channels == 3 else 6  # truecolor (with alpha)
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, 0))
+
+    def _write_chunk(self, chunk_type, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def write(self, strip):
+        """Append rows to the image.
+
+        Args:
+            strip (ndarray): Rows with shape (h, width, channels), BGR(A), uint8 or uint16 for the bit depth.
+        """
+        if strip.shape[1:] != (self.width, self.channels) or self.rows + strip.shape[0] > self.height:
+            raise ValueError(f'Strip of shape {strip.shape} does not fit the {self.width}x{self.height} image.')
+        strip = strip[..., [2, 1, 0, 3][:self.channels]]  # BGR(A) -> RGB(A)
+        strip = strip.astype('>u2' if self.bit_depth == 16 else np.uint8, copy=False)
+        data = np.ascontiguousarray(strip).view(np.uint8).reshape(strip.shape[0], -1)
+        # filter type 1 (Sub): the difference with the previous pixel of the row
+        filtered = np.empty((data.shape[0], data.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 1
+        filtered[:, 1:self._bpp + 1] = data[:, :self._bpp]
+        np.subtract(data[:, self._bpp:], data[:, :-self._bpp], out=filtered[:, self._bpp + 1:])
+        compressed = self._compressor.compress(filtered.tobytes())
+        if compressed:
+            self._write_chunk(b'IDAT', compressed)
+        self.rows += strip.shape[0]
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if self.rows != self.height:
+                raise ValueError(f'{self.rows} rows written, the image has {self.height} rows.')
+            self._write_chunk(b'IDAT', self._compressor.flush())
+            self._write_chunk(b'IEND', b'')
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
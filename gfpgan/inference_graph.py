@@ -0,0 +1,275 @@
+import math
+import torch
+from basicsr.archs.stylegan2_arch import EqualConv2d, EqualLinear, ScaledLeakyReLU
+from torch import nn
+
+from gfpgan.archs.gfpganv1_arch import ConvUpLayer, GFPGANv1
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+
+
+def _linear_params(module):
+    """The (weight, bias) of a Linear or an EqualLinear (without activation), with the scales folded."""
+    if isinstance(module, nn.Linear):
+        return module.weight, module.bias
+    if isinstance(module, EqualLinear) and module.activation is None:
+        return module.weight * module.scale, module.bias * module.lr_mul
+    raise ValueError(f'Unsupported linear layer: {module}.')
+
+
+def _conv_params(module):
+    """The (weight, bias) of a Conv2d or an EqualConv2d, with the scale folded."""
+    if isinstance(module, nn.Conv2d):
+        return module.weight, module.bias
+    if isinstance(module, EqualConv2d):
+        return module.weight * module.scale, module.bias
+    raise ValueError(f'Unsupported convolution: {module}.')
+
+
+def _conv2d(weight, bias, stride=1, padding=0, groups=1):
+    """A Conv2d with the given weight and bias."""
+    out_channels, in_channels, kernel_size, _ = weight.shape
+    conv = nn.Conv2d(
+        in_channels * groups,
+        out_channels,
+        kernel_size,
+        stride=stride,
+        padding=padding,
+        groups=groups,
+        bias=bias is not None,
+        device=weight.device,
+        dtype=weight.dtype)
+    conv.weight.data.copy_(weight)
+    if bias is not None:
+        conv.bias.data.copy_(bias)
+    return conv
+
+
+def fold_equalized_lr(module):
+    """Replace the equalized learning rate layers of a module by plain layers with the scaled weights, in place.
+
+    EqualConv2d becomes a Conv2d, EqualLinear (without activation) a Linear and ConvUpLayer an Upsample and a
+    Conv2d, so that the scaled weights are not recomputed in each forward.
+    """
+    for name, child in module.named_children():
+        if isinstance(child, EqualConv2d):
+            setattr(module, name, _conv2d(*_conv_params(child), stride=child.stride, padding=child.padding))
+        elif isinstance(child, EqualLinear) and child.activation is None:
+            weight, bias = _linear_params(child)
+            linear = nn.Linear(
+                child.in_channels, child.out_channels, bias=bias is not None, device=weight.device, dtype=weight.dtype)
+            linear.weight.data.copy_(weight)
+            if bias is not None:
+                linear.bias.data.copy_(bias)
+            setattr(module, name, linear)
+        elif isinstance(child, ConvUpLayer):
+            layers = [
+                nn.Upsample(scale_factor=2, mode='bilinear', align_corners=False),
+                _conv2d(child.weight * child.scale, child.bias, stride=child.stride, padding=child.padding)
+            ]
+            if child.activation is not None:
+                layers.append(child.activation)
+            setattr(module, name, nn.Sequential(*layers))
+        else:
+            fold_equalized_lr(child)
+    return module
+
+
+def merge_condition_branches(scale_branch, shift_branch):
+    """Merge the SFT scale and shift branches (conv + LeakyReLU + conv) of a level into one branch.
+
+    The first convolutions are concatenated, and the second ones are a grouped convolution (2 groups). The output
+    has the scale channels, then the shift channels. The sqrt(2) gain of ScaledLeakyReLU (original arch) is folded
+    into the second convolution.
+    """
+    activation = scale_branch[1]
+    gain = math.sqrt(2) if isinstance(activation, ScaledLeakyReLU) else 1
+    weight1, bias1 = zip(*[_conv_params(branch[0]) for branch in (scale_branch, shift_branch)])
+    weight2, bias2 = zip(*[_conv_params(branch[2]) for branch in (scale_branch, shift_branch)])
+    return nn.Sequential(
+        _conv2d(torch.cat(weight1), torch.cat(bias1), padding=1),
+        nn.LeakyReLU(negative_slope=activation.negative_slope, inplace=True),
+        _conv2d(torch.cat(weight2) * gain, torch.cat(bias2), padding=1, groups=2))
+
+
+def _style_layers(decoder):
+    """The modulated convolutions of a StyleGAN2 decoder, in the forward order, with the index of their latent."""
+    layers = [(decoder.style_conv1.modulated_conv, 0), (decoder.to_rgb1.modulated_conv, 1)]
+    for i, to_rgb in enumerate(decoder.to_rgbs):
+        layers.append((decoder.style_convs[2 * i].modulated_conv, 2 * i + 1))
+        layers.append((decoder.style_convs[2 * i + 1].modulated_conv, 2 * i + 2))
+        layers.append((to_rgb.modulated_conv, 2 * i + 3))
+    return layers
+
+
+class GFPGANInference(nn.Module):
+    """Inference graph of a GFPGANv1Clean or GFPGANv1 (original arch), with the same outputs and fewer layers.
+
+    It is built from a network with the weights loaded, and is then saved and loaded with its own state dict:
+
+    - The SFT scale and shift branches of each level are merged into one branch with twice the channels.
+    - The style code (final_linear) and the style modulations of all the modulated convolutions are linear layers
+      in a row: they are merged into one linear layer, which gives the styles of all the modulated convolutions.
+    - The equalized learning rate scales (original arch) are folded into plain convolutions and linear layers.
+    - The intermediate rgb images and the style MLP, which the restored faces do not use, are dropped.
+
+    Only the restored images are returned. It runs without autograd, as GFPGANv1Clean.inference.
+
+    Args:
+        net (GFPGANv1Clean | GFPGANv1): The network, with input_is_latent. It is modified.
+    """
+
+    def __init__(self, net):
+        super(GFPGANInference, self).__init__()
+        if not isinstance(net, (GFPGANv1Clean, GFPGANv1)):
+            raise ValueError(f'Unsupported network: {type(net).__name__}. Option: GFPGANv1Clean | GFPGANv1.')
+        if not net.input_is_latent:
+            raise ValueError('The style MLP between the style code and the modulations cannot be merged: '
+                             'the network needs input_is_latent.')
+        self.source_arch = type(net).__name__
+        self.sft_half = net.stylegan_decoder.sft_half
+
+        # merged style layers: the style of each modulated conv from the bottleneck features
+        decoder = net.stylegan_decoder
+        code_weight, code_bias = _linear_params(net.final_linear)
+        weights, biases, self.style_sizes = [], [], []
+        for modulated_conv, latent_idx in _style_layers(decoder):
+            if net.different_w:
+                rows = slice(latent_idx * net.num_style_feat, (latent_idx + 1) * net.num_style_feat)
+            else:  # the same style code for all the layers
+                rows = slice(0, net.num_style_feat)
+            weight, bias = _linear_params(modulated_conv.modulation)
+            # in float64, as the product of two large matrices
+            weights.append(weight.double() @ code_weight[rows].double())
+            biases.append(weight.double() @ code_bias[rows].double() + bias.double())
+            self.style_sizes.append(weight.size(0))
+            modulated_conv.modulation = nn.Identity()
+        self.style_linear = nn.Linear(
+            code_weight.size(1), sum(self.style_sizes), device=code_weight.device, dtype=code_weight.dtype)
+        self.style_linear.weight.data.copy_(torch.cat(weights))
+        self.style_linear.bias.data.copy_(torch.cat(biases))
+        decoder.style_mlp = None
+
+        # merged SFT branches
+        self.condition = nn.ModuleList([
+            merge_condition_branches(scale_branch, shift_branch)
+            for scale_branch, shift_branch in zip(net.condition_scale, net.condition_shift)
+        ])
+
+        # U-Net, with the activations of the clean arch, which are in its forward
+        if isinstance(net, GFPGANv1Clean):
+            self.conv_body_first = nn.Sequential(net.conv_body_first, nn.LeakyReLU(0.2, inplace=True))
+            self.final_conv = nn.Sequential(net.final_conv, nn.LeakyReLU(0.2, inplace=True))
+        else:
+            self.conv_body_first = net.conv_body_first
+            self.final_conv = net.final_conv
+        self.conv_body_down = net.conv_body_down
+        self.conv_body_up = net.conv_body_up
+        fold_equalized_lr(self)
+        self.stylegan_decoder = decoder
+
+    def forward(self, x, return_rgb=False, randomize_noise=True, **kwargs):
+        """Forward function for GFPGANInference.
+
+        Args:
+            x (Tensor): Input images.
+            return_rgb (bool): Only False: the intermediate rgb images are not computed. Default: False.
+            randomize_noise (bool): Randomize noise, used when 'noise' is False. Default: True.
+
+        Returns:
+            tuple: The restored images and an empty list (no intermediate rgb images), as GFPGANv1Clean.
+        """
+        if return_rgb:
+            raise ValueError('GFPGANInference does not compute the intermediate rgb images.')
+        decoder = self.stylegan_decoder
+        unet_skips = []
+
+        # encoder
+        feat = self.conv_body_first(x)
+        for block in self.conv_body_down:
+            feat = block(feat)
+            unet_skips.append(feat)
+        feat = self.final_conv(feat)
+
+        # the styles of all the modulated convolutions
+        styles = self.style_linear(feat.reshape(feat.size(0), -1)).split(self.style_sizes, dim=1)
+        if randomize_noise:
+            noise = [None] * decoder.num_layers
+        else:  # use the stored noise
+            noise = [getattr(decoder.noises, f'noise{i}') for i in range(decoder.num_layers)]
+
+        out = decoder.constant_input(x.size(0))
+        out = decoder.style_conv1(out, styles[0], noise=noise[0])
+        skip = decoder.to_rgb1(out, styles[1])
+        # the in-place SFT is not supported by autograd and ONNX export
+        inplace = not (torch.is_grad_enabled() or torch.onnx.is_in_onnx_export())
+        for i, (up_block, condition) in enumerate(zip(self.conv_body_up, self.condition)):
+            # ResUpLayer, with the unet skip, which is then freed
+            feat = up_block(feat + unet_skips.pop())
+            scale, shift = condition(feat).chunk(2, dim=1)
+            out = decoder.style_convs[2 * i](out, styles[3 * i + 2], noise=noise[2 * i + 1])
+            if self.sft_half:
+                out_same, out_sft = torch.split(out, out.size(1) // 2, dim=1)
+                if inplace:
+                    out_sft.mul_(scale).add_(shift)
+                else:
+                    out = torch.cat([out_same, out_sft * scale + shift], dim=1)
+            elif inplace:
+                out.mul_(scale).add_(shift)
+            else:
+                out = out * scale + shift
+            out = decoder.style_convs[2 * i + 1](out, styles[3 * i + 3], noise=noise[2 * i + 2])
+            skip = decoder.to_rgbs[i](out, styles[3 * i + 4], skip)
+        return skip, []
+
+
+@torch.no_grad()
+def optimize_gfpgan(net):
+    """The inference graph of a GFPGANv1Clean or GFPGANv1, with its weights loaded. The network is modified."""
+    return GFPGANInference(net).eval()
+
+
+@torch.no_grad()
+def check_equivalence(net, inference_net, faces, batch_size=1):
+    """Maximum absolute difference of the restored faces of a network and of its inference graph.
+
+    Both run with the fixed noise of the decoder, so that the outputs are deterministic.
+
+    Args:
+        net (nn.Module): The network.
+        inference_net (GFPGANInference): Its inference graph.
+        faces (Tensor): Normalized faces with shape (n, 3, h, w), in [-1, 1].
+        batch_size (int): Batch size of the forwards. Default: 1.
+    """
+    max_diff = 0
+    for idx in range(0, faces.size(0), batch_size):
+        batch = faces[idx:idx + batch_size]
+        ref = net(batch, return_rgb=False, randomize_noise=False)[0]
+        output = inference_net(batch, return_rgb=False, randomize_noise=False)[0]
+        max_diff = max(max_diff, (output - ref).abs().max().item())
+    return max_diff
+
+
+def save_inference_checkpoint(net, save_path):
+    torch.save(dict(params_inference=net.state_dict(), source_arch=net.source_arch), save_path)
+
+
+def load_inference_checkpoint(net, checkpoint):
+    """Load a checkpoint saved by save_inference_checkpoint.
+
+    Args:
+        net (GFPGANv1Clean | GFPGANv1): A network with the options of the optimized one. Its weights are not used.
+        checkpoint (dict): The loaded checkpoint.
+
+    Returns:
+        GFPGANInference: The inference graph, on cpu.
+    """
+    if type(net).__name__ != checkpoint['source_arch']:
+        raise ValueError(f'The checkpoint is optimized from {checkpoint["source_arch"]}, not {type(net).__name__}.')
+    # the structure is built without computing the merged weights, which are all in the checkpoint
+    inference_net = GFPGANInference(net.to('meta')).to_empty(device='cpu')
+    inference_net.load_state_dict(checkpoint['params_inference'], strict=True)
+    return inference_net.eval()
+
+
+def is_inference_checkpoint(checkpoint):
+    return 'params_inference' in checkpoint
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import torch
+import warnings
+from torch import nn
+
+from gfpgan.oom import is_oom_error
+
+
+def _update_hash(hasher, value):
+    if isinstance(value, torch.Tensor):
+        if value.is_quantized:
+            hasher.update(f'{value.q_scheme()}'.encode())
+            value = value.int_repr()
+        value = value.detach().cpu().contiguous()
+        hasher.update(f'{value.dtype}{tuple(value.shape)}'.encode())
+        hasher.update(value.reshape(-1).view(torch.uint8).numpy().tobytes())
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _update_hash(hasher, v)
+    else:
+        hasher.update(repr(value).encode())
+
+
+def weights_hash(net):
+    """SHA-256 of the network state dict (names, dtypes, shapes and values)."""
+    hasher = hashlib.sha256()
+    for key, value in sorted(net.state_dict().items()):
+        hasher.update(key.encode())
+        _update_hash(hasher, value)
+    return hasher.hexdigest()
+
+
+class RestoredImage(nn.Module):
+    """Only return the restored image, so that the forward can be traced."""
+
+    def __init__(self, net, randomize_noise=True):
+        super(RestoredImage, self).__init__()
+        self.net = net
+        self.randomize_noise = randomize_noise
+
+    def forward(self, x):
+        return self.net(x, return_rgb=False, randomize_noise=self.randomize_noise)[0]
+
+
+class TracedNetwork():
+    """TorchScript graphs of a restoration network, cached on disk.
+
+    The network is traced (and frozen) for a fixed input shape, one graph per batch size. The graphs are saved in
+    ``cache_dir``, keyed by the hash of the weights, the torch version and the trace settings, so that a warm restart
+    loads them instead of tracing again. If tracing or running a graph fails, it falls back to the eager network, except
+    for out-of-memory errors, which are raised.
+
+    Args:
+        net (nn.Module): The restoration network, in eval mode.
+        cache_dir (str): Folder for the traced graphs.
+        name (str): Prefix of the file names, e.g., the arch name. Default: 'gfpgan'.
+        face_size (int): Spatial size of the inputs. Default: 512.
+        randomize_noise (bool): Randomize noise injection in the traced graph. Default: True.
+        extra_key (str): Other settings the graph depends on, e.g., the precision. Default: ''.
+    """
+
+    def __init__(self, net, cache_dir, name='gfpgan', face_size=512, randomize_noise=True, extra_key=''):
+        self.net = net
+        self.cache_dir = cache_dir
+        self.name = name
+        self.face_size = face_size
+        self.randomize_noise = randomize_noise
+        self.extra_key = extra_key
+        self.graphs = {}
+        self.failed = False
+        self._weights_hash = None
+
+    def cache_path(self, x):
+        if self._weights_hash is None:
+            self._weights_hash = weights_hash(self.net)
+        key = '|'.join([
+            self._weights_hash, torch.__version__, x.device.type,
+            str(x.dtype),
+            str(tuple(x.shape)),
+            str(self.randomize_noise), self.extra_key
+        ])
+        key = hashlib.sha256(key.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f'{self.name}_b{x.size(0)}_{key}.pt')
+
+    @torch.no_grad()
+    def _get_graph(self, x):
+        batch_size = x.size(0)
+        if batch_size in self.graphs:
+            return self.graphs[batch_size]
+        path = self.cache_path(x)
+        if os.path.isfile(path):
+            graph = torch.jit.load(path, map_location=x.device)
+        else:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', torch.jit.TracerWarning)
+                graph = torch.jit.trace(RestoredImage(self.net, self.randomize_noise).eval(), x, check_trace=False)
+            graph = torch.jit.freeze(graph)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            torch.jit.save(graph, tmp_path)
+            os.replace(tmp_path, path)
+        self.graphs[batch_size] = graph
+        return graph
+
+    def __call__(self, x):
+        """Restore a batch of faces.
+
+        Args:
+            x (Tensor): Input faces with shape (b, 3, face_size, face_size).
+
+        Returns:
+            Tensor: The restored faces.
+        """
+        if not self.failed and tuple(x.shape[1:]) == (3, self.face_size, self.face_size):
+            try:
+                return self._get_graph(x)(x)
+            except Exception as error:
+                # out of memory is not a failure of the graph: it is raised, e.g., to retry with a smaller batch
+                if is_oom_error(error):
+                    raise
+                print(f'\tFailed to trace or run the compiled network, fall back to eager mode: {error}')
+                self.failed = True
+        return self.net(x, return_rgb=False, randomize_noise=self.randomize_noise)[0]
@@ -0,0 +1,95 @@
+import hashlib
+import inspect
+import os
+import torch
+import warnings
+
+from gfpgan.jit_cache import RestoredImage, weights_hash
+
+OPSET_VERSION = 17
+
+
+def onnx_cache_path(net, model_path, face_size=512, opset_version=OPSET_VERSION, extra_key=''):
+    """Path of the ONNX export of a network next to its checkpoint, keyed by the weights hash and the export settings.
+
+    A change of the weights or of the options of the network gives another path, so that a stale export is not
+    reused.
+
+    Args:
+        net (nn.Module): The restoration network.
+        model_path (str): Path of the checkpoint.
+        face_size (int): Spatial size of the input. Default: 512.
+        opset_version (int): ONNX opset version. Default: OPSET_VERSION.
+        extra_key (str): Other settings the graph depends on, e.g., the arch options. Default: ''.
+    """
+    key = '|'.join([weights_hash(net), str(face_size), str(opset_version), extra_key])
+    key = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return f'{os.path.splitext(model_path)[0]}_{key}.onnx'
+
+
+@torch.no_grad()
+def export_onnx(net, save_path, face_size=512, opset_version=OPSET_VERSION):
+    """Export a restoration network (e.g., GFPGANv1Clean or RestoreFormer) to ONNX.
+
+    The graph takes one normalized RGB face with shape (1, 3, face_size, face_size) as ``input`` and returns the
+    restored face as ``output``. Noise injection uses the fixed noise buffers of the StyleGAN2 decoder
+    (``randomize_noise=False``), so that the graph has no random ops. With a batch of one, the grouped convolution
+    of the modulated convolutions is a plain convolution with a weight computed in the graph.
+
+    Args:
+        net (nn.Module): The restoration network on cpu, in float32.
+        save_path (str): Path of the ONNX model.
+        face_size (int): Spatial size of the input. Default: 512.
+        opset_version (int): ONNX opset version. Default: OPSET_VERSION.
+    """
+    module = RestoredImage(net, randomize_noise=False).eval()
+    x = torch.zeros((1, 3, face_size, face_size))
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False  # the TorchScript-based exporter
+    os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        torch.onnx.export(
+            module, (x, ),
+            save_path,
+            input_names=['input'],
+            output_names=['output'],
+            opset_version=opset_version,
+            do_constant_folding=True,
+            **kwargs)
+
+
+class OnnxRuntimeNetwork():
+    """Run an exported restoration network with ONNX Runtime on cpu.
+
+    Args:
+        onnx_path (str): Path of the ONNX model from export_onnx.
+        num_threads (int): Number of intra-op threads. Default: 0 (chosen by ONNX Runtime).
+    """
+
+    def __init__(self, onnx_path, num_threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        """Restore a batch of faces.
+
+        Args:
+            x (Tensor): Input faces with shape (b, 3, h, w), in [-1, 1].
+
+        Returns:
+            Tensor: The restored faces on the device of ``x``.
+        """
+        inputs = x.detach().float().cpu().numpy()
+        # the graph is exported for one face
+        outputs = [
+            torch.from_numpy(self.session.run(None, {self.input_name: inputs[i:i + 1]})[0])
+            for i in range(inputs.shape[0])
+        ]
+        return torch.cat(outputs, 0).to(x.device)
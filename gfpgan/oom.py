@@ -0,0 +1,5 @@
+def is_oom_error(error):
+    """Whether the error is an out-of-memory error, of torch (cuda or cpu) or numpy."""
+    if isinstance(error, MemoryError):
+        return True
+    return isinstance(error, RuntimeError) and ('out of memory' in str(error) or "can't allocate memory" in str(error))
@@ -0,0 +1,107 @@
+import contextlib
+import copy
+import numpy as np
+import torch
+from basicsr.metrics.psnr_ssim import calculate_psnr
+
+PRECISIONS = ('fp32', 'bf16_autocast', 'bf16')
+
+
+def cast_network(net, precision):
+    """Cast the network weights for the given precision.
+
+    Only ``bf16`` stores the weights in bfloat16. ``bf16_autocast`` keeps float32 weights and lets autocast run the
+    matrix ops (conv, linear, matmul) in bfloat16.
+
+    Args:
+        net (nn.Module): The restoration network.
+        precision (str): One of ``fp32`` | ``bf16_autocast`` | ``bf16``.
+
+    Returns:
+        nn.Module: The casted network.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f'Unsupported precision: {precision}. Options: {" | ".join(PRECISIONS)}.')
+    if precision == 'bf16':
+        net = net.to(torch.bfloat16)
+    return net
+
+
+def to_channels_last(net):
+    """Convert the 4-D weights and buffers of the network to the channels_last memory format, in place.
+
+    ``net.to(memory_format=torch.channels_last)`` does not work for the archs with the 5-D weights of the modulated
+    convolutions, which are left unchanged here. The convolutions keep the memory format of their inputs, so that a
+    channels_last input runs the whole forward in channels_last, which suits oneDNN (cpu) and cuDNN (tensor cores).
+
+    Args:
+        net (nn.Module): The restoration network.
+
+    Returns:
+        nn.Module: The converted network.
+    """
+    for module in net.modules():
+        for param in module.parameters(recurse=False):
+            if param.dim() == 4:
+                param.data = param.data.contiguous(memory_format=torch.channels_last)
+        for name, buffer in module.named_buffers(recurse=False):
+            if buffer is not None and buffer.dim() == 4:
+                setattr(module, name, buffer.contiguous(memory_format=torch.channels_last))
+    return net
+
+
+def precision_context(precision, device):
+    """The context to run the network forward in for the given precision."""
+    if precision == 'bf16_autocast':
+        return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def network_input(x, precision):
+    """Convert the float32 network input for the given precision."""
+    if precision == 'bf16':
+        return x.to(torch.bfloat16)
+    return x
+
+
+def _to_uint8(output):
+    # same as tensor2img with min_max=(-1, 1), for a batch
+    output = (output.float().clamp(-1, 1) + 1) * 127.5
+    return output.round().permute(0, 2, 3, 1).cpu().numpy().astype(np.uint8)
+
+
+@torch.no_grad()
+def check_precision(net, precision, inputs, device=None):
+    """Compare the output of a reduced precision network with the float32 one.
+
+    The float32 network is left unchanged: the reduced precision network is a copy. Noise injection is disabled
+    (``randomize_noise=False``) for both, so that the difference only comes from the precision.
+
+    Args:
+        net (nn.Module): The float32 restoration network.
+        precision (str): One of ``fp32`` | ``bf16_autocast`` | ``bf16``.
+        inputs (Tensor): Normalized input faces with shape (n, 3, h, w), in [-1, 1].
+        device (torch.device): The device to run on. Default: None (the device of ``inputs``).
+
+    Returns:
+        float: The mean PSNR (dB) of the uint8 outputs against the float32 outputs.
+    """
+    device = inputs.device if device is None else device
+    inputs = inputs.to(device)
+    ref = _to_uint8(net(inputs, return_rgb=False, randomize_noise=False)[0])
+
+    low_net = cast_network(copy.deepcopy(net), precision)
+    with precision_context(precision, device):
+        out = _to_uint8(low_net(network_input(inputs, precision), return_rgb=False, randomize_noise=False)[0])
+    del low_net
+
+    psnrs = [calculate_psnr(out[i], ref[i], crop_border=0) for i in range(out.shape[0])]
+    return float(np.mean(psnrs))
+
+
+def make_probe_faces(num=2, size=512, seed=0):
+    """Smooth random images used as inputs for the precision check, with shape (num, 3, size, size) in [-1, 1]."""
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.rand((num, 3, size // 16, size // 16), generator=generator)
+    x = torch.nn.functional.interpolate(x, size=(size, size), mode='bicubic', align_corners=False)
+    return x.clamp_(0, 1) * 2 - 1
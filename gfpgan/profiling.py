@@ -0,0 +1,128 @@
+import contextlib
+import os
+import threading
+import time
+import torch
+from collections import OrderedDict
+
+try:
+    import psutil
+except ImportError:  # the resident memory is read from /proc on Linux
+    psutil = None
+
+
+def _rss():
+    """Resident memory of the process, in bytes, or None if unknown."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class _RssSampler():
+    """Sample the resident memory of the process in a thread, and keep its peak.
+
+    Args:
+        interval (float): Time between the samples (s). Default: 0.005.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start_rss = self.peak_rss = _rss()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, _rss())
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the sampling, and return the peak resident memory above the one at the start (bytes)."""
+        self._stopped.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, _rss())
+        return self.peak_rss - self.start_rss
+
+
+class StageProfiler():
+    """Record the wall time, CPU time and peak memory delta of the stages of GFPGANer.enhance.
+
+    The records of the last enhance call are in ``records``, in order. Each one is a dict with ``stage``,
+    ``wall_time`` (s), ``cpu_time`` (s, of all the threads of the process), ``peak_memory`` (bytes) and the extra
+    info of the stage (e.g., the face indices of a restore batch). On cuda, ``peak_memory`` is the peak of the
+    allocated device memory above its level at the start of the stage. On cpu, it is the peak resident memory of
+    the process above its level at the start of the stage, sampled every ``rss_interval`` in a thread (with psutil,
+    or /proc on Linux; None where it is not available), so a shorter peak can be missed.
+
+    Args:
+        sink (callable | None): Called with the records at the end of each enhance call, e.g., to log them or
+            aggregate them across calls. Default: None.
+        device (torch.device): The device of the restoration, synchronized at the stage boundaries on cuda.
+            Default: None (cpu).
+        rss_interval (float): Time between the resident memory samples on cpu (s). Default: 0.005.
+    """
+
+    def __init__(self, sink=None, device=None, rss_interval=0.005):
+        self.sink = sink
+        self.device = torch.device('cpu') if device is None else torch.device(device)
+        self.rss_interval = rss_interval
+        self.records = []
+
+    def start(self):
+        """Start the records of an enhance call."""
+        self.records = []
+
+    def finish(self):
+        """End the records of an enhance call, and send them to the sink."""
+        if self.sink is not None:
+            self.sink(list(self.records))
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        """Record the stage run in the context."""
+        cuda = self.device.type == 'cuda'
+        if cuda:
+            torch.cuda.synchronize(self.device)
+            start_memory = torch.cuda.memory_allocated(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+        else:
+            sampler = _RssSampler(self.rss_interval).start() if _rss() is not None else None
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            if cuda:
+                torch.cuda.synchronize(self.device)
+                peak_memory = torch.cuda.max_memory_allocated(self.device) - start_memory
+            else:
+                peak_memory = None if sampler is None else sampler.stop()
+            self.records.append(
+                dict(
+                    stage=name,
+                    wall_time=time.perf_counter() - start_wall,
+                    cpu_time=time.process_time() - start_cpu,
+                    peak_memory=peak_memory,
+                    **info))
+
+    def event(self, name, **info):
+        """Record an event within the stages, e.g., a retry with less memory. Its times are zero."""
+        self.records.append(dict(stage=name, wall_time=0., cpu_time=0., peak_memory=None, **info))
+
+    def summary(self):
+        """Total wall and CPU time, max peak memory delta and number of calls of each stage of the records."""
+        summary = OrderedDict()
+        for record in self.records:
+            total = summary.setdefault(record['stage'], dict(wall_time=0, cpu_time=0, peak_memory=None, count=0))
+            total['wall_time'] += record['wall_time']
+            total['cpu_time'] += record['cpu_time']
+            if record['peak_memory'] is not None:
+                total['peak_memory'] = max(total['peak_memory'] or 0, record['peak_memory'])
+            total['count'] += 1
+        return summary
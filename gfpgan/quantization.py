@@ -0,0 +1,156 @@
+import cv2
+import glob
+import os
+import torch
+import warnings
+from torch import nn
+from torch.ao import quantization as tq
+
+from gfpgan.img_util import FaceTensorConverter
+
+
+def get_quantized_engine():
+    """Select the best available int8 engine for CPU inference."""
+    engines = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in engines:
+            return engine
+    raise RuntimeError(f'No supported quantized engine in {engines}.')
+
+
+def _static_targets(net):
+    """(parent module, attribute name) of the GFPGANv1Clean parts with static int8 quantization.
+
+    They are the convolutions of the U-Net, final_linear and the SFT condition branches (conv + LeakyReLU + conv,
+    quantized end-to-end). Their weights are fixed, so both weights and activations are quantized with the
+    activation ranges from calibration.
+    """
+    targets = [(net, 'conv_body_first'), (net, 'final_conv'), (net, 'final_linear')]
+    for block in list(net.conv_body_down) + list(net.conv_body_up):
+        targets.extend([(block, 'conv1'), (block, 'conv2'), (block, 'skip')])
+    for branches in (net.condition_scale, net.condition_shift):
+        for idx in range(len(branches)):
+            targets.append((branches, str(idx)))
+    return targets
+
+
+def _dynamic_targets(net):
+    """Names of the GFPGANv1Clean parts with dynamic int8 quantization.
+
+    The weights of the modulated convolutions are computed from the style of each sample in the forward, so they
+    cannot be quantized ahead of time. Their style modulation layers (Linear) are quantized dynamically instead.
+    """
+    return {
+        f'stylegan_decoder.{name}'
+        for name, module in net.stylegan_decoder.named_modules() if name.endswith('modulation')
+    }
+
+
+def _prepare(net, engine):
+    torch.backends.quantized.engine = engine
+    qconfig = tq.get_default_qconfig(engine)
+    for parent, name in _static_targets(net):
+        wrapper = tq.QuantWrapper(getattr(parent, name))
+        wrapper.qconfig = qconfig
+        for module in wrapper.modules():
+            if isinstance(module, nn.LeakyReLU):
+                module.inplace = False  # not supported by quantized::leaky_relu
+        setattr(parent, name, wrapper)
+    net.eval()
+    tq.prepare(net, inplace=True)
+    return net
+
+
+def _convert(net):
+    tq.convert(net, inplace=True)
+    tq.quantize_dynamic(net, _dynamic_targets(net), dtype=torch.qint8, inplace=True)
+    return net
+
+
+@torch.no_grad()
+def quantize_gfpgan_clean(net, calib_faces, batch_size=4, engine=None):
+    """Post-training int8 quantization of GFPGANv1Clean.
+
+    Args:
+        net (GFPGANv1Clean): The float32 network on cpu. It is modified in place.
+        calib_faces (Tensor): Normalized aligned faces for calibration, with shape (n, 3, h, w), in [-1, 1].
+        batch_size (int): Batch size for calibration. Default: 4.
+        engine (str | None): The quantized engine. Default: None (the best available one).
+
+    Returns:
+        GFPGANv1Clean: The quantized network.
+    """
+    engine = get_quantized_engine() if engine is None else engine
+    net = _prepare(net, engine)
+    for start in range(0, calib_faces.size(0), batch_size):
+        net(calib_faces[start:start + batch_size], return_rgb=False)
+    net = _convert(net)
+    net.quantized_engine = engine
+    return net
+
+
+def build_quantized_gfpgan_clean(net, engine):
+    """Turn a GFPGANv1Clean into the quantized structure, ready to load a quantized state dict."""
+    with warnings.catch_warnings():
+        # the observers are not run: the quantization parameters come from the state dict
+        warnings.simplefilter('ignore', UserWarning)
+        net = _convert(_prepare(net, engine))
+    net.quantized_engine = engine
+    return net
+
+
+def save_quantized_checkpoint(net, save_path):
+    torch.save(dict(params_int8=net.state_dict(), quantized_engine=net.quantized_engine), save_path)
+
+
+def load_quantized_checkpoint(net, checkpoint):
+    """Load a checkpoint saved by save_quantized_checkpoint into a float32 GFPGANv1Clean (on cpu).
+
+    Args:
+        net (GFPGANv1Clean): The float32 network, with the same options as the quantized one.
+        checkpoint (dict): The loaded checkpoint.
+
+    Returns:
+        GFPGANv1Clean: The quantized network.
+    """
+    net = build_quantized_gfpgan_clean(net, checkpoint['quantized_engine'])
+    net.load_state_dict(checkpoint['params_int8'], strict=True)
+    return net.eval()
+
+
+def is_quantized_checkpoint(checkpoint):
+    return 'params_int8' in checkpoint
+
+
+def read_aligned_faces(folder, max_num=None, face_size=512):
+    """Read aligned faces from a folder as a normalized tensor batch for calibration.
+
+    Args:
+        folder (str): Folder of aligned face images.
+        max_num (int | None): Maximum number of faces to read. Default: None (all).
+        face_size (int): The faces are resized to this size. Default: 512.
+
+    Returns:
+        Tensor: Tensor with shape (n, 3, face_size, face_size), RGB, in [-1, 1].
+    """
+    paths = sorted(glob.glob(os.path.join(folder, '*')))
+    faces = []
+    for path in paths:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        faces.append(cv2.resize(img, (face_size, face_size), interpolation=cv2.INTER_LINEAR))
+        if max_num is not None and len(faces) >= max_num:
+            break
+    if not faces:
+        raise FileNotFoundError(f'No images found in {folder}.')
+    return FaceTensorConverter(face_size=face_size).to_tensor(faces).clone()
+
+
+def count_quantized_modules(net):
+    """Count the int8 modules of a quantized network, by type name."""
+    counts = {}
+    for module in net.modules():
+        if type(module).__module__.startswith('torch.ao.nn.quantized'):
+            counts[type(module).__name__] = counts.get(type(module).__name__, 0) + 1
+    return counts
@@ -0,0 +1,104 @@
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+
+def content_hash(*values):
+    """BLAKE2b of arrays (dtype, shape and values) and other values (repr)."""
+    hasher = hashlib.blake2b(digest_size=16)
+    for value in values:
+        if isinstance(value, np.ndarray):
+            hasher.update(f'{value.dtype}{value.shape}'.encode())
+            hasher.update(np.ascontiguousarray(value).data)
+        else:
+            hasher.update(repr(value).encode())
+    return hasher.hexdigest()
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+class LRUCache():
+    """Least recently used cache, bounded by the total size of its numpy arrays.
+
+    Args:
+        max_bytes (int): Maximum total size of the cached arrays. Items larger than it are not cached.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """The cached value of key (which becomes the most recently used), or None."""
+        if key not in self._items:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(key)
+        return self._items[key][0]
+
+    def put(self, key, value):
+        nbytes = _nbytes(value)
+        if key in self._items:
+            self.nbytes -= self._items.pop(key)[1]
+        if nbytes > self.max_bytes:
+            return
+        self._items[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            self.nbytes -= self._items.popitem(last=False)[1][1]
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+
+class StageCache():
+    """Memoization of the stages of GFPGANer.enhance, one LRU cache per stage.
+
+    Each stage is keyed by the content hash of its input and by the parameters it depends on only, so that changing
+    a parameter only recomputes the stages that use it:
+
+    - detection: the face boxes and landmarks, keyed by the image hash, the detector (name and weights) and the
+      detection parameters. The affine matrices and crops are recomputed from the landmarks, which is cheap.
+    - faces: the restored faces, keyed by the crop hash, the model (arch, precision, backend and weights) and weight.
+    - background: the upsampled background, keyed by the image hash, the bg_upsampler (settings and weights),
+      outscale and tile size.
+
+    The models are identified by the hash of their weights, so that a cache shared by several GFPGANers only
+    returns the outputs of the same models.
+
+    Args:
+        detection_bytes (int): Size bound of the detection cache. Default: 16 MB.
+        face_bytes (int): Size bound of the restored face cache. Default: 256 MB.
+        background_bytes (int): Size bound of the background cache. Default: 1 GB.
+    """
+
+    def __init__(self, detection_bytes=16 * 1024**2, face_bytes=256 * 1024**2, background_bytes=1024**3):
+        self.detection = LRUCache(detection_bytes)
+        self.faces = LRUCache(face_bytes)
+        self.background = LRUCache(background_bytes)
+
+    def stats(self):
+        """The hits, misses and size (bytes) of each stage."""
+        return {
+            name: dict(hits=cache.hits, misses=cache.misses, nbytes=cache.nbytes)
+            for name, cache in [('detection', self.detection), ('faces', self.faces), ('background', self.background)]
+        }
+
+    def clear(self):
+        self.detection.clear()
+        self.faces.clear()
+        self.background.clear()
@@ -1,16 +1,30 @@
+import contextlib
 import cv2
+import numpy as np
 import os
 import torch
-from basicsr.utils import img2tensor, tensor2img
 from basicsr.utils.download_util import load_file_from_url
 from facexlib.utils.face_restoration_helper import FaceRestoreHelper
-from torchvision.transforms.functional import normalize
 
 from gfpgan.archs.gfpgan_bilinear_arch import GFPGANBilinear
 from gfpgan.archs.gfpganv1_arch import GFPGANv1
 from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.bundle import BundledFaceRestoreHelper, empty_init_context, is_bundle, load_checkpoint, load_network
+from gfpgan.face_paste import FacePaster
+from gfpgan.img_util import FaceTensorConverter, PngStripWriter
+from gfpgan.inference_graph import is_inference_checkpoint, load_inference_checkpoint
+from gfpgan.jit_cache import TracedNetwork, weights_hash
+from gfpgan.onnx_utils import OnnxRuntimeNetwork, export_onnx, onnx_cache_path
+from gfpgan.oom import is_oom_error
+from gfpgan.precision import (cast_network, check_precision, make_probe_faces, network_input, precision_context,
+                              to_channels_last)
+from gfpgan.quantization import is_quantized_checkpoint, load_quantized_checkpoint
+from gfpgan.stage_cache import content_hash
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the smallest detection size and background tile size of the out-of-memory retries
+MIN_DET_MAX_SIDE = 256
+MIN_BG_TILE_SIZE = 32
 
 
 class GFPGANer():
@@ -22,127 +36,624 @@ class GFPGANer():
     Finally, the faces will be pasted back to the upsample background image.
 
     Args:
-        model_path (str): The path to the GFPGAN model. It can be urls (will first download it automatically).
+        model_path (str): The path to the GFPGAN model. It can be urls (will first download it automatically). It can
+            also be a weight bundle from scripts/pack_bundle.py, which is memory-mapped and also provides the face
+            detection and parsing models, or an inference graph of the clean or original arch from
+            scripts/optimize_gfpgan.py.
         upscale (float): The upscale of the final output. Default: 2.
         arch (str): The GFPGAN architecture. Option: clean | original. Default: clean.
         channel_multiplier (int): Channel multiplier for large networks of StyleGAN2. Default: 2.
         bg_upsampler (nn.Module): The upsampler for the background. Default: None.
+        device (torch.device): The device to run on. Default: None (cuda if available, otherwise cpu).
+        face_batch_size (int): Number of faces restored in one forward. Default: 1.
+        precision (str): Precision of the GFPGAN forward. Option: fp32 | bf16_autocast | bf16 | int8. bf16_autocast
+            keeps float32 weights and runs convolutions and matmuls in bfloat16; bf16 stores the weights in bfloat16.
+            int8 runs on cpu and needs the clean arch and a quantized checkpoint from scripts/quantize_gfpgan.py as
+            model_path. Default: fp32.
+        precision_psnr (float | None): Minimum PSNR (dB) of the bf16 outputs against the fp32 outputs, checked once
+            at initialization. Fall back to fp32 if it is not reached. None disables the check. Default: 35.
+        jit_trace (bool): Run GFPGAN as a TorchScript graph traced for the 512x512 inputs. The graphs are cached in
+            jit_cache_dir, keyed by the weights hash and the torch version. Fall back to eager mode on failure.
+            Default: False.
+        jit_cache_dir (str | None): Folder of the traced graphs. Default: None (gfpgan/weights/jit).
+        backend (str): The runtime of GFPGAN. Option: torch | onnxruntime. onnxruntime runs an ONNX export of the
+            network on cpu, with fixed noise buffers; it supports the clean and RestoreFormer archs in fp32.
+            Default: torch.
+        onnx_path (str | None): Path of the ONNX model for the onnxruntime backend. It is exported from model_path
+            if it does not exist. Default: None (model_path with the .onnx extension, keyed by the weights hash, the
+            arch, the channel multiplier and the opset version).
+        channels_last (bool): Run GFPGAN in the channels_last memory format, which is faster with oneDNN on cpu and
+            with tensor cores on cuda. The modulated convolutions of the StyleGAN2 decoder keep it with a face batch
+            size of 1, and in the low resolution layers (fused modulation) for larger batches. Default: False.
+        face_triage (FaceTriage | None): Select the faces to restore, by their size and sharpness. The skipped faces
+            keep their crop as restored face and are not pasted back. Their indices and reasons are in
+            ``skipped_faces`` after each enhance. Default: None (restore all the faces).
+        mask_mode (str): The masks that blend the restored faces into the background. Option: parse | ellipse |
+            square. parse masks the face regions with a face parsing network, run on a batch of faces per image;
+            ellipse and square are precomputed feathered masks, which skip face parsing. Default: parse.
+        stage_cache (StageCache | None): Memoize the face detection, the restored faces and the upsampled
+            background across enhance calls, e.g., to reprocess an image with other parameters. It can be shared by
+            several GFPGANers. Default: None.
+        randomize_noise (bool): Draw new noise for the noise injection of the StyleGAN2 decoder in each forward.
+            False uses the fixed noise buffers of the decoder (one per resolution, broadcast over the batch), which
+            makes the outputs reproducible and saves a noise allocation and RNG pass per layer; the onnxruntime
+            backend always does. Default: True.
+        profiler (StageProfiler | None): Record the wall time, CPU time and peak memory delta of each stage of
+            enhance (read, detect, align, triage, restore per face batch, bg_upsample, inverse_affine, paste), in
+            ``profiler.records`` and to its sink. Default: None.
+        aligned_only (bool): Only restore aligned faces, with restore_faces. The face helper, with its detection and
+            parsing models, is not built, and enhance is not available. Default: False.
+
+    Out-of-memory errors are retried with less memory: the face batch is halved, the background tiles of the
+    bg_upsampler are halved, and the detection is run on a downscaled copy. Each retry (and each face left
+    unrestored when a single face does not fit) is printed, listed in ``downgrades`` after each enhance, and recorded
+    as a ``downgrade`` event by the profiler. The faces left unrestored, by out of memory or another error of the
+    network, keep their crop and their indices are listed in ``failed_faces`` after each enhance.
     """
 
-    def __init__(self, model_path, upscale=2, arch='clean', channel_multiplier=2, bg_upsampler=None, device=None):
+    def __init__(self,
+                 model_path,
+                 upscale=2,
+                 arch='clean',
+                 channel_multiplier=2,
+                 bg_upsampler=None,
+                 device=None,
+                 face_batch_size=1,
+                 precision='fp32',
+                 precision_psnr=35.,
+                 jit_trace=False,
+                 jit_cache_dir=None,
+                 backend='torch',
+                 onnx_path=None,
+                 channels_last=False,
+                 face_triage=None,
+                 mask_mode='parse',
+                 stage_cache=None,
+                 randomize_noise=True,
+                 profiler=None,
+                 aligned_only=False):
         self.upscale = upscale
+        self.profiler = profiler
+        self.randomize_noise = randomize_noise
         self.bg_upsampler = bg_upsampler
+        self.face_batch_size = face_batch_size
+        self.face_triage = face_triage
+        self.skipped_faces = {}
+        self.failed_faces = []
+        self.downgrades = []
+        self.stage_cache = stage_cache
+        self._model_key = None
+        self._detector_key = None
+        self._bg_upsampler_key = None
+        self._input_hash = None
 
         # initialize model
+        if precision == 'int8':
+            # the quantized kernels only run on cpu
+            device = torch.device('cpu') if device is None else device
+            if torch.device(device).type != 'cpu' or arch != 'clean':
+                raise ValueError('int8 precision only supports the clean arch on cpu.')
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu') if device is None else device
-        # initialize the GFP-GAN
-        if arch == 'clean':
-            self.gfpgan = GFPGANv1Clean(
-                out_size=512,
-                num_style_feat=512,
-                channel_multiplier=channel_multiplier,
-                decoder_load_path=None,
-                fix_decoder=False,
-                num_mlp=8,
-                input_is_latent=True,
-                different_w=True,
-                narrow=1,
-                sft_half=True)
-        elif arch == 'bilinear':
-            self.gfpgan = GFPGANBilinear(
-                out_size=512,
-                num_style_feat=512,
-                channel_multiplier=channel_multiplier,
-                decoder_load_path=None,
-                fix_decoder=False,
-                num_mlp=8,
-                input_is_latent=True,
-                different_w=True,
-                narrow=1,
-                sft_half=True)
-        elif arch == 'original':
-            self.gfpgan = GFPGANv1(
-                out_size=512,
-                num_style_feat=512,
-                channel_multiplier=channel_multiplier,
-                decoder_load_path=None,
-                fix_decoder=True,
-                num_mlp=8,
-                input_is_latent=True,
-                different_w=True,
-                narrow=1,
-                sft_half=True)
-        elif arch == 'RestoreFormer':
-            from gfpgan.archs.restoreformer_arch import RestoreFormer
-            self.gfpgan = RestoreFormer()
-        # initialize face helper
-        self.face_helper = FaceRestoreHelper(
-            upscale,
-            face_size=512,
-            crop_ratio=(1, 1),
-            det_model='retinaface_resnet50',
-            save_ext='png',
-            use_parse=True,
-            device=self.device,
-            model_rootpath='gfpgan/weights')
-
         if model_path.startswith('https://'):
             model_path = load_file_from_url(
                 url=model_path, model_dir=os.path.join(ROOT_DIR, 'gfpgan/weights'), progress=True, file_name=None)
-        loadnet = torch.load(model_path)
-        if 'params_ema' in loadnet:
-            keyname = 'params_ema'
+        # memory-mapped, so that only the used weights are read
+        loadnet = load_checkpoint(model_path)
+        # the networks of a bundle are built without initializing their weights, which are then assigned
+        init_context = empty_init_context() if is_bundle(loadnet) else contextlib.nullcontext()
+
+        # initialize the GFP-GAN
+        with init_context:
+            if arch == 'clean':
+                self.gfpgan = GFPGANv1Clean(
+                    out_size=512,
+                    num_style_feat=512,
+                    channel_multiplier=channel_multiplier,
+                    decoder_load_path=None,
+                    fix_decoder=False,
+                    num_mlp=8,
+                    input_is_latent=True,
+                    different_w=True,
+                    narrow=1,
+                    sft_half=True)
+            elif arch == 'bilinear':
+                self.gfpgan = GFPGANBilinear(
+                    out_size=512,
+                    num_style_feat=512,
+                    channel_multiplier=channel_multiplier,
+                    decoder_load_path=None,
+                    fix_decoder=False,
+                    num_mlp=8,
+                    input_is_latent=True,
+                    different_w=True,
+                    narrow=1,
+                    sft_half=True)
+            elif arch == 'original':
+                self.gfpgan = GFPGANv1(
+                    out_size=512,
+                    num_style_feat=512,
+                    channel_multiplier=channel_multiplier,
+                    decoder_load_path=None,
+                    fix_decoder=True,
+                    num_mlp=8,
+                    input_is_latent=True,
+                    different_w=True,
+                    narrow=1,
+                    sft_half=True)
+            elif arch == 'RestoreFormer':
+                from gfpgan.archs.restoreformer_arch import RestoreFormer
+                self.gfpgan = RestoreFormer()
+
+        # initialize face helper
+        if aligned_only:
+            self.face_helper = None
+        elif is_bundle(loadnet):
+            self.face_helper = BundledFaceRestoreHelper(
+                loadnet,
+                upscale,
+                face_size=512,
+                crop_ratio=(1, 1),
+                det_model=loadnet['bundle_meta']['det_model'],
+                save_ext='png',
+                use_parse=mask_mode == 'parse',
+                device=self.device,
+                model_rootpath='gfpgan/weights')
+        else:
+            self.face_helper = FaceRestoreHelper(
+                upscale,
+                face_size=512,
+                crop_ratio=(1, 1),
+                det_model='retinaface_resnet50',
+                save_ext='png',
+                use_parse=mask_mode == 'parse',
+                device=self.device,
+                model_rootpath='gfpgan/weights')
+        if aligned_only:
+            self.face_paster = None
         else:
-            keyname = 'params'
-        self.gfpgan.load_state_dict(loadnet[keyname], strict=True)
+            self.face_paster = FacePaster(
+                self.face_helper.upscale_factor,
+                mask_mode=mask_mode,
+                face_parse=self.face_helper.face_parse if mask_mode == 'parse' else None,
+                device=self.device)
+
+        if is_bundle(loadnet):
+            if precision == 'int8':
+                raise ValueError('int8 precision needs a quantized checkpoint, not a weight bundle.')
+            # the parameters are the mapped tensors of the bundle on cpu (no copy)
+            self.gfpgan = load_network(self.gfpgan, loadnet['gfpgan'], self.device)
+        elif precision == 'int8':
+            if not is_quantized_checkpoint(loadnet):
+                raise ValueError(f'{model_path} is not an int8 checkpoint. Make one with scripts/quantize_gfpgan.py.')
+            self.gfpgan = load_quantized_checkpoint(self.gfpgan, loadnet)
+        elif is_inference_checkpoint(loadnet):
+            self.gfpgan = load_inference_checkpoint(self.gfpgan, loadnet)
+        else:
+            if 'params_ema' in loadnet:
+                keyname = 'params_ema'
+            else:
+                keyname = 'params'
+            self.gfpgan.load_state_dict(loadnet[keyname], strict=True)
         self.gfpgan.eval()
+        if isinstance(self.gfpgan, GFPGANv1Clean):
+            # the restored faces use neither the intermediate rgb images nor the style MLP
+            self.gfpgan.strip_for_inference()
         self.gfpgan = self.gfpgan.to(self.device)
+        self.precision = self._init_precision(precision, precision_psnr)
+        # the quantized convolutions choose their own memory format
+        self.channels_last = channels_last and self.precision != 'int8'
+        if self.channels_last:
+            self.gfpgan = to_channels_last(self.gfpgan)
+        if jit_trace:
+            if jit_cache_dir is None:
+                jit_cache_dir = os.path.join(ROOT_DIR, 'gfpgan/weights/jit')
+            self.traced_gfpgan = TracedNetwork(
+                self.gfpgan,
+                jit_cache_dir,
+                name=f'gfpgan_{arch}',
+                face_size=512,
+                randomize_noise=randomize_noise,
+                extra_key=f'{self.precision}|channels_last={self.channels_last}')
+        else:
+            self.traced_gfpgan = None
+        if backend == 'onnxruntime':
+            if arch not in ('clean', 'RestoreFormer') or self.precision != 'fp32':
+                raise ValueError('The onnxruntime backend supports the clean and RestoreFormer archs in fp32.')
+            if onnx_path is None:
+                onnx_path = onnx_cache_path(
+                    self.gfpgan, model_path, face_size=512, extra_key=f'{arch}|channel_multiplier={channel_multiplier}')
+            if not os.path.isfile(onnx_path):
+                print(f'\tExport GFPGAN to {onnx_path}.')
+                export_onnx(self.gfpgan.cpu(), onnx_path, face_size=512)
+                self.gfpgan = self.gfpgan.to(self.device)
+            self.onnx_gfpgan = OnnxRuntimeNetwork(onnx_path)
+        elif backend == 'torch':
+            self.onnx_gfpgan = None
+        else:
+            raise ValueError(f'Unsupported backend: {backend}. Option: torch | onnxruntime.')
+        # uint8 BGR faces <-> normalized tensor batches, with reused buffers for the 512x512 crops
+        self.face_converter = FaceTensorConverter(face_size=512, device=self.device, channels_last=self.channels_last)
+        if self.stage_cache is not None:
+            # the restored faces depend on the weights as loaded, not on the model path
+            self._model_key = (f'{arch}|{self.precision}|{backend}|randomize_noise={randomize_noise}|'
+                               f'{weights_hash(self.gfpgan)}')
+            # the models of the other stages are also identified by their weights, so that the cache can be shared
+            if self.face_helper is not None:
+                face_det = self.face_helper.face_det
+                self._detector_key = f'{type(face_det).__name__}|{weights_hash(face_det)}'
+            self._bg_upsampler_key = self._bg_upsampler_identity()
+
+    def _bg_upsampler_identity(self):
+        """The settings and the weights hash of a RealESRGANer-like bg_upsampler, or None (the upsampled backgrounds
+        are not cached) if it has no network."""
+        bg_model = getattr(self.bg_upsampler, 'model', None)
+        if not isinstance(bg_model, torch.nn.Module):
+            return None
+        settings = [
+            f'{name}={getattr(self.bg_upsampler, name, None)}' for name in ('scale', 'half', 'tile_pad', 'pre_pad')
+        ]
+        return '|'.join([type(self.bg_upsampler).__name__, type(bg_model).__name__] + settings +
+                        [weights_hash(bg_model)])
 
     @torch.no_grad()
-    def enhance(self, img, has_aligned=False, only_center_face=False, paste_back=True, weight=0.5):
+    def _init_precision(self, precision, precision_psnr):
+        if precision == 'int8':
+            # the quality of a quantized checkpoint is checked when it is made
+            return precision
+        if precision != 'fp32' and precision_psnr is not None:
+            psnr = check_precision(self.gfpgan, precision, make_probe_faces(), device=self.device)
+            if psnr < precision_psnr:
+                print(f'\tPrecision {precision} gives {psnr:.2f} dB PSNR against fp32, lower than {precision_psnr} dB. '
+                      'Fall back to fp32.')
+                return 'fp32'
+        self.gfpgan = cast_network(self.gfpgan, precision)
+        return precision
+
+    def _get_face_landmarks_5(self, only_center_face, eye_dist_threshold, det_max_side):
+        """Detect the faces of face_helper.input_img, on a copy downscaled to det_max_side.
+
+        The boxes and landmarks are mapped back to the input resolution, so that the faces are still aligned and
+        warped from the full-resolution pixels.
+        """
+        input_img = self.face_helper.input_img
+        h, w = input_img.shape[0:2]
+        if det_max_side is None or max(h, w) <= det_max_side:
+            self.face_helper.get_face_landmarks_5(
+                only_center_face=only_center_face, eye_dist_threshold=eye_dist_threshold)
+            return
+        scale = det_max_side / max(h, w)
+        det_w, det_h = max(1, round(w * scale)), max(1, round(h * scale))
+        self.face_helper.input_img = cv2.resize(input_img, (det_w, det_h), interpolation=cv2.INTER_AREA)
+        try:
+            self.face_helper.get_face_landmarks_5(
+                only_center_face=only_center_face, eye_dist_threshold=eye_dist_threshold * scale)
+        finally:
+            self.face_helper.input_img = input_img
+        # back to the input resolution (x1, y1, x2, y2, score) and (x, y)
+        scale_x, scale_y = w / det_w, h / det_h
+        box_scale = np.array([scale_x, scale_y, scale_x, scale_y, 1], dtype=np.float32)
+        self.face_helper.det_faces = [det_face * box_scale for det_face in self.face_helper.det_faces]
+        self.face_helper.all_landmarks_5 = [
+            landmark * np.array([scale_x, scale_y], dtype=np.float32) for landmark in self.face_helper.all_landmarks_5
+        ]
+
+    @contextlib.contextmanager
+    def _profile_call(self):
+        """Start the profiler records of an enhance call, and send them to its sink at the end, also on error."""
+        if self.profiler is None:
+            yield
+            return
+        self.profiler.start()
+        try:
+            yield
+        finally:
+            self.profiler.finish()
+
+    def _stage(self, name, **info):
+        """Record a stage of enhance with the profiler, if any."""
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.stage(name, **info)
+
+    def _downgrade(self, stage, error, **info):
+        """Record how a stage is downgraded after an out-of-memory error, e.g., retried with less memory."""
+        print(f'\tOut of memory in {stage} ({error}): {info}.')
+        self.downgrades.append(dict(stage=stage, **info))
+        if self.profiler is not None:
+            self.profiler.event('downgrade', downgraded_stage=stage, **info)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _detect_faces(self, only_center_face, det_max_side):
+        """Get the face landmarks, on a smaller copy of the input after each out-of-memory error."""
+        while True:
+            try:
+                # eye_dist_threshold=5: skip faces whose eye distance is smaller than 5 pixels (of the input)
+                self._get_face_landmarks_5(only_center_face, eye_dist_threshold=5, det_max_side=det_max_side)
+                return
+            except (RuntimeError, MemoryError) as error:
+                max_side = max(self.face_helper.input_img.shape[0:2]) if det_max_side is None else det_max_side
+                if not is_oom_error(error) or max_side // 2 < MIN_DET_MAX_SIDE:
+                    raise
+                det_max_side = max_side // 2
+                self.face_helper.det_faces = []
+                self.face_helper.all_landmarks_5 = []
+                self._downgrade('detect', error, det_max_side=det_max_side)
+
+    def _upsample_background(self, img, outscale):
+        """Upsample the background, with smaller tiles after each out-of-memory error.
+
+        The tile size of the bg_upsampler is restored afterwards. Note that RealESRGANer catches the errors within
+        its tiles by itself.
+        """
+        tile_size = getattr(self.bg_upsampler, 'tile_size', None)
+        try:
+            while True:
+                try:
+                    return self.bg_upsampler.enhance(img, outscale=outscale)[0]
+                except (RuntimeError, MemoryError) as error:
+                    if not is_oom_error(error) or tile_size is None:
+                        raise
+                    new_tile_size = (self.bg_upsampler.tile_size or max(img.shape[0:2])) // 2
+                    if new_tile_size < MIN_BG_TILE_SIZE:
+                        raise
+                    self.bg_upsampler.tile_size = new_tile_size
+                    self._downgrade('bg_upsample', error, tile_size=new_tile_size)
+        finally:
+            if tile_size is not None:
+                self.bg_upsampler.tile_size = tile_size
+
+    def _restore_faces(self, img, has_aligned, only_center_face, weight, det_max_side):
+        """Detect, align and restore the faces into the face helper.
+
+        Returns:
+            list[int]: The indices of the restored faces, i.e., those not skipped by the face triage.
+        """
+        if self.face_helper is None:
+            raise ValueError('The GFPGANer is built with aligned_only: use restore_faces.')
         self.face_helper.clean_all()
+        self.downgrades = []
 
         if has_aligned:  # the inputs are already aligned
-            img = cv2.resize(img, (512, 512))
+            with self._stage('read'):
+                img = cv2.resize(img, (512, 512))
             self.face_helper.cropped_faces = [img]
         else:
-            self.face_helper.read_image(img)
-            # get face landmarks for each face
-            self.face_helper.get_face_landmarks_5(only_center_face=only_center_face, eye_dist_threshold=5)
-            # eye_dist_threshold=5: skip faces whose eye distance is smaller than 5 pixels
-            # TODO: even with eye_dist_threshold, it will still introduce wrong detections and restorations.
+            with self._stage('read'):
+                self.face_helper.read_image(img)
+            detection = None
+            if self.stage_cache is not None:
+                self._input_hash = content_hash(img)
+                detection_key = (self._input_hash, self._detector_key, only_center_face, det_max_side)
+                detection = self.stage_cache.detection.get(detection_key)
+            if detection is not None:
+                self.face_helper.det_faces = [det_face.copy() for det_face in detection[0]]
+                self.face_helper.all_landmarks_5 = [landmark.copy() for landmark in detection[1]]
+            else:
+                # get face landmarks for each face
+                with self._stage('detect'):
+                    self._detect_faces(only_center_face, det_max_side)
+                # TODO: even with eye_dist_threshold, it will still introduce wrong detections and restorations.
+                if self.stage_cache is not None:
+                    detection = ([det_face.copy() for det_face in self.face_helper.det_faces],
+                                 [landmark.copy() for landmark in self.face_helper.all_landmarks_5])
+                    self.stage_cache.detection.put(detection_key, detection)
             # align and warp each face
-            self.face_helper.align_warp_face()
+            with self._stage('align'):
+                self.face_helper.align_warp_face()
+
+        # face triage: only the faces worth it are sent to the network
+        cropped_faces = self.face_helper.cropped_faces
+        if self.face_triage is not None:
+            with self._stage('triage'):
+                skip_reasons = self.face_triage(cropped_faces, None if has_aligned else self.face_helper.det_faces)
+        else:
+            skip_reasons = [None] * len(cropped_faces)
+        self.skipped_faces = {idx: reason for idx, reason in enumerate(skip_reasons) if reason is not None}
+        restore_indices = [idx for idx, reason in enumerate(skip_reasons) if reason is None]
 
         # face restoration
-        for cropped_face in self.face_helper.cropped_faces:
-            # prepare data
-            cropped_face_t = img2tensor(cropped_face / 255., bgr2rgb=True, float32=True)
-            normalize(cropped_face_t, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
-            cropped_face_t = cropped_face_t.unsqueeze(0).to(self.device)
+        restored_faces = self.restore_faces([cropped_faces[idx] for idx in restore_indices], weight)
+        self.failed_faces = [restore_indices[idx] for idx in self.failed_faces]
+        restored = dict(zip(restore_indices, restored_faces))
+        for idx, cropped_face in enumerate(cropped_faces):
+            self.face_helper.add_restored_face(restored.get(idx, cropped_face.astype('uint8')))
+        return restore_indices
+
+    @torch.no_grad()
+    def restore_faces(self, faces, weight=0.5):
+        """Restore aligned faces with GFPGAN, in batches of face_batch_size, without the face helper.
+
+        The faces in the stage cache are not restored again. After an out-of-memory error, the batch size is halved.
+        A face that fails to be restored (out of memory with a single face, or another error of the network) keeps
+        its input, and its index is listed in ``failed_faces``.
+
+        Args:
+            faces (list[ndarray]): Aligned 512x512 faces, BGR.
+            weight (float): Weight of the SFT features (for the original arch). Default: 0.5.
+
+        Returns:
+            list[ndarray]: The restored faces, BGR, uint8.
+        """
+        restored = {}
+        face_keys = {}
+        self.failed_faces = []
+        if self.stage_cache is not None:
+            for idx, face in enumerate(faces):
+                face_keys[idx] = (content_hash(face), self._model_key, weight)
+                cached_face = self.stage_cache.faces.get(face_keys[idx])
+                if cached_face is not None:
+                    restored[idx] = cached_face.copy()
+        # the faces that are not cached
+        remaining_indices = [idx for idx in range(len(faces)) if idx not in restored]
+        batch_size = self.face_batch_size
+        while remaining_indices:
+            batch_indices = remaining_indices[:batch_size]
+            batch = [faces[idx] for idx in batch_indices]
+            with self._stage('restore', faces=batch_indices):
+                try:
+                    # prepare data
+                    cropped_faces_t = network_input(self.face_converter.to_tensor(batch), self.precision)
+                    with precision_context(self.precision, self.device):
+                        if self.onnx_gfpgan is not None:
+                            output = self.onnx_gfpgan(cropped_faces_t)
+                        elif self.traced_gfpgan is not None:
+                            output = self.traced_gfpgan(cropped_faces_t)
+                        else:
+                            output = self.gfpgan(
+                                cropped_faces_t, return_rgb=False, weight=weight,
+                                randomize_noise=self.randomize_noise)[0]
+                    # convert to images
+                    restored_faces = self.face_converter.to_images(output, min_max=(-1, 1))
+                    if self.stage_cache is not None:
+                        for idx, restored_face in zip(batch_indices, restored_faces):
+                            self.stage_cache.faces.put(face_keys[idx], restored_face.copy())
+                except (RuntimeError, MemoryError) as error:
+                    if is_oom_error(error) and len(batch_indices) > 1:
+                        # retry, and restore the next faces, with half the batch size
+                        output = cropped_faces_t = None
+                        batch_size = len(batch_indices) // 2
+                        self._downgrade('restore', error, face_batch_size=batch_size)
+                        continue
+                    if is_oom_error(error):
+                        self._downgrade('restore', error, unrestored_faces=batch_indices)
+                    else:
+                        print(f'\tFailed inference for GFPGAN ({error}): faces {batch_indices} are not restored.')
+                    self.failed_faces.extend(batch_indices)
+                    restored_faces = [cropped_face.astype('uint8') for cropped_face in batch]
+
+            for idx, restored_face in zip(batch_indices, restored_faces):
+                restored[idx] = restored_face
+            remaining_indices = remaining_indices[len(batch_indices):]
+        return [restored[idx] for idx in range(len(faces))]
+
+    @torch.no_grad()
+    def enhance(self, img, has_aligned=False, only_center_face=False, paste_back=True, weight=0.5, det_max_side=None):
+        """Restore the faces of an image.
+
+        Args:
+            det_max_side (int | None): Detect the faces on a copy of the input downscaled to this max side, which is
+                much faster for large photos. The faces are still aligned on the input image. None detects at the
+                input resolution. Default: None.
+        """
+        with self._profile_call():
+            restore_indices = self._restore_faces(img, has_aligned, only_center_face, weight, det_max_side)
+
+            restored_img = None
+            if not has_aligned and paste_back:
+                # upsample the background
+                if self.bg_upsampler is not None:
+                    bg_img = None
+                    use_cache = self.stage_cache is not None and self._bg_upsampler_key is not None
+                    if use_cache:
+                        bg_key = (self._input_hash, self._bg_upsampler_key, self.upscale,
+                                  getattr(self.bg_upsampler, 'tile_size', None))
+                        bg_img = self.stage_cache.background.get(bg_key)
+                    if bg_img is None:
+                        # Now only support RealESRGAN for upsampling background
+                        with self._stage('bg_upsample'):
+                            bg_img = self._upsample_background(img, self.upscale)
+                        if use_cache:
+                            self.stage_cache.background.put(bg_key, bg_img)
+                else:
+                    bg_img = None
+
+                with self._stage('inverse_affine'):
+                    self.face_helper.get_inverse_affine(None)
+                # paste each restored face to the input image, within its bounding region. The skipped faces stay as in
+                # the background
+                with self._stage('paste'):
+                    restored_img = self.face_paster.paste(
+                        self.face_helper.input_img, [self.face_helper.restored_faces[idx] for idx in restore_indices],
+                        [self.face_helper.inverse_affine_matrices[idx] for idx in restore_indices],
+                        upsample_img=bg_img)
+
+        return self.face_helper.cropped_faces, self.face_helper.restored_faces, restored_img
+
+    @torch.no_grad()
+    def enhance_to_file(self,
+                        img,
+                        save_path,
+                        only_center_face=False,
+                        weight=0.5,
+                        det_max_side=None,
+                        strip_height=512,
+                        strip_pad=16):
+        """Restore the faces of an image and write the output to a PNG file, strip by strip.
+
+        The background is upsampled one strip at a time (with the bg_upsampler, or resized), the restored faces are
+        pasted into the strips they overlap, and each strip is encoded right away. Beside the input image and the
+        faces, the peak memory is set by strip_height, not by the output size. The output matches enhance up to the
+        borders of the bg_upsampler tiles.
+
+        Args:
+            img (ndarray): The input image, BGR(A).
+            save_path (str): Path of the PNG output.
+            det_max_side (int | None): See enhance. Default: None.
+            strip_height (int): Height of the output strips. Default: 512.
+            strip_pad (int): Input rows added on both sides of each strip for the upsampling, so that the strips
+                join seamlessly. Default: 16.
 
+        Returns:
+            tuple[int]: The (height, width) of the output.
+        """
+        if os.path.splitext(save_path)[1].lower() != '.png':
+            raise ValueError(f'enhance_to_file only writes PNG files, got {save_path}.')
+        with self._profile_call():
+            restore_indices = self._restore_faces(img, False, only_center_face, weight, det_max_side)
+            with self._stage('inverse_affine'):
+                self.face_helper.get_inverse_affine(None)
+            restored_faces = [self.face_helper.restored_faces[idx] for idx in restore_indices]
+            inverse_affines = [self.face_helper.inverse_affine_matrices[idx] for idx in restore_indices]
+            with self._stage('masks'):
+                masks = self.face_paster.masks(restored_faces)
+
+            # the bg_upsampler works on the original image, the resize on the converted one (as in enhance)
+            src_img = img if self.bg_upsampler is not None else self.face_helper.input_img
+            h, w = src_img.shape[0:2]
+            upscale = self.face_helper.upscale_factor
+            h_up, w_up = int(h * upscale), int(w * upscale)
+            writer = None
             try:
-                output = self.gfpgan(cropped_face_t, return_rgb=False, weight=weight)[0]
-                # convert to image
-                restored_face = tensor2img(output.squeeze(0), rgb2bgr=True, min_max=(-1, 1))
-            except RuntimeError as error:
-                print(f'\tFailed inference for GFPGAN: {error}.')
-                restored_face = cropped_face
-
-            restored_face = restored_face.astype('uint8')
-            self.face_helper.add_restored_face(restored_face)
-
-        if not has_aligned and paste_back:
-            # upsample the background
-            if self.bg_upsampler is not None:
-                # Now only support RealESRGAN for upsampling background
-                bg_img = self.bg_upsampler.enhance(img, outscale=self.upscale)[0]
-            else:
-                bg_img = None
+                for y0 in range(0, h_up, strip_height):
+                    y1 = min(y0 + strip_height, h_up)
+                    with self._stage('bg_upsample', rows=(y0, y1)):
+                        strip = self._upsample_strip(src_img, y0, y1, (h_up, w_up), strip_pad)
+                    with self._stage('paste', rows=(y0, y1)):
+                        self.face_paster.paste_to_region(strip, (0, y0), restored_faces, inverse_affines, masks=masks)
+                    if writer is None:
+                        bit_depth = 8 if strip.dtype == np.uint8 else 16
+                        writer = PngStripWriter(save_path, w_up, h_up, channels=strip.shape[2], bit_depth=bit_depth)
+                    with self._stage('write', rows=(y0, y1)):
+                        writer.write(strip)
+            finally:
+                if writer is not None:
+                    writer.close()
+        return h_up, w_up
 
-            self.face_helper.get_inverse_affine(None)
-            # paste each restored face to the input image
-            restored_img = self.face_helper.paste_faces_to_input_image(upsample_img=bg_img)
-            return self.face_helper.cropped_faces, self.face_helper.restored_faces, restored_img
-        else:
-            return self.face_helper.cropped_faces, self.face_helper.restored_faces, None
+    def _upsample_strip(self, img, y0, y1, out_size, strip_pad):
+        """The rows [y0, y1) of the upsampled background of img, with out_size (h, w)."""
+        h, w = img.shape[0:2]
+        h_up, w_up = out_size
+        # the input rows of the strip, with a margin for the interpolation and the receptive field of the upsampler
+        src_y0 = max(int(y0 * h / h_up) - strip_pad, 0)
+        src_y1 = min(int(np.ceil(y1 * h / h_up)) + strip_pad, h)
+        src = img[src_y0:src_y1]
+        if self.bg_upsampler is not None:
+            src = self._upsample_background(src, self.face_helper.upscale_factor)
+        # output pixel -> input pixel (as cv2.resize) -> pixel of the (upsampled) input rows
+        scale_x = w / w_up * src.shape[1] / w
+        scale_y = h / h_up * src.shape[0] / (src_y1 - src_y0)
+        matrix = np.array([[scale_x, 0, 0.5 * scale_x - 0.5],
+                           [0, scale_y, (y0 + 0.5) * scale_y - src_y0 * src.shape[0] / (src_y1 - src_y0) - 0.5]])
+        strip = cv2.warpAffine(
+            src,
+            matrix,
+            dsize=(w_up, y1 - y0),
+            flags=cv2.INTER_LANCZOS4 | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_REPLICATE)
+        if strip.ndim == 2:  # gray image
+            strip = cv2.cvtColor(strip, cv2.COLOR_GRAY2BGR)
+        if not np.issubdtype(strip.dtype, np.integer):
+            strip = np.clip(np.rint(strip), 0, 255).astype(np.uint8)
+        return strip
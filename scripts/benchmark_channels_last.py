@@ -0,0 +1,102 @@
+import argparse
+import copy
+import time
+import torch
+from collections import defaultdict
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.archs.restoreformer_arch import RestoreFormer
+from gfpgan.archs.stylegan2_clean_arch import StyleGAN2GeneratorClean
+from gfpgan.precision import to_channels_last
+
+
+class LayerTimer():
+    """Accumulate the forward time of the leaf modules (and the modulated convolutions), per module type."""
+
+    def __init__(self, net):
+        self.times = defaultdict(float)
+        self.handles = []
+        self._starts = {}
+        for module in net.modules():
+            if len(list(module.children())) == 0 or type(module).__name__ == 'ModulatedConv2d':
+                self.handles.append(module.register_forward_pre_hook(self._pre_hook))
+                self.handles.append(module.register_forward_hook(self._hook))
+
+    def _pre_hook(self, module, inputs):
+        self._starts[id(module)] = time.perf_counter()
+
+    def _hook(self, module, inputs, output):
+        self.times[type(module).__name__] += time.perf_counter() - self._starts.pop(id(module))
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+
+
+def build_network(arch, size):
+    if arch == 'clean':
+        net = GFPGANv1Clean(
+            out_size=size,
+            num_style_feat=512,
+            channel_multiplier=2,
+            decoder_load_path=None,
+            fix_decoder=False,
+            num_mlp=8,
+            input_is_latent=True,
+            different_w=True,
+            narrow=1,
+            sft_half=True)
+        forward = lambda net, x: net(x, return_rgb=False, randomize_noise=False)[0]  # noqa: E731
+        x = torch.rand(1, 3, size, size) * 2 - 1
+    elif arch == 'stylegan2':
+        net = StyleGAN2GeneratorClean(out_size=size, num_style_feat=512, num_mlp=8, channel_multiplier=2)
+        forward = lambda net, x: net([x], input_is_latent=True, randomize_noise=False)[0]  # noqa: E731
+        x = torch.randn(1, 512)
+    else:
+        net = RestoreFormer()
+        forward = lambda net, x: net(x)[0]  # noqa: E731
+        x = torch.rand(1, 3, size, size) * 2 - 1
+    return net.eval(), forward, x
+
+
+@torch.no_grad()
+def profile(net, forward, x, repeat):
+    """Return the output, the time per forward (ms) and the time per module type (ms)."""
+    output = forward(net, x)  # warm up
+    timer = LayerTimer(net)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        output = forward(net, x)
+    total = (time.perf_counter() - start) / repeat * 1000
+    timer.remove()
+    return output, total, {key: value / repeat * 1000 for key, value in timer.times.items()}
+
+
+if __name__ == '__main__':
+    """Per-layer timing of the archs in the default (NCHW) and channels_last (NHWC) memory formats.
+
+    The per-layer times include the hook overhead and, for container modules (ModulatedConv2d), their children.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--arch', type=str, default='clean', choices=['clean', 'stylegan2', 'RestoreFormer'])
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    net, forward, x = build_network(args.arch, args.size)
+    net, x = net.to(device), x.to(device)
+    cl_net = to_channels_last(copy.deepcopy(net))
+    cl_x = x.contiguous(memory_format=torch.channels_last) if x.dim() == 4 else x
+
+    ref, ref_total, ref_layers = profile(net, forward, x, args.repeat)
+    out, cl_total, cl_layers = profile(cl_net, forward, cl_x, args.repeat)
+
+    print(f'{"layer":>20} | {"NCHW (ms)":>10} | {"NHWC (ms)":>10} | {"speedup":>7}')
+    for key in sorted(ref_layers, key=ref_layers.get, reverse=True):
+        print(f'{key:>20} | {ref_layers[key]:>10.2f} | {cl_layers.get(key, 0):>10.2f} | '
+              f'{ref_layers[key] / max(cl_layers.get(key, 0), 1e-9):>6.2f}x')
+    print(f'{"total":>20} | {ref_total:>10.2f} | {cl_total:>10.2f} | {ref_total / cl_total:>6.2f}x')
+    print(f'Output in channels_last: {out.is_contiguous(memory_format=torch.channels_last)}, '
+          f'max abs diff: {(out - ref).abs().max().item():.2e}')
@@ -0,0 +1,57 @@
+import argparse
+import numpy as np
+import time
+import torch
+from basicsr.utils import img2tensor, tensor2img
+from torchvision.transforms.functional import normalize
+
+from gfpgan.img_util import FaceTensorConverter
+
+
+def reference_to_tensor(faces, device):
+    faces_t = []
+    for face in faces:
+        face_t = img2tensor(face / 255., bgr2rgb=True, float32=True)
+        normalize(face_t, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
+        faces_t.append(face_t.unsqueeze(0).to(device))
+    return faces_t
+
+
+def reference_to_images(outputs):
+    return [tensor2img(output.squeeze(0), rgb2bgr=True, min_max=(-1, 1)).astype('uint8') for output in outputs]
+
+
+def timeit(func, repeat):
+    func()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+if __name__ == '__main__':
+    """Compare the per-face pre/post-processing in GFPGANer with FaceTensorConverter."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--face_size', type=int, default=512)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    converter = FaceTensorConverter(face_size=args.face_size, device=device)
+    print(f'{"batch":>5} | {"stage":>11} | {"reference (ms)":>14} | {"fused (ms)":>10} | {"speedup":>7}')
+    for batch_size in args.batch_size:
+        faces = [np.random.randint(0, 256, (args.face_size, args.face_size, 3), dtype=np.uint8)] * batch_size
+        outputs = [torch.rand(1, 3, args.face_size, args.face_size, device=device) * 2 - 1] * batch_size
+        output = torch.cat(outputs, 0)
+
+        stages = {
+            'pre': (lambda: reference_to_tensor(faces, device), lambda: converter.to_tensor(faces)),
+            'post': (lambda: reference_to_images(outputs), lambda: converter.to_images(output.clone())),
+        }
+        for stage, (reference, fused) in stages.items():
+            ref_time = timeit(reference, args.repeat)
+            fused_time = timeit(fused, args.repeat)
+            print(f'{batch_size:>5} | {stage:>11} | {ref_time:>14.2f} | {fused_time:>10.2f} | '
+                  f'{ref_time / fused_time:>6.2f}x')
@@ -0,0 +1,47 @@
+import argparse
+import numpy as np
+import time
+import torch
+from facexlib.parsing import init_parsing_model
+
+from gfpgan.face_paste import FacePaster
+
+
+def timeit(func, repeat):
+    func()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+if __name__ == '__main__':
+    """Compare the time per face of the blending masks of each mask_mode, and of the paste-back with them."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_faces', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    face_parse = init_parsing_model(model_name='parsenet', device=device, model_rootpath='gfpgan/weights')
+    faces = [np.random.randint(0, 256, (512, 512, 3), dtype=np.uint8) for _ in range(args.num_faces)]
+    input_img = np.random.randint(0, 256, (1024, 1024, 3), dtype=np.uint8)
+    # the faces scattered on the 2x upsampled image
+    inverse_affines = []
+    for i in range(args.num_faces):
+        inverse_affine = np.array([[0.5, 0, 0], [0, 0.5, 0]])
+        inverse_affine[:, 2] = (i % 4) * 500, (i // 4) * 500
+        inverse_affines.append(inverse_affine)
+
+    pasters = {
+        'parse (1 per forward)': FacePaster(2, 'parse', face_parse=face_parse, device=device, parse_batch_size=1),
+        'parse (batched)': FacePaster(2, 'parse', face_parse=face_parse, device=device, parse_batch_size=8),
+        'ellipse': FacePaster(2, 'ellipse'),
+        'square': FacePaster(2, 'square'),
+    }
+    print(f'{"mask_mode":>21} | {"mask / face (ms)":>16} | {"paste / face (ms)":>17}')
+    for name, paster in pasters.items():
+        mask_time = timeit(lambda: paster.masks(faces), args.repeat) / args.num_faces
+        paste_time = timeit(lambda: paster.paste(input_img, faces, inverse_affines), args.repeat) / args.num_faces
+        print(f'{name:>21} | {mask_time:>16.2f} | {paste_time:>17.2f}')
@@ -0,0 +1,69 @@
+import argparse
+import time
+import torch
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.archs.restoreformer_arch import RestoreFormer
+from gfpgan.jit_cache import RestoredImage
+from gfpgan.onnx_utils import OnnxRuntimeNetwork, export_onnx
+from gfpgan.precision import make_probe_faces
+
+
+def timeit(func, x, repeat):
+    func(x)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(x)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+if __name__ == '__main__':
+    """Export GFPGANv1Clean (e.g., GFPGANv1.3/1.4) or RestoreFormer to ONNX, then compare with PyTorch.
+
+    The ONNX model can be used with GFPGANer(..., backend='onnxruntime', onnx_path=...).
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', type=str, default='experiments/pretrained_models/GFPGANv1.4.pth')
+    parser.add_argument('--arch', type=str, default='clean', help='clean | RestoreFormer')
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--save_path', type=str, default=None, help='Default: model_path with .onnx')
+    parser.add_argument('--opset_version', type=int, default=17)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.arch == 'clean':
+        net = GFPGANv1Clean(
+            out_size=512,
+            num_style_feat=512,
+            channel_multiplier=args.channel_multiplier,
+            decoder_load_path=None,
+            fix_decoder=False,
+            num_mlp=8,
+            input_is_latent=True,
+            different_w=True,
+            narrow=1,
+            sft_half=True)
+    elif args.arch == 'RestoreFormer':
+        net = RestoreFormer()
+    else:
+        raise ValueError(f'Unsupported arch: {args.arch}.')
+    loadnet = torch.load(args.model_path, map_location='cpu')
+    net.load_state_dict(loadnet['params_ema'] if 'params_ema' in loadnet else loadnet['params'], strict=True)
+    net.eval()
+
+    save_path = args.save_path if args.save_path is not None else args.model_path.rsplit('.', 1)[0] + '.onnx'
+    export_onnx(net, save_path, face_size=512, opset_version=args.opset_version)
+    print(f'Save to {save_path}.')
+
+    # check and benchmark with the same (fixed) noise
+    ort_net = OnnxRuntimeNetwork(save_path)
+    x = make_probe_faces(num=1, size=512)
+    torch_net = RestoredImage(net, randomize_noise=False).eval()
+    with torch.no_grad():
+        ref = torch_net(x)
+        out = ort_net(x)
+        print(f'Max abs difference against PyTorch: {(out - ref).abs().max().item():.2e}')
+        torch_time = timeit(torch_net, x, args.repeat)
+        ort_time = timeit(ort_net, x, args.repeat)
+    print(f'PyTorch: {torch_time:.1f} ms/face, ONNX Runtime: {ort_time:.1f} ms/face, '
+          f'speedup: {torch_time / ort_time:.2f}x')
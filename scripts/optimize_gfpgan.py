@@ -0,0 +1,91 @@
+import argparse
+import copy
+import os
+import sys
+import time
+import torch
+
+from gfpgan.archs.gfpganv1_arch import GFPGANv1
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.inference_graph import check_equivalence, optimize_gfpgan, save_inference_checkpoint
+from gfpgan.precision import make_probe_faces
+
+
+@torch.no_grad()
+def timeit(net, faces, batch_size):
+    """Time per face (ms) of the forward, with the fixed noise."""
+    net(faces[:batch_size], return_rgb=False, randomize_noise=False)  # warm up
+    start = time.perf_counter()
+    for idx in range(0, faces.size(0), batch_size):
+        net(faces[idx:idx + batch_size], return_rgb=False, randomize_noise=False)
+    return (time.perf_counter() - start) / faces.size(0) * 1000
+
+
+if __name__ == '__main__':
+    """Rewrite a GFPGAN model (clean or original arch) into its inference graph (gfpgan.inference_graph).
+
+    The SFT condition branches and the style layers are merged, and the equalized learning rate scales of the
+    original arch are folded into the weights. The checkpoint is saved only if the restored faces are the same as
+    the ones of the model, up to atol. It can be used with GFPGANer(..., arch='clean' | 'original').
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', type=str, default='experiments/pretrained_models/GFPGANv1.4.pth')
+    parser.add_argument('--arch', type=str, default='clean', help='clean | original')
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--num_faces', type=int, default=4, help='Number of probe faces of the equivalence check')
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--atol', type=float, default=1e-3, help='Maximum absolute difference of the outputs')
+    parser.add_argument('--save_path', type=str, default=None, help='Default: model_path with the -inference suffix')
+    args = parser.parse_args()
+
+    if args.arch == 'clean':
+        net = GFPGANv1Clean(
+            out_size=512,
+            num_style_feat=512,
+            channel_multiplier=args.channel_multiplier,
+            decoder_load_path=None,
+            fix_decoder=False,
+            num_mlp=8,
+            input_is_latent=True,
+            different_w=True,
+            narrow=1,
+            sft_half=True)
+    elif args.arch == 'original':
+        net = GFPGANv1(
+            out_size=512,
+            num_style_feat=512,
+            channel_multiplier=args.channel_multiplier,
+            decoder_load_path=None,
+            fix_decoder=True,
+            num_mlp=8,
+            input_is_latent=True,
+            different_w=True,
+            narrow=1,
+            sft_half=True)
+    else:
+        raise ValueError(f'Wrong arch: {args.arch}. Option: clean | original.')
+    loadnet = torch.load(args.model_path, map_location='cpu')
+    net.load_state_dict(loadnet['params_ema'] if 'params_ema' in loadnet else loadnet['params'], strict=True)
+    net.eval()
+    save_path = args.save_path
+    if save_path is None:
+        save_path = f'{os.path.splitext(args.model_path)[0]}-inference.pth'
+
+    inference_net = optimize_gfpgan(copy.deepcopy(net))
+    num_modules = sum(1 for _ in net.modules())
+    num_inference_modules = sum(1 for _ in inference_net.modules())
+    print(f'Modules: {num_modules} -> {num_inference_modules}')
+
+    faces = make_probe_faces(args.num_faces)
+    max_diff = check_equivalence(net, inference_net, faces, batch_size=args.batch_size)
+    print(f'Maximum absolute difference of the outputs: {max_diff:.3g} (atol: {args.atol:.3g})')
+    if max_diff > args.atol:
+        print('The inference graph is not equivalent to the model. Not saved.')
+        sys.exit(1)
+    save_inference_checkpoint(inference_net, save_path)
+    print(f'Save to {save_path}.')
+
+    ref_time = timeit(net, faces, args.batch_size)
+    inference_time = timeit(inference_net, faces, args.batch_size)
+    print(f'Model: {ref_time:.1f} ms/face, inference graph: {inference_time:.1f} ms/face '
+          f'({ref_time / inference_time:.2f}x)')
@@ -0,0 +1,61 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from gfpgan.bundle import pack_bundle
+
+# cold start of a new process: read the weights and build the restorer (no bg upsampler), after the imports
+COLD_START = """
+import time
+from gfpgan import GFPGANer
+start = time.perf_counter()
+restorer = GFPGANer(model_path='{model_path}', upscale=2, arch='{arch}', channel_multiplier={channel_multiplier},
+                    device='cpu', precision_psnr=None)
+print(time.perf_counter() - start)
+"""
+
+
+def cold_start(model_path, arch, channel_multiplier):
+    code = COLD_START.format(model_path=model_path, arch=arch, channel_multiplier=channel_multiplier)
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    """Pack the GFPGAN, face detection, face parsing and RealESRGAN weights into one memory-mappable bundle.
+
+    The bundle can be used as model_path of GFPGANer, and with gfpgan.bundle.build_bg_upsampler for the background.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', type=str, default='experiments/pretrained_models/GFPGANv1.4.pth')
+    parser.add_argument('--arch', type=str, default='clean')
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--det_model', type=str, default='retinaface_resnet50')
+    parser.add_argument('--detector_path', type=str, default='gfpgan/weights/detection_Resnet50_Final.pth')
+    parser.add_argument('--parser_path', type=str, default='gfpgan/weights/parsing_parsenet.pth')
+    parser.add_argument('--bg_upsampler_path', type=str, default=None, help='e.g., RealESRGAN_x2plus.pth')
+    parser.add_argument('--bg_upsampler_scale', type=int, default=2)
+    parser.add_argument('--save_path', type=str, default='experiments/pretrained_models/GFPGANv1.4-bundle.pth')
+    parser.add_argument('--benchmark', action='store_true', help='Compare the cold start with the original weights')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    pack_bundle(
+        args.save_path,
+        args.model_path,
+        detector_path=args.detector_path,
+        parser_path=args.parser_path,
+        bg_upsampler_path=args.bg_upsampler_path,
+        arch=args.arch,
+        channel_multiplier=args.channel_multiplier,
+        det_model=args.det_model,
+        bg_upsampler_scale=args.bg_upsampler_scale)
+    print(f'Save to {args.save_path} ({os.path.getsize(args.save_path) / 1024**2:.1f} MB) in '
+          f'{time.perf_counter() - start:.1f} s.')
+
+    if args.benchmark:
+        ref_time = cold_start(args.model_path, args.arch, args.channel_multiplier)
+        bundle_time = cold_start(args.save_path, args.arch, args.channel_multiplier)
+        print(f'Cold start: {ref_time:.2f} s with the original weights, {bundle_time:.2f} s with the bundle.')
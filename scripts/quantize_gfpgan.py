@@ -0,0 +1,78 @@
+import argparse
+import copy
+import numpy as np
+import os
+import time
+import torch
+from basicsr.metrics.psnr_ssim import calculate_psnr
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.img_util import FaceTensorConverter
+from gfpgan.quantization import (count_quantized_modules, quantize_gfpgan_clean, read_aligned_faces,
+                                 save_quantized_checkpoint)
+
+
+@torch.no_grad()
+def run(net, faces, batch_size):
+    """Return the uint8 outputs and the time per face (ms)."""
+    converter = FaceTensorConverter(face_size=faces.size(-1))
+    net(faces[:batch_size], return_rgb=False, randomize_noise=False)  # warm up
+    outputs = []
+    start = time.perf_counter()
+    for idx in range(0, faces.size(0), batch_size):
+        output = net(faces[idx:idx + batch_size], return_rgb=False, randomize_noise=False)[0]
+        outputs.extend(converter.to_images(output))
+    return outputs, (time.perf_counter() - start) / faces.size(0) * 1000
+
+
+def checkpoint_size(state_dict_path):
+    return os.path.getsize(state_dict_path) / 1024**2
+
+
+if __name__ == '__main__':
+    """Post-training int8 quantization of a clean GFPGAN model (e.g., GFPGANv1.3/1.4) for cpu inference.
+
+    The quantized checkpoint can be used with GFPGANer(..., arch='clean', precision='int8').
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', type=str, default='experiments/pretrained_models/GFPGANv1.4.pth')
+    parser.add_argument('--calib_dir', type=str, required=True, help='Folder of aligned faces for calibration')
+    parser.add_argument('--num_calib', type=int, default=32)
+    parser.add_argument('--eval_dir', type=str, default=None, help='Folder of aligned faces for evaluation')
+    parser.add_argument('--num_eval', type=int, default=8)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--save_path', type=str, default='experiments/pretrained_models/GFPGANv1.4-int8.pth')
+    args = parser.parse_args()
+
+    net = GFPGANv1Clean(
+        out_size=512,
+        num_style_feat=512,
+        channel_multiplier=args.channel_multiplier,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=1,
+        sft_half=True)
+    loadnet = torch.load(args.model_path, map_location='cpu')
+    net.load_state_dict(loadnet['params_ema'] if 'params_ema' in loadnet else loadnet['params'], strict=True)
+    net.eval()
+
+    calib_faces = read_aligned_faces(args.calib_dir, max_num=args.num_calib)
+    eval_dir = args.calib_dir if args.eval_dir is None else args.eval_dir
+    eval_faces = read_aligned_faces(eval_dir, max_num=args.num_eval)
+    print(f'Calibrate with {calib_faces.size(0)} faces, evaluate with {eval_faces.size(0)} faces.')
+
+    quant_net = quantize_gfpgan_clean(copy.deepcopy(net), calib_faces)
+    print(f'Quantized modules: {count_quantized_modules(quant_net)}')
+    save_quantized_checkpoint(quant_net, args.save_path)
+    print(f'Save to {args.save_path}.')
+
+    ref_outputs, ref_time = run(net, eval_faces, args.batch_size)
+    outputs, quant_time = run(quant_net, eval_faces, args.batch_size)
+    psnr = np.mean([calculate_psnr(out, ref, crop_border=0) for out, ref in zip(outputs, ref_outputs)])
+    print(f'fp32: {ref_time:.1f} ms/face, {checkpoint_size(args.model_path):.1f} MB')
+    print(f'int8: {quant_time:.1f} ms/face, {checkpoint_size(args.save_path):.1f} MB')
+    print(f'Speedup: {ref_time / quant_time:.2f}x, PSNR against fp32: {psnr:.2f} dB')
@@ -104,4 +104,10 @@ if __name__ == '__main__':
         license='Apache License Version 2.0',
         setup_requires=['cython', 'numpy'],
         install_requires=get_requirements(),
+        entry_points={
+            'console_scripts': [
+                'gfpgan-batch=gfpgan.batch_inference:main',
+                'gfpgan-bulk=gfpgan.bulk_inference:main',
+            ]
+        },
         zip_safe=False)
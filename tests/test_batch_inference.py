@@ -0,0 +1,80 @@
+import cv2
+import json
+import numpy as np
+import os
+import pytest
+
+from gfpgan.batch_inference import check_args, main, output_path, parse_args, scan_inputs
+
+
+def test_scan_inputs(tmp_path):
+    """Test walking an input tree and a file list."""
+    for rel_path in ['a/1.png', 'a/b/2.JPG', 'c.jpg', 'notes.txt']:
+        path = tmp_path / 'input' / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'')
+
+    inputs = list(scan_inputs(str(tmp_path / 'input')))
+    expected = ['c.jpg', os.path.join('a', '1.png'), os.path.join('a', 'b', '2.JPG')]
+    assert [rel_path for _, rel_path in inputs] == expected
+    assert inputs[0][0] == str(tmp_path / 'input' / 'c.jpg')
+
+    # file list, relative to its folder
+    (tmp_path / 'list.txt').write_text('input/c.jpg\n\ninput/a/1.png\n')
+    inputs = list(scan_inputs(str(tmp_path / 'list.txt')))
+    assert [rel_path for _, rel_path in inputs] == [os.path.join('input', 'c.jpg'), os.path.join('input', 'a', '1.png')]
+
+    assert output_path(os.path.join('a', '2.JPG'), 'out', 'auto') == os.path.join('out', 'a', '2.jpg')
+    assert output_path(os.path.join('a', '2.JPG'), 'out', 'png') == os.path.join('out', 'a', '2.png')
+
+
+def test_scan_inputs_outside_root(tmp_path):
+    """Test that the inputs outside the input root, which would be written outside the output folder, are rejected."""
+    (tmp_path / 'lists').mkdir()
+    (tmp_path / 'lists' / 'list.txt').write_text(f'../c.jpg\n{tmp_path / "d.jpg"}\n')
+    with pytest.raises(ValueError, match='not under the input root'):
+        list(scan_inputs(str(tmp_path / 'lists' / 'list.txt')))
+    inputs = list(scan_inputs(str(tmp_path / 'lists' / 'list.txt'), input_root=str(tmp_path)))
+    assert [rel_path for _, rel_path in inputs] == ['c.jpg', 'd.jpg']
+
+    with pytest.raises(ValueError, match='not in the output folder'):
+        output_path(os.path.join('..', 'c.jpg'), 'out', 'auto')
+    with pytest.raises(ValueError, match='not in the output folder'):
+        output_path(str(tmp_path / 'c.jpg'), 'out', 'auto')
+
+
+def test_parse_args():
+    args = parse_args(['-i', 'inputs', '-o', 'results', '-w', '4', '--precision', 'bf16'])
+    assert args.workers == 4 and args.threads >= 1
+    assert args.log == os.path.join('results', 'batch_log.jsonl')
+    assert args.precision == 'bf16' and args.mask_mode == 'parse'
+
+
+def test_check_args(tmp_path):
+    """Test that wrong paths are rejected before the workers start."""
+    (tmp_path / 'input').mkdir()
+    (tmp_path / 'model.pth').write_bytes(b'')
+    input_dir, model_path = str(tmp_path / 'input'), str(tmp_path / 'model.pth')
+    args = parse_args(['-i', input_dir, '-o', str(tmp_path / 'out'), '--model_path', model_path])
+    check_args(args)
+    args.model_path = str(tmp_path / 'missing.pth')
+    with pytest.raises(ValueError, match='model_path'):
+        check_args(args)
+    args.input = str(tmp_path / 'missing')
+    with pytest.raises(ValueError, match='input'):
+        check_args(args)
+
+
+def test_main_broken_pool(tmp_path):
+    """Test that the images of a run whose worker cannot build its restorer are logged as errors."""
+    (tmp_path / 'input').mkdir()
+    for name in ('1.png', '2.png'):
+        cv2.imwrite(str(tmp_path / 'input' / name), np.zeros((16, 16, 3), np.uint8))
+    (tmp_path / 'model.pth').write_bytes(b'not a checkpoint')
+    input_dir, output_dir, model_path = str(tmp_path / 'input'), str(tmp_path / 'out'), str(tmp_path / 'model.pth')
+    assert main(['-i', input_dir, '-o', output_dir, '-w', '1', '--model_path', model_path]) == 1
+    with open(tmp_path / 'out' / 'batch_log.jsonl') as f:
+        records = [json.loads(line) for line in f]
+    assert [record['status'] for record in records] == ['error', 'error']
+    assert all('BrokenProcessPool' in record['error'] for record in records)
+    assert not (tmp_path / 'out' / '1.png').exists()
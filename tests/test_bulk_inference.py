@@ -0,0 +1,57 @@
+import cv2
+import io
+import numpy as np
+import tarfile
+
+from gfpgan.bulk_inference import batches, bulk_restore, decode_face, encode_face, prefetch, read_tar
+
+
+class DummyRestorer():
+    """Restore the faces by inverting them. The faces of value 20 fail, and keep their input."""
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.failed_faces = []
+
+    def restore_faces(self, faces, weight=0.5):
+        self.batch_sizes.append(len(faces))
+        self.failed_faces = [idx for idx, face in enumerate(faces) if face[0, 0, 0] == 20]
+        return [face if idx in self.failed_faces else 255 - face for idx, face in enumerate(faces)]
+
+
+def test_prefetch_and_batches():
+    assert list(prefetch(range(10), lambda x: x * 2, num_threads=3, depth=4)) == [x * 2 for x in range(10)]
+    assert list(batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_bulk_restore(tmp_path):
+    """Test restoring a tar shard of aligned faces, in batches and in order."""
+    faces = [np.full((512, 512, 3), i * 10, dtype=np.uint8) for i in range(5)]
+    faces[4] = np.full((256, 256, 3), 40, dtype=np.uint8)  # resized to 512
+    tar_path = tmp_path / 'shard.tar'
+    with tarfile.open(tar_path, 'w') as tar:
+        for i, face in enumerate(faces):
+            data = encode_face(face)
+            info = tarfile.TarInfo(f'faces/{i:08d}.png')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        info = tarfile.TarInfo('faces/broken.png')
+        info.size = 3
+        tar.addfile(info, io.BytesIO(b'abc'))
+
+    records = list(read_tar(str(tar_path)))
+    assert [key for key, _ in records] == [f'faces/{i:08d}' for i in range(5)] + ['faces/broken']
+    key, face = decode_face(records[4])
+    assert face.shape == (512, 512, 3)
+
+    restorer = DummyRestorer()
+    outputs = []
+    counts = bulk_restore(restorer, records, lambda *args: outputs.append(args), batch_size=2, num_threads=2)
+    # the broken record and the face that is not restored are errors, and are not written
+    assert counts == dict(ok=4, error=2)
+    assert restorer.batch_sizes == [2, 2, 1]
+    assert [key for _, key, _ in outputs] == [f'faces/{i:08d}' for i in (0, 1, 3, 4)]
+    for i, (img_byte, _, img_shape) in zip((0, 1, 3, 4), outputs):
+        assert img_shape == (512, 512, 3)
+        restored = cv2.imdecode(np.frombuffer(img_byte, np.uint8), cv2.IMREAD_COLOR)
+        assert np.all(restored == 255 - i * 10)
@@ -0,0 +1,119 @@
+import pytest
+import torch
+from facexlib.detection import RetinaFace, init_detection_model
+from facexlib.parsing import ParseNet
+from facexlib.utils import face_restoration_helper
+
+from gfpgan import bundle as bundle_module
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.bundle import (BundledFaceRestoreHelper, empty_init_context, is_bundle, is_bundle_file, load_bundle,
+                           load_checkpoint, load_network, pack_bundle)
+
+
+def build_network():
+    return GFPGANv1Clean(
+        out_size=32,
+        num_style_feat=256,
+        channel_multiplier=1,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True).eval()
+
+
+def test_bundle(tmp_path):
+    """Test packing the pipeline weights into a bundle, and loading them without copies."""
+    torch.manual_seed(0)
+    net = build_network()
+    gfpgan_path = str(tmp_path / 'gfpgan.pth')
+    # the training checkpoint also has params
+    torch.save({'params_ema': net.state_dict(), 'params': build_network().state_dict()}, gfpgan_path)
+    detector = RetinaFace(network_name='mobile0.25', device='cpu')
+    detector_path = str(tmp_path / 'detector.pth')
+    torch.save({f'module.{k}': v for k, v in detector.state_dict().items()}, detector_path)
+    parser = ParseNet(in_size=512, out_size=512, parsing_ch=19)
+    parser_path = str(tmp_path / 'parser.pth')
+    torch.save(parser.state_dict(), parser_path)
+
+    bundle_path = str(tmp_path / 'bundle.pth')
+    pack_bundle(bundle_path, gfpgan_path, detector_path, parser_path, det_model='retinaface_mobile0.25')
+    bundle = load_bundle(bundle_path)
+    assert is_bundle(bundle)
+    assert not is_bundle(load_checkpoint(gfpgan_path))
+    assert is_bundle_file(bundle_path) and not is_bundle_file(gfpgan_path)
+    assert 'params' not in bundle  # no bg upsampler
+    assert bundle['bundle_meta']['det_model'] == 'retinaface_mobile0.25'
+
+    # the network parameters are the mapped tensors
+    bundled_net = load_network(build_network(), bundle['gfpgan'])
+    for key, value in bundled_net.state_dict().items():
+        assert value.data_ptr() == bundle['gfpgan'][key].data_ptr()
+        assert torch.equal(value, net.state_dict()[key])
+    x = torch.rand(1, 3, 32, 32) * 2 - 1
+    with torch.no_grad():
+        ref = net(x, randomize_noise=False)[0]
+        output = bundled_net(x, randomize_noise=False)[0]
+    assert torch.equal(output, ref)
+
+    # the face helper builds its models from the bundle, without downloading weights
+    face_helper = BundledFaceRestoreHelper(
+        bundle,
+        2,
+        face_size=512,
+        det_model='retinaface_mobile0.25',
+        use_parse=True,
+        device='cpu',
+        model_rootpath=str(tmp_path / 'weights'))
+    for key, value in face_helper.face_det.state_dict().items():
+        assert torch.equal(value, detector.state_dict()[key])
+    for key, value in face_helper.face_parse.state_dict().items():
+        assert value.data_ptr() == bundle['parser'][key].data_ptr()
+    assert not (tmp_path / 'weights').exists()
+    # the facexlib loaders are restored
+    assert face_restoration_helper.init_detection_model is init_detection_model
+    assert face_helper.face_det.device == 'cpu'
+    assert torch.equal(face_helper.face_det.mean_tensor, detector.mean_tensor)
+    img = (torch.rand(64, 64, 3) * 255).numpy().astype('uint8')
+    face_helper.read_image(img)
+    assert face_helper.get_face_landmarks_5() == 0
+
+    # only the RetinaFace detectors can be rebuilt from a bundle
+    with pytest.raises(ValueError):
+        pack_bundle(bundle_path, gfpgan_path, detector_path, parser_path, det_model='YOLOv5l')
+
+
+def test_bundle_without_mmap(tmp_path, monkeypatch):
+    """Test loading a bundle with a torch older than 2.1, which cannot map it: the weights are read and copied."""
+    monkeypatch.setattr(bundle_module, 'INIT_EMPTY_SUPPORTED', False)
+    net = build_network()
+    gfpgan_path = str(tmp_path / 'gfpgan.pth')
+    torch.save({'params_ema': net.state_dict()}, gfpgan_path)
+    parser = ParseNet(in_size=512, out_size=512, parsing_ch=19)
+    parser_path = str(tmp_path / 'parser.pth')
+    torch.save(parser.state_dict(), parser_path)
+    detector = RetinaFace(network_name='mobile0.25', device='cpu')
+    detector_path = str(tmp_path / 'detector.pth')
+    torch.save(detector.state_dict(), detector_path)
+    bundle_path = str(tmp_path / 'bundle.pth')
+    pack_bundle(bundle_path, gfpgan_path, detector_path, parser_path, det_model='retinaface_mobile0.25')
+
+    bundle = load_bundle(bundle_path)
+    with empty_init_context():
+        bundled_net = build_network()
+    bundled_net = load_network(bundled_net, bundle['gfpgan'])
+    for key, value in bundled_net.state_dict().items():
+        assert value.data_ptr() != bundle['gfpgan'][key].data_ptr()
+        assert torch.equal(value, net.state_dict()[key])
+    face_helper = BundledFaceRestoreHelper(
+        bundle,
+        2,
+        face_size=512,
+        det_model='retinaface_mobile0.25',
+        use_parse=True,
+        device='cpu',
+        model_rootpath=str(tmp_path / 'weights'))
+    for key, value in face_helper.face_det.state_dict().items():
+        assert torch.equal(value, detector.state_dict()[key])
+    for key, value in face_helper.face_parse.state_dict().items():
+        assert torch.equal(value, parser.state_dict()[key])
@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+from facexlib.parsing import ParseNet
+
+from gfpgan.face_paste import FacePaster
+
+
+def test_facepaster():
+    """Test the ROI-bounded paste-back against full-frame warps."""
+    rng = np.random.RandomState(0)
+    input_img = rng.randint(0, 256, (100, 120, 3), dtype=np.uint8)
+    faces = [rng.randint(0, 256, (64, 64, 3), dtype=np.uint8) for _ in range(3)]
+    # crop -> upsampled image: rotated and scaled faces, the last one partly outside of the image
+    inverse_affines = []
+    for angle, scale, (x, y) in [(0, 1, (10, 20)), (30, 1.5, (120, 40)), (-10, 1, (200, 150))]:
+        inverse_affine = cv2.getRotationMatrix2D((32, 32), angle, scale)
+        inverse_affine[:, 2] += (x, y)
+        inverse_affines.append(inverse_affine)
+
+    paster = FacePaster(upscale_factor=2)
+    output = paster.paste(input_img, faces, inverse_affines)
+    assert output.shape == (200, 240, 3)
+    assert output.dtype == np.uint8
+    # the inverse affine matrices are not modified
+    assert inverse_affines[0][0, 2] == 10
+
+    ref = cv2.resize(input_img, (240, 200), interpolation=cv2.INTER_LANCZOS4).astype(np.float32)
+    for face, inverse_affine in zip(faces, inverse_affines):
+        inverse_affine = inverse_affine.copy()
+        inverse_affine[:, 2] += 1  # 0.5 * upscale_factor
+        inv_face = cv2.warpAffine(face, inverse_affine, (240, 200)).astype(np.float32)
+        inv_mask = cv2.warpAffine(paster.square_mask(64, 64), inverse_affine, (240, 200))[:, :, None]
+        ref += inv_mask * (inv_face - ref)
+    assert np.abs(output.astype(np.float32) - ref).max() <= 1.5
+
+    # strip by strip
+    canvas = cv2.resize(input_img, (240, 200), interpolation=cv2.INTER_LANCZOS4)
+    for y0 in range(0, 200, 32):
+        paster.paste_to_region(canvas[y0:y0 + 32], (0, y0), faces, inverse_affines)
+    assert np.abs(canvas.astype(np.float32) - output.astype(np.float32)).max() <= 1
+
+    # the mask templates are cached per crop size
+    assert paster.square_mask(64, 64) is paster.square_mask(64, 64)
+
+    # alpha channel
+    bg_img = np.concatenate([cv2.resize(input_img, (240, 200)), np.full((200, 240, 1), 7, np.uint8)], axis=2)
+    output = paster.paste(input_img, faces, inverse_affines, upsample_img=bg_img)
+    assert output.shape == (200, 240, 4)
+    assert (output[:, :, 3] == 7).all()
+
+
+def test_facepaster_masks():
+    """Test the blending masks of each mask_mode."""
+    torch.manual_seed(0)
+    rng = np.random.RandomState(0)
+    faces = [rng.randint(0, 256, (512, 512, 3), dtype=np.uint8) for _ in range(3)]
+
+    for mask_mode in ('ellipse', 'square'):
+        masks = FacePaster(2, mask_mode=mask_mode).masks(faces)
+        assert len(masks) == 3
+        assert masks[0].shape == (512, 512) and masks[0].dtype == np.float32
+        assert masks[0][256, 256] > 0.99 and masks[0][0, 0] < 1e-3
+
+    # batched face parsing gives the same masks as one face at a time
+    face_parse = ParseNet(in_size=512, out_size=512, parsing_ch=19).eval()
+    masks = FacePaster(2, mask_mode='parse', face_parse=face_parse, parse_batch_size=2).masks(faces)
+    ref_masks = FacePaster(2, mask_mode='parse', face_parse=face_parse, parse_batch_size=1).masks(faces)
+    for mask, ref_mask in zip(masks, ref_masks):
+        assert mask.shape == (512, 512)
+        assert np.abs(mask - ref_mask).max() < 1e-4
+
+    # the parse masks are warped with INTER_AREA, as in facexlib
+    paster = FacePaster(1, mask_mode='parse', face_parse=face_parse)
+    canvas = np.zeros((600, 600, 3), dtype=np.uint8)
+    inverse_affine = cv2.getRotationMatrix2D((256, 256), 20, 0.7)
+    output = paster.paste(canvas, faces[:1], [inverse_affine], masks=masks[:1])
+    inv_face = cv2.warpAffine(faces[0], inverse_affine, (600, 600)).astype(np.float32)
+    inv_mask = cv2.warpAffine(masks[0], inverse_affine, (600, 600), flags=cv2.INTER_AREA)[:, :, None]
+    assert np.abs(output.astype(np.float32) - inv_mask * inv_face).max() <= 1.5
+
+    with pytest.raises(ValueError):
+        FacePaster(2, mask_mode='parse')
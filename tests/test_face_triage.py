@@ -0,0 +1,28 @@
+import cv2
+import numpy as np
+
+from gfpgan.face_triage import FaceTriage, laplacian_variance
+
+
+def test_facetriage():
+    """Test the face triage by size and sharpness."""
+    rng = np.random.RandomState(0)
+    sharp_face = rng.randint(0, 256, (64, 64, 3), dtype=np.uint8)
+    blurry_face = cv2.GaussianBlur(sharp_face, (0, 0), 3)
+    assert laplacian_variance(sharp_face) > laplacian_variance(blurry_face)
+
+    # no threshold: restore all the faces
+    assert FaceTriage()([sharp_face, blurry_face]) == [None, None]
+
+    triage = FaceTriage(min_face_size=20, max_face_size=600, sharpness_threshold=laplacian_variance(sharp_face))
+    det_faces = [
+        np.array([0, 0, 10, 12, 0.9]),  # small
+        np.array([0, 0, 700, 650, 0.9]),  # large
+        np.array([0, 0, 100, 100, 0.9]),
+        np.array([0, 0, 100, 100, 0.9]),
+    ]
+    faces = [blurry_face, blurry_face, sharp_face, blurry_face]
+    assert triage(faces, det_faces) == ['small', 'large', 'sharp', None]
+
+    # aligned faces have no box: only the sharpness is checked
+    assert triage([sharp_face, blurry_face]) == ['sharp', None]
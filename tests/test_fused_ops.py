@@ -0,0 +1,69 @@
+import pytest
+import torch
+from basicsr.archs import stylegan2_arch
+from basicsr.ops import fused_act
+from basicsr.ops.upfirdn2d.upfirdn2d import upfirdn2d_native
+from torch.nn import functional as F
+
+from gfpgan.archs.fused_ops import FusedLeakyReLU, fused_leaky_relu, upfirdn2d
+from gfpgan.archs.gfpgan_bilinear_arch import GFPGANBilinear
+from gfpgan.archs.gfpganv1_arch import GFPGANv1
+
+
+def test_fused_leaky_relu():
+    x = torch.randn(2, 4, 5, 5)
+    bias = torch.randn(4)
+    ref = F.leaky_relu(x + bias.view(1, 4, 1, 1), 0.2) * 2**0.5
+    with torch.no_grad():
+        assert torch.allclose(fused_leaky_relu(x, bias), ref, atol=1e-6)
+    # autograd, and the 2D inputs of the linear layers
+    bias.requires_grad_(True)
+    fused_leaky_relu(x, bias).sum().backward()
+    assert bias.grad.shape == (4, )
+    assert torch.allclose(fused_leaky_relu(x[:, :, 0, 0], bias), ref[:, :, 0, 0], atol=1e-6)
+
+    act = FusedLeakyReLU(4)
+    assert list(act.state_dict().keys()) == ['bias']
+
+
+@pytest.mark.parametrize('up, down, pad', [(2, 1, (2, 1)), (1, 2, (1, 1)), (1, 1, (2, 1)), (2, 1, (1, 0)),
+                                           (1, 1, (-1, 2))])
+def test_upfirdn2d(up, down, pad):
+    """Test the depthwise upfirdn2d against the native op of basicsr."""
+    x = torch.randn(2, 3, 9, 8)
+    kernel = torch.tensor([1., 3., 3., 1.])
+    kernel = kernel[None, :] * kernel[:, None]
+    kernel = kernel / kernel.sum() * up**2
+    ref = upfirdn2d_native(x, kernel, up, up, down, down, pad[0], pad[1], pad[0], pad[1])
+    out = upfirdn2d(x, kernel, up=up, down=down, pad=pad)
+    assert out.shape == ref.shape
+    assert torch.allclose(out, ref, atol=1e-5)
+
+    # asymmetric kernel, which is flipped
+    kernel = torch.rand(3, 2)
+    ref = upfirdn2d_native(x, kernel, up, up, down, down, pad[0], pad[1], pad[0], pad[1])
+    assert torch.allclose(upfirdn2d(x, kernel, up=up, down=down, pad=pad), ref, atol=1e-5)
+
+
+def test_original_and_bilinear_archs_on_cpu():
+    """Test the GFPGAN archs that use the fused ops of basicsr, without its compiled extensions."""
+    kwargs = dict(
+        out_size=32,
+        num_style_feat=256,
+        channel_multiplier=1,
+        decoder_load_path=None,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True)
+    img = torch.rand((2, 3, 32, 32), dtype=torch.float32)
+    for net in [GFPGANv1(fix_decoder=True, **kwargs), GFPGANBilinear(fix_decoder=False, **kwargs)]:
+        with torch.no_grad():
+            output = net.eval()(img, return_rgb=False)
+        assert output[0].shape == (2, 3, 32, 32)
+
+    # the layers of basicsr itself are not patched
+    assert stylegan2_arch.fused_leaky_relu is fused_act.fused_leaky_relu
+    assert stylegan2_arch.FusedLeakyReLU is fused_act.FusedLeakyReLU
+    assert type(stylegan2_arch.EqualLinear(4, 4, activation='fused_lrelu')) is stylegan2_arch.EqualLinear
@@ -1,7 +1,8 @@
 import torch
 
 from gfpgan.archs.gfpganv1_arch import FacialComponentDiscriminator, GFPGANv1, StyleGAN2GeneratorSFT
-from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean, StyleGAN2GeneratorCSFT
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean, ResBlock, StyleGAN2GeneratorCSFT
+from gfpgan.archs.stylegan2_clean_arch import ModulatedConv2d, StyleConv
 
 
 def test_stylegan2generatorsft():
@@ -201,3 +202,88 @@ def test_gfpganv1clean():
         assert output[1][0].shape == (1, 3, 8, 8)
         assert output[1][1].shape == (1, 3, 16, 16)
         assert output[1][2].shape == (1, 3, 32, 32)
+
+
+def test_gfpganv1clean_fixed_noise():
+    """Test GFPGANv1Clean with the fixed noise buffers: reproducible, and independent of the batch."""
+    torch.manual_seed(0)
+    net = GFPGANv1Clean(
+        out_size=32,
+        num_style_feat=256,
+        channel_multiplier=1,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True).eval()
+    # the noise injection is zero at init
+    for module in net.modules():
+        if isinstance(module, StyleConv):
+            module.weight.data.fill_(0.1)
+
+    img = torch.rand((2, 3, 32, 32), dtype=torch.float32)
+    with torch.no_grad():
+        output = net(img, randomize_noise=False)[0]
+        assert torch.equal(net(img, randomize_noise=False)[0], output)
+        assert torch.allclose(net(img[1:], randomize_noise=False)[0], output[1:], atol=1e-6)
+        assert not torch.equal(net(img, randomize_noise=True)[0], output)
+
+
+def test_gfpganv1clean_fused_upsample():
+    """Test GFPGANv1Clean with the fused upsampling and convolution, against the upsampled tensors."""
+    torch.manual_seed(0)
+    net = GFPGANv1Clean(
+        out_size=32,
+        num_style_feat=256,
+        channel_multiplier=1,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True).eval()
+    img = torch.rand((2, 3, 32, 32), dtype=torch.float32)
+    outputs = []
+    for fused_upsample in [False, True]:
+        for module in net.modules():
+            if isinstance(module, (ModulatedConv2d, ResBlock)):
+                module.fused_upsample = fused_upsample
+        with torch.no_grad():
+            outputs.append(net(img, randomize_noise=False)[0])
+    assert torch.allclose(outputs[0], outputs[1], atol=1e-5)
+
+
+def test_gfpganv1clean_inference():
+    """Test the inference of GFPGANv1Clean, against the forward with autograd."""
+    for sft_half, input_is_latent, different_w in [(True, True, True), (False, False, False), (True, False, True)]:
+        net = GFPGANv1Clean(
+            out_size=32,
+            num_style_feat=256,
+            channel_multiplier=1,
+            decoder_load_path=None,
+            fix_decoder=False,
+            num_mlp=8,
+            input_is_latent=input_is_latent,
+            different_w=different_w,
+            narrow=0.5,
+            sft_half=sft_half).eval()
+        img = torch.rand((2, 3, 32, 32), dtype=torch.float32)
+        torch.manual_seed(0)
+        ref = net(img, return_rgb=False)[0].detach()
+        # the noise is drawn in the same order
+        torch.manual_seed(0)
+        with torch.no_grad():
+            output, out_rgbs = net(img, return_rgb=False)
+        assert torch.equal(output, ref)
+        assert out_rgbs == []
+
+        # the stripped network gives the same restored images
+        net.strip_for_inference()
+        assert not any(key.startswith('toRGB') for key in net.state_dict())
+        assert any(key.startswith('stylegan_decoder.style_mlp') for key in net.state_dict()) != input_is_latent
+        torch.manual_seed(0)
+        with torch.no_grad():
+            assert torch.equal(net.inference(img), ref)
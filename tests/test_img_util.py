@@ -0,0 +1,79 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+from basicsr.utils import img2tensor, tensor2img
+from torchvision.transforms.functional import normalize
+
+from gfpgan.img_util import FaceTensorConverter, PngStripWriter
+
+
+def test_facetensorconverter():
+    """Test FaceTensorConverter against img2tensor / normalize / tensor2img."""
+    rng = np.random.RandomState(0)
+    faces = [rng.randint(0, 256, (64, 64, 3), dtype=np.uint8) for _ in range(3)]
+    converter = FaceTensorConverter(face_size=64)
+
+    # ------------------ uint8 BGR -> tensor ---------------- #
+    out = converter.to_tensor(faces)
+    assert out.shape == (3, 3, 64, 64)
+    assert out.dtype == torch.float32
+    for i, face in enumerate(faces):
+        face_t = img2tensor(face / 255., bgr2rgb=True, float32=True)
+        normalize(face_t, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
+        assert torch.allclose(out[i], face_t, atol=1e-6)
+
+    # float faces are cast to uint8
+    float_faces = [face + 0.75 for face in faces[:2]]
+    out = converter.to_tensor(float_faces).clone()
+    assert torch.equal(out, converter.to_tensor(faces[:2]))
+
+    # buffers are reused for smaller batches
+    buffer = converter._input_buffer
+    out = converter.to_tensor(faces[:2])
+    assert out.shape == (2, 3, 64, 64)
+    assert converter._input_buffer is buffer
+
+    # ------------------ tensor -> uint8 BGR ---------------- #
+    output = torch.rand((3, 3, 64, 64)) * 2.2 - 1.1
+    expected = [tensor2img(output[i].clone(), rgb2bgr=True, min_max=(-1, 1)) for i in range(3)]
+    imgs = converter.to_images(output.clone())
+    assert len(imgs) == 3
+    for img, ref in zip(imgs, expected):
+        assert img.shape == (64, 64, 3)
+        assert img.dtype == np.uint8
+        assert np.abs(img.astype(np.int16) - ref.astype(np.int16)).max() <= 1
+
+    # round trip
+    imgs = converter.to_images(converter.to_tensor(faces))
+    for img, face in zip(imgs, faces):
+        np.testing.assert_array_equal(img, face)
+
+
+def test_facetensorconverter_channels_last():
+    rng = np.random.RandomState(0)
+    faces = [rng.randint(0, 256, (64, 64, 3), dtype=np.uint8) for _ in range(2)]
+    out = FaceTensorConverter(face_size=64, channels_last=True).to_tensor(faces)
+    assert out.shape == (2, 3, 64, 64)
+    assert out.is_contiguous(memory_format=torch.channels_last)
+    torch.testing.assert_close(out, FaceTensorConverter(face_size=64).to_tensor(faces))
+
+
+def test_pngstripwriter(tmp_path):
+    """Test writing a PNG file strip by strip."""
+    rng = np.random.RandomState(0)
+    for channels, dtype in [(3, np.uint8), (4, np.uint8), (3, np.uint16)]:
+        img = rng.randint(0, np.iinfo(dtype).max + 1, (50, 37, channels)).astype(dtype)
+        path = str(tmp_path / f'{channels}_{img.dtype}.png')
+        with PngStripWriter(path, 37, 50, channels=channels, bit_depth=img.dtype.itemsize * 8) as writer:
+            for y0 in range(0, 50, 16):
+                writer.write(img[y0:y0 + 16])
+        output = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        assert output.dtype == img.dtype
+        np.testing.assert_array_equal(output, img)
+
+    # missing rows
+    writer = PngStripWriter(str(tmp_path / 'missing.png'), 37, 50)
+    writer.write(np.zeros((10, 37, 3), np.uint8))
+    with pytest.raises(ValueError):
+        writer.close()
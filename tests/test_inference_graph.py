@@ -0,0 +1,69 @@
+import copy
+import pytest
+import torch
+
+from gfpgan.archs.gfpganv1_arch import GFPGANv1
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.inference_graph import (GFPGANInference, check_equivalence, is_inference_checkpoint,
+                                    load_inference_checkpoint, optimize_gfpgan, save_inference_checkpoint)
+from gfpgan.precision import make_probe_faces
+
+
+def build_net(arch, different_w=True, sft_half=True):
+    net_cls = GFPGANv1Clean if arch == 'clean' else GFPGANv1
+    net = net_cls(
+        out_size=32,
+        num_style_feat=256,
+        channel_multiplier=1,
+        fix_decoder=arch != 'clean',
+        input_is_latent=True,
+        different_w=different_w,
+        narrow=0.5,
+        sft_half=sft_half).eval()
+    # non-zero biases, which are zeros (or ones) at initialization
+    with torch.no_grad():
+        for name, param in net.named_parameters():
+            if name.endswith('bias'):
+                param.add_(torch.randn_like(param) * 0.1)
+    return net
+
+
+def test_optimize_gfpgan(tmp_path):
+    """Test the inference graph of the clean and original archs, against the networks."""
+    torch.manual_seed(0)
+    faces = make_probe_faces(num=2, size=32)
+    for arch, different_w, sft_half in [('clean', True, True), ('clean', False, False), ('original', True, True)]:
+        net = build_net(arch, different_w, sft_half)
+        inference_net = optimize_gfpgan(copy.deepcopy(net))
+        # merged SFT branches: 3 levels, conv + LeakyReLU + grouped conv
+        assert len(inference_net.condition) == 3
+        assert inference_net.condition[0][2].groups == 2
+        assert check_equivalence(net, inference_net, faces, batch_size=2) < 1e-4
+        # the same noise draws
+        torch.manual_seed(0)
+        with torch.no_grad():
+            ref = net(faces, return_rgb=False)[0]
+        torch.manual_seed(0)
+        with torch.no_grad():
+            output, out_rgbs = inference_net(faces)
+        assert torch.allclose(output, ref, atol=1e-4)
+        assert out_rgbs == []
+
+        # save and load
+        save_path = str(tmp_path / f'gfpgan_{arch}_inference.pth')
+        save_inference_checkpoint(inference_net, save_path)
+        checkpoint = torch.load(save_path)
+        assert is_inference_checkpoint(checkpoint)
+        loaded_net = load_inference_checkpoint(build_net(arch, different_w, sft_half), checkpoint)
+        with torch.no_grad():
+            loaded_output = loaded_net(faces, randomize_noise=False)[0]
+            assert torch.equal(loaded_output, inference_net(faces, randomize_noise=False)[0])
+
+    # wrong options
+    with pytest.raises(ValueError):
+        load_inference_checkpoint(build_net('original'), dict(params_inference={}, source_arch='GFPGANv1Clean'))
+    with pytest.raises(ValueError):
+        GFPGANInference(
+            GFPGANv1Clean(out_size=32, num_style_feat=256, channel_multiplier=1, input_is_latent=False, narrow=0.5))
+    with pytest.raises(ValueError):
+        inference_net(faces, return_rgb=True)
@@ -0,0 +1,79 @@
+import glob
+import os
+import pytest
+import torch
+from torch import nn
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.jit_cache import TracedNetwork, weights_hash
+
+
+def test_tracednetwork(tmp_path):
+    """Test TracedNetwork with its on-disk cache."""
+    torch.manual_seed(0)
+    net = GFPGANv1Clean(
+        out_size=32,
+        num_style_feat=256,
+        channel_multiplier=1,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True).eval()
+    x = torch.rand((2, 3, 32, 32)) * 2 - 1
+    with torch.no_grad():
+        ref = net(x, return_rgb=False, randomize_noise=False)[0]
+
+    traced = TracedNetwork(net, str(tmp_path), face_size=32, randomize_noise=False)
+    with torch.no_grad():
+        output = traced(x)
+    assert not traced.failed
+    assert torch.allclose(output, ref, atol=1e-5)
+    assert len(glob.glob(os.path.join(tmp_path, '*.pt'))) == 1
+
+    # warm restart: load the graph from disk
+    traced = TracedNetwork(net, str(tmp_path), face_size=32, randomize_noise=False)
+    path = traced.cache_path(x)
+    mtime = os.path.getmtime(path)
+    with torch.no_grad():
+        output = traced(x)
+    assert torch.allclose(output, ref, atol=1e-5)
+    assert os.path.getmtime(path) == mtime
+
+    # another batch size and other weights have their own graphs
+    with torch.no_grad():
+        traced(x[:1])
+    old_hash = weights_hash(net)
+    with torch.no_grad():
+        net.final_conv.bias.add_(1)
+    assert weights_hash(net) != old_hash
+    assert TracedNetwork(net, str(tmp_path), face_size=32, randomize_noise=False).cache_path(x) != path
+
+
+class _Untraceable(nn.Module):
+
+    def forward(self, x, **kwargs):
+        if torch.jit.is_tracing():
+            raise RuntimeError('Cannot be traced.')
+        return x, None
+
+
+def test_tracednetwork_fallback(tmp_path):
+    net = _Untraceable()
+    traced = TracedNetwork(net, str(tmp_path), face_size=8)
+    x = torch.zeros((1, 3, 8, 8))
+    assert torch.equal(traced(x), x)
+    assert traced.failed
+
+
+class _OutOfMemory(nn.Module):
+
+    def forward(self, x, **kwargs):
+        raise RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB')
+
+
+def test_tracednetwork_oom(tmp_path):
+    """Test that an out-of-memory error is raised, without falling back to the eager network."""
+    traced = TracedNetwork(_OutOfMemory(), str(tmp_path), face_size=8)
+    with pytest.raises(RuntimeError, match='out of memory'):
+        traced(torch.zeros((2, 3, 8, 8)))
+    assert not traced.failed
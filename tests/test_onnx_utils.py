@@ -0,0 +1,61 @@
+import pytest
+import torch
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.archs.restoreformer_arch import RestoreFormer
+from gfpgan.onnx_utils import OnnxRuntimeNetwork, export_onnx, onnx_cache_path
+
+
+def test_export_onnx(tmp_path):
+    """Test export_onnx and OnnxRuntimeNetwork against the PyTorch outputs."""
+    pytest.importorskip('onnxruntime')
+    torch.manual_seed(0)
+    clean = GFPGANv1Clean(
+        out_size=32,
+        num_style_feat=256,
+        channel_multiplier=1,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True)
+    restoreformer = RestoreFormer(
+        n_embed=64,
+        embed_dim=32,
+        ch=32,
+        ch_mult=(1, 2),
+        num_res_blocks=1,
+        attn_resolutions=(16, ),
+        resolution=32,
+        z_channels=32,
+        head_size=2)
+    x = torch.rand((2, 3, 32, 32)) * 2 - 1
+    for idx, net in enumerate([clean.eval(), restoreformer.eval()]):
+        onnx_path = str(tmp_path / f'net{idx}.onnx')
+        export_onnx(net, onnx_path, face_size=32)
+        with torch.no_grad():
+            ref = net(x, return_rgb=False, randomize_noise=False)[0]
+        output = OnnxRuntimeNetwork(onnx_path)(x)
+        assert output.shape == (2, 3, 32, 32)
+        assert torch.allclose(output, ref, atol=1e-4)
+
+
+def test_onnx_cache_path():
+    """Test that the default ONNX path changes with the weights and the options."""
+    torch.manual_seed(0)
+    net = GFPGANv1Clean(
+        out_size=32,
+        num_style_feat=256,
+        channel_multiplier=1,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True)
+    path = onnx_cache_path(net, 'weights/GFPGANv1.4.pth', extra_key='clean|channel_multiplier=1')
+    assert path.startswith('weights/GFPGANv1.4_') and path.endswith('.onnx')
+    assert onnx_cache_path(net, 'weights/GFPGANv1.4.pth', extra_key='clean|channel_multiplier=1') == path
+    assert onnx_cache_path(net, 'weights/GFPGANv1.4.pth', extra_key='clean|channel_multiplier=2') != path
+    assert onnx_cache_path(
+        net, 'weights/GFPGANv1.4.pth', opset_version=18, extra_key='clean|channel_multiplier=1') != path
+    with torch.no_grad():
+        net.final_conv.weight.add_(1)
+    assert onnx_cache_path(net, 'weights/GFPGANv1.4.pth', extra_key='clean|channel_multiplier=1') != path
@@ -0,0 +1,8 @@
+from gfpgan.oom import is_oom_error
+
+
+def test_is_oom_error():
+    assert is_oom_error(RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB'))
+    assert is_oom_error(RuntimeError("[enforce fail at alloc_cpu.cpp:75] DefaultCPUAllocator: can't allocate memory"))
+    assert is_oom_error(MemoryError())
+    assert not is_oom_error(RuntimeError('Expected 4-dimensional input'))
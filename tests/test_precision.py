@@ -0,0 +1,81 @@
+import pytest
+import torch
+
+from gfpgan.archs.gfpgan_bilinear_arch import GFPGANBilinear
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.archs.restoreformer_arch import RestoreFormer
+from gfpgan.precision import (cast_network, check_precision, make_probe_faces, network_input, precision_context,
+                              to_channels_last)
+
+
+def build_networks():
+    clean = GFPGANv1Clean(
+        out_size=32,
+        num_style_feat=256,
+        channel_multiplier=1,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True)
+    restoreformer = RestoreFormer(
+        n_embed=64,
+        embed_dim=32,
+        ch=32,
+        ch_mult=(1, 2),
+        num_res_blocks=1,
+        attn_resolutions=(16, ),
+        resolution=32,
+        z_channels=32,
+        head_size=2)
+    bilinear = GFPGANBilinear(
+        out_size=32,
+        num_style_feat=256,
+        channel_multiplier=1,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True)
+    return [clean.eval(), restoreformer.eval(), bilinear.eval()]
+
+
+@pytest.mark.parametrize('precision', ['bf16_autocast', 'bf16'])
+def test_check_precision(precision):
+    """Test the reduced precision forward and its PSNR check against fp32."""
+    torch.manual_seed(0)
+    inputs = make_probe_faces(num=2, size=32)
+    assert inputs.shape == (2, 3, 32, 32)
+    for net in build_networks():
+        ref_weight = next(net.parameters()).clone()
+        psnr = check_precision(net, precision, inputs)
+        assert psnr > 20
+        # the fp32 network is left untouched
+        assert next(net.parameters()).dtype == torch.float32
+        assert torch.equal(next(net.parameters()), ref_weight)
+
+        net = cast_network(net, precision)
+        with torch.no_grad(), precision_context(precision, 'cpu'):
+            output = net(network_input(inputs, precision), return_rgb=False)[0]
+        assert output.shape == (2, 3, 32, 32)
+
+
+def test_check_precision_fp32():
+    net = build_networks()[0]
+    assert check_precision(net, 'fp32', make_probe_faces(num=1, size=32)) == float('inf')
+    with pytest.raises(ValueError):
+        cast_network(net, 'fp16')
+
+
+def test_to_channels_last():
+    """Test that the forward stays in channels_last and matches the NCHW forward."""
+    torch.manual_seed(0)
+    inputs = make_probe_faces(num=1, size=32)
+    for net in build_networks():
+        with torch.no_grad():
+            ref = net(inputs, return_rgb=False, randomize_noise=False)[0]
+            net = to_channels_last(net)
+            output = net(
+                inputs.contiguous(memory_format=torch.channels_last), return_rgb=False, randomize_noise=False)[0]
+        assert output.is_contiguous(memory_format=torch.channels_last)
+        assert torch.allclose(output, ref, atol=1e-4)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import time
+
+from gfpgan import profiling
+from gfpgan.profiling import StageProfiler
+
+
+def test_stageprofiler():
+    """Test recording the stages of an enhance call."""
+    calls = []
+    profiler = StageProfiler(sink=calls.append)
+    profiler.start()
+    with profiler.stage('detect'):
+        time.sleep(0.01)
+    for idx in range(2):
+        with profiler.stage('restore', faces=[idx]):
+            bytearray(1024)
+    profiler.finish()
+
+    assert [record['stage'] for record in profiler.records] == ['detect', 'restore', 'restore']
+    assert profiler.records[0]['wall_time'] >= 0.01
+    assert profiler.records[2]['faces'] == [1]
+    assert all(record['cpu_time'] >= 0 for record in profiler.records)
+    # the sink gets the records of each call
+    assert calls == [profiler.records]
+
+    summary = profiler.summary()
+    assert list(summary) == ['detect', 'restore']
+    assert summary['restore']['count'] == 2
+
+    # a new call starts new records
+    profiler.start()
+    assert profiler.records == []
+
+
+@pytest.mark.skipif(profiling._rss() is None, reason='the resident memory is not available')
+def test_stageprofiler_peak_memory():
+    """Test that the peak memory of a cpu stage is measured in each call, not only when the process peak grows."""
+    profiler = StageProfiler()
+    for _ in range(2):
+        profiler.start()
+        with profiler.stage('allocate'):
+            buffer = np.ones(64 * 1024 * 1024, dtype=np.uint8)
+            time.sleep(0.05)
+            del buffer
+        with profiler.stage('sleep'):
+            time.sleep(0.01)
+        assert profiler.records[0]['peak_memory'] >= 48 * 1024 * 1024
+        assert profiler.records[1]['peak_memory'] < 16 * 1024 * 1024
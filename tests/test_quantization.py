@@ -0,0 +1,45 @@
+import copy
+import torch
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.precision import make_probe_faces
+from gfpgan.quantization import (count_quantized_modules, is_quantized_checkpoint, load_quantized_checkpoint,
+                                 quantize_gfpgan_clean, save_quantized_checkpoint)
+
+
+def test_quantize_gfpgan_clean(tmp_path):
+    """Test the int8 post-training quantization of GFPGANv1Clean."""
+    torch.manual_seed(0)
+    net = GFPGANv1Clean(
+        out_size=32,
+        num_style_feat=256,
+        channel_multiplier=1,
+        fix_decoder=False,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True).eval()
+    faces = make_probe_faces(num=4, size=32)
+    with torch.no_grad():
+        ref = net(faces, return_rgb=False, randomize_noise=False)[0]
+
+    quant_net = quantize_gfpgan_clean(copy.deepcopy(net), faces)
+    counts = count_quantized_modules(quant_net)
+    # U-Net: 1 + 3 * 3 (down) + 1 + 3 * 3 (up), SFT branches: 2 * 3 * 2
+    assert counts['Conv2d'] == 20 + 12
+    # final_linear + the modulations of 7 style convs and 4 to_rgbs
+    assert counts['Linear'] == 1 + 11
+    with torch.no_grad():
+        output = quant_net(faces, return_rgb=False, randomize_noise=False)[0]
+    assert output.shape == (4, 3, 32, 32)
+    assert (output - ref).abs().mean() < 0.05
+
+    # save and load
+    save_path = str(tmp_path / 'gfpgan_int8.pth')
+    save_quantized_checkpoint(quant_net, save_path)
+    checkpoint = torch.load(save_path)
+    assert is_quantized_checkpoint(checkpoint)
+    loaded_net = load_quantized_checkpoint(copy.deepcopy(net), checkpoint)
+    with torch.no_grad():
+        loaded_output = loaded_net(faces, return_rgb=False, randomize_noise=False)[0]
+    assert torch.equal(loaded_output, output)
@@ -0,0 +1,50 @@
+import torch
+from torch.nn import functional as F
+
+from gfpgan.archs.restoreformer_arch import MultiHeadAttnBlock, VectorQuantizer
+
+
+def test_vectorquantizer():
+    """Test the inference of VectorQuantizer (chunked argmin), against the training path."""
+    torch.manual_seed(0)
+    quantizer = VectorQuantizer(64, 8, beta=0.25)
+    z = torch.randn(2, 8, 16, 16) * 0.05
+
+    z_q_train, loss, (perplexity, min_encodings, indices_train, d) = quantizer.train()(z)
+    assert z_q_train.shape == (2, 8, 16, 16)
+    assert loss is not None and perplexity is not None
+    assert min_encodings.shape == (512, 64)
+    assert d.shape == (512, 64)
+
+    with torch.no_grad():
+        z_q, loss, (perplexity, min_encodings, indices, d) = quantizer.eval()(z)
+    assert loss is None and perplexity is None and min_encodings is None and d is None
+    assert torch.equal(indices, indices_train)
+    assert torch.allclose(z_q, z_q_train, atol=1e-6)
+
+    # the chunks of distances give the same indices
+    z_flattened = z.permute(0, 2, 3, 1).reshape(-1, 8)
+    assert torch.equal(quantizer.nearest_indices(z_flattened, chunk_size=100), indices.squeeze(1))
+
+    # codebook entries of the indices
+    entries = quantizer.get_codebook_entry(indices.squeeze(1), (2, 16, 16, 8))
+    assert torch.equal(entries, z_q)
+
+
+def test_multiheadattnblock():
+    """Test MultiHeadAttnBlock against the attention with the explicit (hw, hw) matrices of the heads."""
+    torch.manual_seed(0)
+    block = MultiHeadAttnBlock(64, head_size=4).eval()
+    x = torch.randn(2, 64, 8, 8)
+    y = torch.randn(2, 64, 8, 8)
+    for cross in [False, True]:
+        h_ = block.norm1(x)
+        y_ = block.norm2(y) if cross else h_
+        q, k, v = [t.reshape(2, 4, 16, 64) for t in (block.q(y_), block.k(h_), block.v(h_))]
+        attn = F.softmax(torch.matmul(q.transpose(2, 3), k) / 16**0.5, dim=3)  # (b, head, hw, hw)
+        ref = x + block.proj_out(torch.matmul(v, attn.transpose(2, 3)).reshape(2, 64, 8, 8))
+        with torch.no_grad():
+            output = block(x, y if cross else None)
+            output_cl = block(x.contiguous(memory_format=torch.channels_last), y if cross else None)
+        assert torch.allclose(output, ref, atol=1e-5)
+        assert torch.allclose(output_cl, ref, atol=1e-5)
@@ -0,0 +1,37 @@
+import numpy as np
+
+from gfpgan.stage_cache import LRUCache, StageCache, content_hash
+
+
+def test_lrucache():
+    """Test the size-bounded LRU cache."""
+    cache = LRUCache(max_bytes=300)
+    a, b, c = (np.full(100, i, dtype=np.uint8) for i in range(3))
+    cache.put('a', a)
+    cache.put('b', b)
+    cache.put('c', c)
+    assert len(cache) == 3 and cache.nbytes == 300
+    assert cache.get('a') is a  # 'a' becomes the most recently used
+    cache.put('d', np.zeros(100, dtype=np.uint8))
+    assert cache.get('b') is None  # evicted
+    assert cache.get('a') is a and cache.get('c') is c
+    assert cache.nbytes == 300
+    assert cache.hits == 3 and cache.misses == 1
+    # too large to be cached
+    cache.put('e', np.zeros(400, dtype=np.uint8))
+    assert cache.get('e') is None and len(cache) == 3
+
+
+def test_content_hash():
+    """Test the content hash of the stage keys."""
+    img = np.random.randint(0, 256, (16, 16, 3), dtype=np.uint8)
+    assert content_hash(img, 2) == content_hash(img.copy(), 2)
+    assert content_hash(img, 2) != content_hash(img, 4)
+    assert content_hash(img) != content_hash(img.reshape(16, 48))
+    assert content_hash(img[:, ::-1]) == content_hash(np.ascontiguousarray(img[:, ::-1]))
+
+    stage_cache = StageCache()
+    stage_cache.faces.put('face', img)
+    assert stage_cache.stats()['faces'] == dict(hits=0, misses=0, nbytes=img.nbytes)
+    stage_cache.clear()
+    assert stage_cache.faces.get('face') is None
@@ -1,6 +1,8 @@
 import torch
+from torch.nn import functional as F
 
-from gfpgan.archs.stylegan2_clean_arch import StyleGAN2GeneratorClean
+from gfpgan.archs.stylegan2_clean_arch import (ModulatedConv2d, StyleGAN2GeneratorClean, upsample_conv2d,
+                                               use_fused_upsample)
 
 
 def test_stylegan2generatorclean():
@@ -50,3 +52,65 @@ def test_stylegan2generatorclean():
         # ------------------ test mean_latent ----------------------- #
         out = net.mean_latent(2)
         assert out.shape == (1, 512)
+
+
+def test_fused_modulation():
+    """Test the fused modulation of ModulatedConv2d against the weight modulation (grouped conv)."""
+    torch.manual_seed(0)
+    x = torch.randn(4, 32, 8, 8)
+    style = torch.randn(4, 64)
+    for sample_mode in [None, 'upsample']:
+        for demodulate in [True, False]:
+            conv = ModulatedConv2d(32, 16, 3, 64, demodulate=demodulate, sample_mode=sample_mode)
+            assert conv.use_fused_modulation(4, 8, 8)  # a large weight against the features
+            assert not conv.use_fused_modulation(1, 8, 8)
+            assert not conv.use_fused_modulation(4, 64, 64)
+            with torch.no_grad():
+                conv.fused_modulation = False
+                ref = conv(x, style)
+                conv.fused_modulation = True
+                out = conv(x, style)
+            assert out.shape == ref.shape
+            assert torch.allclose(out, ref, atol=1e-5)
+
+    # a batch of the generator matches its samples
+    net = StyleGAN2GeneratorClean(out_size=32, num_style_feat=64, num_mlp=2, channel_multiplier=1, narrow=0.5).eval()
+    styles = torch.randn(3, 64)
+    with torch.no_grad():
+        output = net([styles], randomize_noise=False)[0]
+        for i in range(3):
+            assert torch.allclose(net([styles[i:i + 1]], randomize_noise=False)[0], output[i:i + 1], atol=1e-5)
+
+
+def test_upsample_conv2d():
+    """Test the fused bilinear upsampling and convolution against the upsampled tensor."""
+    torch.manual_seed(0)
+    x = torch.randn(2, 6, 5, 7)
+    weight = torch.randn(4, 6, 3, 3)
+    bias = torch.randn(4)
+    ref = F.conv2d(F.interpolate(x, scale_factor=2, mode='bilinear', align_corners=False), weight, bias, padding=1)
+    out = upsample_conv2d(x, weight, bias)
+    assert out.shape == (2, 4, 10, 14)
+    assert torch.allclose(out, ref, atol=1e-5)
+    # grouped
+    weight = torch.randn(8, 3, 3, 3)
+    ref = F.conv2d(F.interpolate(x, scale_factor=2, mode='bilinear', align_corners=False), weight, padding=1, groups=2)
+    assert torch.allclose(upsample_conv2d(x, weight, groups=2), ref, atol=1e-5)
+
+    # in the modulated convolutions, with the weight and the fused modulation
+    x = torch.randn(3, 16, 6, 6)
+    style = torch.randn(3, 64)
+    conv = ModulatedConv2d(16, 8, 3, 64, sample_mode='upsample').eval()
+    # by default, in eval mode only, when the upsampled tensor is larger than the phase weight
+    assert use_fused_upsample(conv, 3 * 6 * 6, 8)
+    assert not use_fused_upsample(conv, 2 * 2 * 2, 8)
+    assert not use_fused_upsample(conv.train(), 3 * 6 * 6, 8)
+    conv.eval()
+    for fused_modulation in [False, True]:
+        conv.fused_modulation = fused_modulation
+        with torch.no_grad():
+            conv.fused_upsample = False
+            ref = conv(x, style)
+            conv.fused_upsample = True
+            out = conv(x, style)
+        assert torch.allclose(out, ref, atol=1e-5)
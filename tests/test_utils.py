@@ -1,12 +1,14 @@
 import cv2
+import pytest
 from facexlib.utils.face_restoration_helper import FaceRestoreHelper
 
 from gfpgan.archs.gfpganv1_arch import GFPGANv1
 from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.profiling import StageProfiler
 from gfpgan.utils import GFPGANer
 
 
-def test_gfpganer():
+def test_gfpganer(tmp_path):
     # initialize with the clean model
     restorer = GFPGANer(
         model_path='experiments/pretrained_models/GFPGANCleanv1-NoCE-C2.pth',
@@ -36,6 +38,77 @@ def test_gfpganer():
     assert result[1][0].shape == (512, 512, 3)
     assert result[2].shape == (1024, 1024, 3)
 
+    # detect on a downscaled copy, align on the input
+    ref = restorer.enhance(img, has_aligned=False, paste_back=False)
+    ref_landmarks = restorer.face_helper.all_landmarks_5
+    result = restorer.enhance(img, has_aligned=False, paste_back=True, det_max_side=256)
+    assert len(result[0]) == len(ref[0])
+    assert result[2].shape == (1024, 1024, 3)
+    for landmark, ref_landmark in zip(restorer.face_helper.all_landmarks_5, ref_landmarks):
+        assert abs(landmark - ref_landmark).max() < 8
+
+    # write the output strip by strip
+    ref = restorer.enhance(img, has_aligned=False, paste_back=True)[2]
+    assert restorer.enhance_to_file(img, str(tmp_path / 'output.png'), strip_height=100) == (1024, 1024)
+    output = cv2.imread(str(tmp_path / 'output.png'), cv2.IMREAD_UNCHANGED)
+    assert output.shape == ref.shape
+    assert abs(output.astype('float32') - ref.astype('float32')).mean() < 1
+
+    # aligned faces only, without the face helper
+    aligned_restorer = GFPGANer(
+        model_path='experiments/pretrained_models/GFPGANCleanv1-NoCE-C2.pth',
+        upscale=1,
+        arch='clean',
+        channel_multiplier=2,
+        aligned_only=True)
+    assert aligned_restorer.face_helper is None
+    assert aligned_restorer.restore_faces([result[0][0]])[0].shape == (512, 512, 3)
+    with pytest.raises(ValueError):
+        aligned_restorer.enhance(img)
+
+    # record the stages
+    restorer.profiler = StageProfiler()
+    restorer.enhance(img, has_aligned=False, paste_back=True)
+    stages = [record['stage'] for record in restorer.profiler.records]
+    assert stages == ['read', 'detect', 'align', 'restore', 'inverse_affine', 'paste']
+    restorer.profiler = None
+
+    # retry the background upsampling with smaller tiles after out-of-memory errors
+    class TiledUpsampler():
+
+        def __init__(self):
+            self.tile_size = 400
+            self.tile_sizes = []
+
+        def enhance(self, img, outscale):
+            self.tile_sizes.append(self.tile_size)
+            if self.tile_size > 100:
+                raise RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB')
+            return cv2.resize(img, None, fx=outscale, fy=outscale), None
+
+    restorer.bg_upsampler = TiledUpsampler()
+    result = restorer.enhance(img, has_aligned=False, paste_back=True)
+    assert result[2].shape == (1024, 1024, 3)
+    assert restorer.bg_upsampler.tile_sizes == [400, 200, 100]
+    assert restorer.bg_upsampler.tile_size == 400  # restored
+    assert [downgrade['tile_size'] for downgrade in restorer.downgrades] == [200, 100]
+    restorer.bg_upsampler = None
+
+    # the sink gets the records of a failed call
+    class FailingUpsampler():
+
+        def enhance(self, img, outscale):
+            raise ValueError('Unsupported image')
+
+    calls = []
+    restorer.profiler = StageProfiler(sink=calls.append)
+    restorer.bg_upsampler = FailingUpsampler()
+    with pytest.raises(ValueError):
+        restorer.enhance(img, has_aligned=False, paste_back=True)
+    assert [record['stage'] for record in calls[0]] == ['read', 'detect', 'align', 'restore', 'bg_upsample']
+    restorer.profiler = None
+    restorer.bg_upsampler = None
+
     # with has_aligned=True
     result = restorer.enhance(img, has_aligned=True, paste_back=False)
     assert result[0][0].shape == (512, 512, 3)